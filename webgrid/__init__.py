@@ -1,9 +1,15 @@
 from __future__ import absolute_import
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import datetime as dt
+import hashlib
 import inspect
+from itertools import islice
 import json
 import re
 import sys
+import threading
+import timeit
 import six
 import warnings
 
@@ -15,12 +21,19 @@ from blazeutils.strings import case_cw2us, randchars
 from blazeutils.spreadsheets import xlsxwriter
 from formencode import Invalid
 import formencode.validators as fev
+from sqlalchemy import exc as sa_exc, inspect as sa_inspect
+from sqlalchemy.ext.compiler import compiles
 import sqlalchemy.sql as sasql
+from sqlalchemy.sql.util import find_tables
+from sqlalchemy.util import lightweight_named_tuple
 from webhelpers2.html.tags import link_to
 from werkzeug.datastructures import MultiDict
 
+from .cache import query_stats
 from .extensions import gettext as _
+from .filters import FullTextFilter, OptionsFilterBase
 from .renderers import HTML, XLS, XLSX
+from .utils import decode_cursor, encode_cursor
 
 # conditional imports to support libs without requiring them
 try:
@@ -37,6 +50,12 @@ except ImportError:
 sum_ = sasql.functions.sum
 avg_ = sasql.func.avg
 
+# guards creating each grid class's prefetch thread pool
+_prefetch_pool_lock = threading.Lock()
+
+# Column classes' __init__ argument names, for Column.new_instance()
+_column_init_args = {}
+
 
 class _None(object):
     """
@@ -58,6 +77,72 @@ class DuplicateQueryNameError(TypeError):
     pass
 
 
+class QueryBudgetExceeded(Exception):
+    """ raised when the database cancels a grid query for running past its query_budgets time """
+
+    def __init__(self, phase, seconds):
+        super(QueryBudgetExceeded, self).__init__(
+            'the {0} query ran over its budget of {1}s'.format(phase, seconds)
+        )
+        self.phase = phase
+        self.seconds = seconds
+
+
+class _Explain(sasql.expression.Executable, sasql.expression.ClauseElement):
+    """
+        EXPLAIN of a statement. It executes like any statement, so its parameters go through
+        their types' bind processing.
+    """
+
+    def __init__(self, statement, options=None):
+        self.statement = statement
+        self.options = options
+
+
+@compiles(_Explain)
+def _compile_explain(element, compiler, **kwargs):
+    options = ' ({0})'.format(element.options) if element.options else ''
+    return 'EXPLAIN{0} {1}'.format(options, compiler.process(element.statement, **kwargs))
+
+
+def _result_row(labels, values):
+    """ Build a row shaped like the keyed tuples SQLAlchemy query results return """
+    return lightweight_named_tuple('result', labels)(values)
+
+
+def _row_type(labels):
+    """
+        Row class for row_mode records. Positions are looked up by key once per query instead
+        of once per cell.
+    """
+    row_type = lightweight_named_tuple('result', labels)
+    # the first column with a label wins, as with attribute access
+    row_type._row_positions = dict(
+        (label, idx) for idx, label in reversed(list(enumerate(labels)))
+    )
+    return row_type
+
+
+def _row_labels(query, statement):
+    """
+        Labels for the values of the rows Core returns for a query of columns. A column the
+        query lists more than once is selected once, at its first position.
+    """
+    # Core dedupes the selected columns by hash, see Select._columns_plus_names
+    hashes = []
+    for column in statement.inner_columns:
+        if hash(column) not in hashes:
+            hashes.append(hash(column))
+    labels = [None] * len(hashes)
+    for desc in query.column_descriptions:
+        expr = desc['expr']
+        clause = expr.__clause_element__() if hasattr(expr, '__clause_element__') else expr
+        idx = hashes.index(hash(clause))
+        if labels[idx] is None:
+            labels[idx] = desc['name']
+    return labels
+
+
 class _DeclarativeMeta(type):
 
     def __new__(cls, name, bases, class_dict):
@@ -101,6 +186,16 @@ class Column(object):
     xls_num_format = None
     xls_style = None
     render_in = 'html', 'xls', 'xlsx', 'csv'
+    # set when the column reads ORM entities from the record (e.g. to follow a relationship),
+    #   so a grid in row_mode keeps them in the query
+    needs_entity = False
+    # set when the column's values come from other rows (e.g. a one-to-many relationship), to
+    #   fetch them for all of the records being rendered at once with load_batch(), instead
+    #   of with a query per record. extract_data() then reads them with batch_value().
+    batch_loads = False
+    # the grid's @col_filter and @col_styler functions for this column, set by the grid
+    col_filters = ()
+    col_stylers = ()
 
     def __new__(cls, *args, **kwargs):
         col_inst = super(Column, cls).__new__(cls)
@@ -180,16 +275,23 @@ class Column(object):
         # try to be smart about which attributes should get copied to the
         # new instance by looking for attributes on the class that have the
         # same name as arguments to the classes __init__ method
-        args = (inspect.getargspec(self.__init__).args
-                if six.PY2 else inspect.getfullargspec(self.__init__).args)
-
-        for argname in args:
+        for argname in cls.init_arg_names():
             if argname != 'self' and hasattr(self, argname) and \
                     argname not in ('label', 'key', 'filter', 'can_sort'):
                 setattr(column, argname, getattr(self, argname))
 
         return column
 
+    @classmethod
+    def init_arg_names(cls):
+        # inspecting the signature is slow, so do it once per class
+        args = _column_init_args.get(cls)
+        if args is None:
+            args = _column_init_args[cls] = (inspect.getargspec(cls.__init__).args
+                                             if six.PY2 else
+                                             inspect.getfullargspec(cls.__init__).args)
+        return args
+
     def extract_and_format_data(self, record):
         """
             Extract a value from the record for this column and run it through
@@ -197,16 +299,19 @@ class Column(object):
         """
         data = self.extract_data(record)
         data = self.format_data(data)
-        for _filter, cname in self.grid._colfilters:
-            for_column = self.grid.column(cname)
-            if self.key == for_column.key:
-                data = _filter(self.grid, data)
+        for _filter in self.col_filters:
+            data = _filter(self.grid, data)
         return data
 
     def extract_data(self, record):
         """
             Locate the data for this column in the record and return it.
         """
+        # row_mode records know the position of each key
+        positions = getattr(record, '_row_positions', None)
+        if positions is not None and self.key in positions:
+            return record[positions[self.key]]
+
         # key style based on expression
         if self.expr is not None:
             try:
@@ -229,6 +334,25 @@ class Column(object):
 
         raise ExtractionError(_('key "{key}" not found in record', key=self.key))
 
+    def batch_key(self, record):
+        """
+            The key of the record's value in the dict load_batch() returns, e.g. the record's id
+        """
+        raise NotImplementedError('batch_key() must be defined on a batch_loads column')
+
+    def load_batch(self, keys):
+        """
+            Return a dict of this column's value for each of the keys. Query through
+            self.grid.related_query() so the query runs on the grid's session.
+        """
+        raise NotImplementedError('load_batch() must be defined on a batch_loads column')
+
+    def batch_value(self, record, default=None):
+        """
+            The record's value from the batch loaded for the grid's records
+        """
+        return self.grid.batch_values(self).get(self.batch_key(record), default)
+
     def format_data(self, value):
         """
             Use to adjust the value extracted from the record for this column.
@@ -515,6 +639,72 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
     subtotals = 'none'
     manager = None
     allowed_export_targets = None
+    # enables keyset (seek) paging when set to a unique, non-null SA column (usually the primary
+    #   key). The column is used as the final sort key so the order is total, and the paging
+    #   links carry a cursor so the next/previous pages do not have to OFFSET past earlier rows.
+    #   Sorting is owned by the grid in this mode, so query_prep() always receives has_sort=True.
+    keyset_key = None
+    # fetch the record count with the page records as a COUNT(*) OVER() window column, so a
+    #   paged render needs one round trip instead of two. The database must support window
+    #   functions (e.g. SQLite >= 3.25, PostgreSQL) and the query must not use DISTINCT.
+    window_count = False
+    # how record_count is determined: exact|capped|estimated
+    #   - exact: count(*) of the full query
+    #   - capped: count at most count_cap + 1 records, so we only know there are "more than
+    #     count_cap" when the limit is hit
+    #   - estimated: ask the database planner through an estimate_count_<dialect name>() method
+    #     (one is provided for PostgreSQL). Falls back to capped when the dialect has no hook or
+    #     the estimate is small enough to count.
+    count_strategy = 'exact'
+    count_cap = 10000
+    # entities (or tables) that query_prep() outer joins for display only. Counts leave such a
+    #   join out when nothing else in the query, like an active filter, refers to it. Only list
+    #   joins that can't repeat rows (e.g. many-to-one relationships).
+    count_prunable_joins = ()
+    # cache for record_count, records, and totals: a webgrid.cache.ResultCache, usually shared by
+    #   every instance of the grid class. Entries are keyed on the SQL and its parameters and
+    #   expire after cache_ttl seconds (None to keep them until evicted or invalidated).
+    result_cache = None
+    cache_ttl = 300
+    # rows fetched per round trip when iter_records() streams an unpaged query
+    stream_batch_size = 1000
+    # query_base() selects only the columns rendered in render_target, plus those needed for
+    #   sorting, filtering, and totals. Only turn on when no render or url method reads another
+    #   column's value from the record, e.g. a link to record.id with the ID column hidden.
+    column_projection = False
+    # fetch records as lightweight tuples through SA Core instead of the ORM: entities added in
+    #   query_prep() are left out of the query, and nothing goes through the session's identity
+    #   map. Grids with columns that set needs_entity are fetched through the ORM as usual.
+    row_mode = False
+    # number of threads build() uses to run the record count, records, and totals queries at
+    #   the same time, each on a session from the manager's concurrent_session_factory(). None
+    #   runs them one after another on the request's session.
+    concurrent_queries = None
+    # seconds the queries of each phase may run, e.g. {'count': 2, 'totals': 5, 'export': 60}.
+    #   Phases are the workloads of query_workload(): page, count, totals, and export. A query
+    #   over budget is cancelled through a limit_query_time_<dialect name>() hook (SQLite and
+    #   PostgreSQL are provided, other databases are not limited) and the phase falls back:
+    #   - count: record_count is estimated, see count_over_budget()
+    #   - totals: page_totals and grand_totals are None and the totals rows are not rendered
+    #   - export: export_as_response() returns export_deferred()
+    #   - page: there is nothing to show instead, so QueryBudgetExceeded is raised
+    #   The user is warned and webgrid.cache.query_stats counts the timeout.
+    query_budgets = None
+    # after the HTML renders, fetch the next page's records into result_cache on a background
+    #   thread, so a click on "next" is served from the cache. Needs a result_cache and the
+    #   manager's concurrent_session_factory(), and offset paging (not keyset_key).
+    #   prefetch_workers limits the prefetches a grid class runs at once, and pages beyond
+    #   that limit are not prefetched.
+    prefetch_next_page = False
+    prefetch_workers = 2
+    # show beside each option of the options filters how many records it would match with the
+    #   other active filters. Counts are a grouped count per filter, except on PostgreSQL where
+    #   the filters that are not active share one GROUPING SETS query. They go through
+    #   result_cache like the page's other results.
+    facet_counts_on = False
+    # adds a search box to the filters that looks for its text in every column with a
+    #   FullTextFilter. Records match when any of the columns matches.
+    search_all_on = False
 
     # Will ask for confirmation before exporting more than this many records.
     # Set to None to disable this check
@@ -529,12 +719,26 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
         self.filtered_cols = OrderedDict()
         self.subtotal_cols = OrderedDict()
         self.order_by = []
+        self.paging_cursor = None
         self.qs_prefix = qs_prefix
         self.user_warnings = []
+        # phases that ran over their query_budgets time
+        self.budgets_exceeded = set()
+        self._deferred_warnings = []
+        # future of the background prefetch started by prefetch_adjacent_page()
+        self.prefetch_future = None
+        # batch_loads column values for the records, by column
+        self._batch_values = {}
+        self._facet_counts = None
+        # text for the search_all_on box
+        self.search_value = None
         self._record_count = None
+        self._record_count_kind = 'exact'
         self._records = None
         self._page_totals = None
         self._grand_totals = None
+        self._built_queries = {}
+        self._compiled_queries = {}
         if self.hide_excel_link is True:
             warnings.warn(
                 "Hide excel link is deprecated, you should just override allowed_export_targets instead", # noqa
@@ -550,6 +754,12 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
                 self.allowed_export_targets['xlsx'] = XLSX
         self.set_renderers()
         self.export_to = None
+        self._render_target = None
+        # holds the session queries run on in concurrent_queries threads
+        self._thread_state = threading.local()
+        # sessions the concurrent queries ran on, kept so their records can still load
+        #   relationships (records only hold a weak reference to their session)
+        self._task_sessions = []
         # when session feature is enabled, key is the unique string
         #   used to distinguish grids. Initially set to a random
         #   string, but will be set to the session key in args
@@ -586,6 +796,23 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
                 )
 
         self.post_init()
+        self.resolve_column_decorators()
+
+    def resolve_column_decorators(self):
+        """
+            Give each column the @col_filter and @col_styler functions registered for its key,
+            so rendering a cell doesn't have to look for them
+        """
+        for col in self.columns:
+            col.col_filters = []
+            col.col_stylers = []
+        for registered, attr in ((self._colfilters, 'col_filters'),
+                                 (self._colstylers, 'col_stylers')):
+            for func, ident in registered:
+                key = self.column(ident).key
+                for col in self.columns:
+                    if col.key == key:
+                        getattr(col, attr).append(func)
 
     def post_init(self):
         """Provided for subclasses to run post-initialization customizations"""
@@ -601,8 +828,212 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
         # this will force the query to execute.  We used to wait to evaluate this but it ended
         # up causing AttributeErrors to be hidden when the grid was used in Jinja.
         # Calling build is now preferred over calling .apply_qs_args() and then .html()
+        self.run_queries()
         self.record_count
 
+    def run_queries(self):
+        """
+            Run the queries needed to render the page at the same time, when concurrent_queries
+            is set and the manager can make sessions for other threads. Otherwise, the queries
+            run as they are needed.
+        """
+        if not self.concurrent_queries or self.export_to:
+            return
+        tasks = self.query_tasks()
+        factory = getattr(self.manager, 'concurrent_session_factory', lambda: None)()
+        if len(tasks) < 2 or factory is None:
+            return
+        context = self.concurrent_context()
+        with ThreadPoolExecutor(max_workers=self.concurrent_queries) as executor:
+            futures = [
+                executor.submit(self._run_in_session, factory, task, context) for task in tasks
+            ]
+            for future in futures:
+                future.result()
+        self.flash_deferred_warnings()
+
+    def query_tasks(self):
+        """
+            Functions that each fetch and store one of the independent results for a page
+        """
+        def records():
+            self.records
+
+        def record_count():
+            self.record_count
+
+        def page_totals():
+            self._page_totals = self.fetch_page_totals()
+
+        def grand_totals():
+            self.grand_totals
+
+        tasks = [records]
+        # with window_count, the count comes with the records
+        if not self.window_count_on:
+            tasks.append(record_count)
+        if not self.subtotal_cols:
+            return tasks
+        if self.subtotals in ('page', 'all') and any(
+            func is not sum_ and func is not avg_
+            for func, colobj in six.itervalues(self.subtotal_cols)
+        ):
+            tasks.append(page_totals)
+        # an exact count fetches the grand totals with it
+        if self.subtotals in ('grand', 'all') \
+                and (self.window_count_on or self.count_strategy != 'exact'):
+            tasks.append(grand_totals)
+        return tasks
+
+    def concurrent_context(self):
+        """
+            Factory for the context (e.g. the web framework's application context) grid queries
+            run in on other threads, or None when the manager doesn't need one. Called on the
+            thread the grid was built on.
+        """
+        return getattr(self.manager, 'concurrent_context', lambda: None)()
+
+    def _run_in_session(self, session_factory, task, context=None):
+        if context is not None:
+            with context():
+                return self._run_in_session(session_factory, task)
+        session = session_factory()
+        self._thread_state.session = session
+        # sessions from the manager's workload routing used by the task
+        self._thread_state.routed_sessions = set()
+        sessions = self._thread_state.routed_sessions
+        try:
+            result = task()
+            # return the connection to the pool. ORM records stay attached to the session, so
+            #   relationships can still be loaded.
+            for used in [session] + list(sessions):
+                used.commit()
+            self._task_sessions.append(session)
+            return result
+        except Exception:
+            for used in [session] + list(sessions):
+                used.close()
+            raise
+        finally:
+            self._thread_state.session = None
+            self._thread_state.routed_sessions = None
+
+    def _bind_query(self, query, workload=None):
+        session = self.workload_session(workload)
+        if session is None:
+            session = getattr(self._thread_state, 'session', None)
+        if session is None:
+            return query
+        return query.with_session(session)
+
+    def query_workload(self, kind):
+        """
+            The workload (page, count, totals, or export) a query of the given kind runs as.
+            Everything an export fetches is part of the export.
+        """
+        if self.render_target != 'html':
+            return 'export'
+        return kind
+
+    def workload_session(self, kind):
+        """
+            Session the manager routes queries of this kind to (e.g. a read replica), or None to
+            use the default session
+        """
+        get_session = getattr(self.manager, 'workload_session', None)
+        if kind is None or get_session is None:
+            return None
+        session = get_session(self.query_workload(kind))
+        routed_sessions = getattr(self._thread_state, 'routed_sessions', None)
+        if session is not None and routed_sessions is not None:
+            routed_sessions.add(session)
+        return session
+
+    @contextmanager
+    def query_budget(self, kind, query):
+        """
+            Run the block, which executes query, within the query_budgets time for the phase of
+            a query of this kind. QueryBudgetExceeded is raised if it runs over.
+        """
+        phase = self.query_workload(kind)
+        seconds = (self.query_budgets or {}).get(phase)
+        limiter = None
+        if seconds is not None:
+            connection = query.session.connection()
+            limiter = getattr(self, 'limit_query_time_{0}'.format(connection.dialect.name), None)
+        if limiter is None:
+            yield
+            return
+        with limiter(connection, phase, seconds):
+            yield
+
+    @contextmanager
+    def limit_query_time_sqlite(self, connection, phase, seconds):
+        # SQLite calls the progress handler as statements run, and stops a statement when the
+        #   handler returns true
+        deadline = timeit.default_timer() + seconds
+        dbapi_connection = connection.connection
+        dbapi_connection.set_progress_handler(lambda: timeit.default_timer() > deadline, 1000)
+        try:
+            yield
+        except sa_exc.OperationalError as e:
+            if 'interrupted' in str(e.orig):
+                raise QueryBudgetExceeded(phase, seconds)
+            raise
+        finally:
+            dbapi_connection.set_progress_handler(None, 0)
+
+    @contextmanager
+    def limit_query_time_postgresql(self, connection, phase, seconds):
+        # a cancelled statement aborts the transaction, so run in a savepoint the session's
+        #   transaction can carry on from
+        savepoint = connection.begin_nested()
+        # the timeout the app set, restored after the block
+        previous = connection.execute('SHOW statement_timeout').scalar()
+        connection.execute('SET LOCAL statement_timeout = {0:d}'.format(int(seconds * 1000)))
+        failed = True
+        try:
+            yield
+            failed = False
+        except sa_exc.DBAPIError as e:
+            # query_canceled
+            if getattr(e.orig, 'pgcode', None) == '57014':
+                raise QueryBudgetExceeded(phase, seconds)
+            raise
+        finally:
+            # also when the block stops early, e.g. a consumer of iter_records() is done
+            if failed:
+                savepoint.rollback()
+            connection.execute(
+                sasql.text("SELECT set_config('statement_timeout', :previous, true)"),
+                previous=previous,
+            )
+            if not failed:
+                savepoint.commit()
+
+    def query_budget_exceeded(self, error):
+        """
+            Record that a phase ran over its budget, and warn the user
+        """
+        self.budgets_exceeded.add(error.phase)
+        query_stats.timed_out(error.phase)
+        messages = {
+            'count': _('Counting the records took too long, the count shown is approximate.'),
+            'totals': _('Totals took too long to calculate and are not shown.'),
+            'export': _('The export took too long and was stopped.'),
+        }
+        message = messages.get(error.phase, _('The records took too long to load.'))
+        self.user_warnings.append(message)
+        if getattr(self._thread_state, 'session', None) is None:
+            self.manager.flash_message('warning', message)
+        else:
+            # the request isn't available to concurrent_queries threads, flash once they finish
+            self._deferred_warnings.append(message)
+
+    def flash_deferred_warnings(self):
+        while self._deferred_warnings:
+            self.manager.flash_message('warning', self._deferred_warnings.pop(0))
+
     def column(self, ident):
         if isinstance(ident, six.string_types):
             return self.key_column_map[ident]
@@ -613,6 +1044,34 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
             if render_type in col.render_in:
                 yield col
 
+    @property
+    def render_target(self):
+        """
+            The render type (html, xls, xlsx, csv) the records are being fetched for
+        """
+        return self._render_target or self.export_to or 'html'
+
+    def set_render_target(self, render_type):
+        if render_type != self.render_target:
+            self.clear_record_cache()
+        self._render_target = render_type
+
+    def query_columns(self):
+        """
+            Columns query_base() selects for the render target
+        """
+        if not self.column_projection:
+            return list(self.columns)
+        render_type = self.render_target
+        sort_keys = [key for key, flag_desc in self.order_by]
+        return [
+            col for col in self.columns
+            if render_type in col.render_in
+            or col.key in sort_keys
+            or col.key in self.subtotal_cols
+            or (col.key in self.filtered_cols and col.filter.is_active)
+        ]
+
     def set_renderers(self):
         self.html = HTML(self)
         for key, value in self.allowed_export_targets.items():
@@ -620,6 +1079,7 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
 
     def set_filter(self, key, op, value):
         self.clear_record_cache()
+        self._grand_totals = None
         self.filtered_cols[key].filter.set(op, value)
 
     def set_sort(self, *args):
@@ -638,14 +1098,36 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
             elif not self.foreign_session_loaded:
                 self.user_warnings.append(_('''can't sort on invalid key "{key}"''', key=key))
 
-    def set_paging(self, per_page, on_page):
+        # a keyset cursor is only meaningful for the sort order it was made with
+        if self.paging_cursor is not None and \
+                self.paging_cursor['sort_keys'] != self.keyset_sort_keys():
+            self.paging_cursor = None
+
+    def set_paging(self, per_page, on_page, cursor=None):
         self.clear_record_cache()
         self.per_page = per_page
         self.on_page = on_page
+        self.set_cursor(cursor)
+
+    def set_cursor(self, cursor):
+        """
+            Set the keyset paging cursor. A cursor that was created with a different sort order
+            than the grid currently has is ignored, and paging falls back to using an offset.
+        """
+        self.clear_record_cache()
+        if cursor is not None and isinstance(cursor, six.string_types):
+            cursor = decode_cursor(cursor)
+        if cursor is not None and cursor['sort_keys'] != self.keyset_sort_keys():
+            cursor = None
+        self.paging_cursor = cursor
 
     def clear_record_cache(self):
         self._record_count = None
+        self._record_count_kind = 'exact'
         self._records = None
+        self._page_totals = None
+        self._batch_values = {}
+        self._facet_counts = None
 
     @property
     def ident(self):
@@ -655,30 +1137,407 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
 
     @property
     def has_filters(self):
+        if self.search_active:
+            return True
         for col in six.itervalues(self.filtered_cols):
             if col.filter.is_active:
                 return True
         return False
 
+    @property
+    def search_active(self):
+        return bool(self.search_all_on and self.search_value and self.search_columns())
+
+    def search_columns(self):
+        return [
+            col for col in six.itervalues(self.filtered_cols)
+            if isinstance(col.filter, FullTextFilter)
+        ]
+
+    def set_search(self, value):
+        self.clear_record_cache()
+        self._grand_totals = None
+        self.search_value = value.strip() if value else None
+
     @property
     def has_sort(self):
         return bool(self.order_by)
 
+    @property
+    def window_count_on(self):
+        # the window counts the rows the page query sees, which is everything only when there is
+        #   no keyset seek predicate
+        return bool(self.window_count and self.pager_on and self.per_page
+                    and not self.keyset_seeking)
+
     @property
     def record_count(self):
-        if self._record_count is None:
-            query = self.build_query(for_count=True)
-            self._record_count = query.count()
+        if self._record_count is None and self.window_count_on:
+            # sets the count from the window column when the page has records
+            self.records
+        if self._record_count is None and self._record_count_kind != 'unknown':
+            self._record_count = self.count_records()
         return self._record_count
 
+    @property
+    def record_count_kind(self):
+        """
+            How record_count was determined: "exact", "capped" (it is count_cap + 1 and there
+            may be more), "estimated" (by the database planner), or "unknown" (record_count is
+            None, an export's count ran over its query budget)
+        """
+        self.record_count
+        return self._record_count_kind
+
+    @property
+    def record_count_exact(self):
+        return self.record_count_kind == 'exact'
+
+    def count_records(self):
+        """
+            Count the records with the count_strategy. Returns the count and sets record_count_kind.
+        """
+        query = self.build_query(for_count=True)
+        counter = getattr(self, 'count_records_{0}'.format(self.count_strategy))
+
+        def count_query():
+            count, kind = counter(self._bind_query(query, 'count'))
+            # grand totals may have been fetched with the count, keep them together
+            return count, kind, self._grand_totals
+
+        try:
+            count, self._record_count_kind, grand_totals = self.cached_result(
+                'count_{0}'.format(self.count_strategy), query, count_query
+            )
+        except QueryBudgetExceeded as e:
+            self.query_budget_exceeded(e)
+            count, self._record_count_kind = self.count_over_budget(query)
+            grand_totals = None
+        if self._grand_totals is None:
+            self._grand_totals = grand_totals
+        return count
+
+    def count_records_exact(self, query):
+        if self.subtotals in ('grand', 'all') and self.subtotal_cols and \
+                self._grand_totals is None:
+            # the grand totals aggregate the same rows as the count, so get both in one query
+            result = self._totals_col_results(
+                page_totals_only=False, with_count=True, workload='count'
+            )
+            self._grand_totals = _result_row(list(self.subtotal_cols.keys()), result[:-1])
+            return result[-1], 'exact'
+        return self.lean_count(query), 'exact'
+
+    def count_over_budget(self, query):
+        """
+            Fallback count when counting runs over its query budget: the database planner's
+            estimate when the dialect has an estimate_count_<dialect name>() method, otherwise the
+            records up to this page, plus one more when the page is full so there is a next page.
+            An unpaged export streams its records, so its count is left unknown (None).
+        """
+        query = self._bind_query(query, 'count')
+        dialect = query.session.connection().dialect
+        estimator = getattr(self, 'estimate_count_{0}'.format(dialect.name), None)
+        estimate = estimator(query) if estimator else None
+        if estimate is not None:
+            return estimate, 'estimated'
+        if not (self.pager_on and self.per_page):
+            if self._records is None and self.render_target != 'html':
+                return None, 'unknown'
+            # the HTML shows every record, so they are fetched anyway
+            return len(self.records), 'estimated'
+        offset = (self.on_page - 1) * self.per_page if not self.keyset_key else 0
+        count = offset + len(self.records)
+        if len(self.records) == self.per_page:
+            count += 1
+        return count, 'estimated'
+
+    def count_records_capped(self, query):
+        # SELECT count(*) FROM (... LIMIT cap + 1)
+        count = self.lean_count(query, limit=self.count_cap + 1)
+        return count, 'exact' if count <= self.count_cap else 'capped'
+
+    def lean_count(self, query, limit=None):
+        """
+            Count the rows of a build_query(for_count=True) query using only its FROM and WHERE
+            clauses. Selected columns, ORDER BY, eager loads, and prunable joins are left out.
+            Counting at most limit rows still needs a subquery.
+        """
+        query = query.enable_eagerloads(False).order_by(None)
+        stmt = query.statement
+        if stmt._distinct or stmt._group_by_clause.clauses or stmt._having is not None \
+                or stmt._limit_clause is not None or stmt._offset_clause is not None:
+            # the rows depend on what is selected, so they have to be counted as they are
+            if limit is not None:
+                query = query.limit(limit)
+            with self.query_budget('count', query):
+                return query.count()
+
+        froms = self.prune_count_joins(stmt)
+        if limit is None:
+            count_stmt = sasql.select(
+                [sasql.func.count()], whereclause=stmt._whereclause, from_obj=froms
+            )
+        else:
+            rows = sasql.select(
+                [sasql.literal_column('1')], whereclause=stmt._whereclause, from_obj=froms
+            ).limit(limit)
+            count_stmt = sasql.select([sasql.func.count()]).select_from(rows.alias())
+        with self.query_budget('count', query):
+            return query.session.execute(count_stmt).scalar()
+
+    def prune_count_joins(self, stmt):
+        """
+            The statement's FROM clauses with count_prunable_joins outer joins removed where
+            nothing else refers to them
+        """
+        prunable = set(sa_inspect(item).selectable for item in self.count_prunable_joins)
+        if not prunable:
+            return stmt.froms
+
+        joins = []
+
+        def collect_joins(from_):
+            if isinstance(from_, sasql.expression.Join):
+                joins.append(from_)
+                collect_joins(from_.left)
+                collect_joins(from_.right)
+        for from_ in stmt.froms:
+            collect_joins(from_)
+
+        def referenced_elsewhere(join):
+            clauses = [stmt._whereclause] + [j.onclause for j in joins if j is not join]
+            tables = set()
+            for clause in clauses:
+                if clause is not None:
+                    tables.update(find_tables(clause, check_columns=True, include_aliases=True))
+            return join.right in tables
+
+        def prune(from_):
+            if not isinstance(from_, sasql.expression.Join):
+                return from_
+            left = prune(from_.left)
+            if from_.isouter and not from_.full and from_.right in prunable \
+                    and not referenced_elsewhere(from_):
+                return left
+            return left.join(prune(from_.right), from_.onclause, isouter=from_.isouter,
+                             full=from_.full)
+
+        return [prune(from_) for from_ in stmt.froms]
+
+    def count_records_estimated(self, query):
+        dialect = self.manager.db.engine.dialect
+        estimator = getattr(self, 'estimate_count_{0}'.format(dialect.name), None)
+        estimate = estimator(query) if estimator else None
+        # small results are cheap to count, and planner estimates are least reliable there
+        if estimate is None or estimate <= self.count_cap:
+            return self.count_records_capped(query)
+        return estimate, 'estimated'
+
+    def estimate_count_postgresql(self, query):
+        result = query.session.connection().execute(
+            _Explain(query.statement, 'FORMAT JSON')
+        ).scalar()
+        if isinstance(result, six.string_types):
+            result = json.loads(result)
+        return int(result[0]['Plan']['Plan Rows'])
+
     @property
     def records(self):
         if self._records is None:
-            query = self.build_query()
-            self._records = query.all()
+            if self.window_count_on:
+                self._records = self.records_with_window_count()
+            else:
+                query = self.page_records_query()
+                if self.pager_on and self.per_page:
+                    self._records = self.cached_result(
+                        'records', query, lambda: self.fetch_records(query)
+                    )
+                else:
+                    # unpaged (export) results can be any size, don't hold them in the cache
+                    self._records = self.fetch_records(query)
+            if self.keyset_seeking and self.paging_cursor['direction'] == 'p':
+                # previous pages are fetched in reverse order. Copy, the list may be cached.
+                self._records = self._records[::-1]
         return self._records
 
-    def _totals_col_results(self, page_totals_only):
+    def iter_records(self, batch_size=None):
+        """
+            Iterate over the records. Unpaged queries (e.g. exports) are streamed in batches of
+            batch_size rows with yield_per(), so the full result is never held in memory. The
+            records are not kept on the grid. Note that yield_per() can not be used with
+            collection eager loads in query_prep().
+        """
+        if self._records is not None or (self.pager_on and self.per_page):
+            for record in self.records:
+                yield record
+            return
+
+        query = self._bind_query(self.records_query(), 'page')
+        batch_size = batch_size or self.stream_batch_size
+        if self.row_mode_on:
+            records = self.iter_rows(query, batch_size)
+        else:
+            records = query.yield_per(batch_size)
+        with self.query_budget('page', query):
+            if not any(col.batch_loads for col in self.iter_columns(self.render_target)):
+                for record in records:
+                    yield record
+                return
+            # load the batch_loads columns one batch of streamed records at a time
+            records = iter(records)
+            batch = list(islice(records, batch_size))
+            while batch:
+                self.load_batches(batch)
+                for record in batch:
+                    yield record
+                batch = list(islice(records, batch_size))
+
+    def load_batches(self, records, render_type=None):
+        """
+            Load the values of the batch_loads columns rendered in render_type (default is the
+            render_target) for the records, replacing those loaded before
+        """
+        self._batch_values = {}
+        for col in self.iter_columns(render_type or self.render_target):
+            if col.batch_loads:
+                self._batch_values[col] = self._load_column_batch(col, records)
+
+    def _load_column_batch(self, column, records):
+        keys = set(column.batch_key(record) for record in records)
+        keys.discard(None)
+        return column.load_batch(keys) if keys else {}
+
+    def batch_values(self, column):
+        """
+            The values load_batch() returned for the column, loaded for the page's records when
+            they have not been by load_batches()
+        """
+        if column not in self._batch_values:
+            self._batch_values[column] = self._load_column_batch(column, self.records)
+        return self._batch_values[column]
+
+    def related_query(self, *args, **kwargs):
+        """
+            A query for rows related to the records (e.g. in Column.load_batch()), on the
+            session the grid's record queries run on
+        """
+        return self._bind_query(self.manager.sa_query(*args, **kwargs), 'page')
+
+    @property
+    def row_mode_on(self):
+        return self.row_mode and not any(
+            col.needs_entity for col in self.iter_columns(self.render_target)
+        )
+
+    def records_query(self):
+        """
+            The query for the records, without entities when row mode is on
+        """
+        query = self.build_query()
+        if not self.row_mode_on:
+            return query
+        descriptions = query.column_descriptions
+        exprs = [d['expr'] for d in descriptions if d['expr'] is not d['entity']]
+        if len(exprs) == len(descriptions):
+            return query
+        return query.with_entities(*exprs)
+
+    def fetch_records(self, query):
+        query = self._bind_query(query, 'page')
+        with self.query_budget('page', query):
+            if self.row_mode_on:
+                return list(self.iter_rows(query))
+            return query.all()
+
+    def iter_rows(self, query, batch_size=None):
+        """
+            Run query through SA Core, yielding row_mode records. Rows are streamed in batches
+            when batch_size is given.
+        """
+        statement = query.statement
+        if batch_size:
+            statement = statement.execution_options(stream_results=True)
+        result = query.session.execute(statement)
+        row_type = _row_type(_row_labels(query, statement))
+        try:
+            while True:
+                rows = result.fetchmany(batch_size) if batch_size else result.fetchall()
+                for row in rows:
+                    yield row_type(row)
+                if not batch_size or not rows:
+                    break
+        finally:
+            result.close()
+
+    def page_records_query(self):
+        """
+            The query the records for the page are fetched and cached with
+        """
+        query = self.records_query()
+        if self.window_count_on:
+            query = query.add_columns(sasql.func.count().over().label('_window_count'))
+        return query
+
+    def records_with_window_count(self):
+        descriptions = self.records_query().column_descriptions
+        query = self.page_records_query()
+        rows = self.cached_result('records', query, lambda: self.fetch_records(query))
+
+        if not rows:
+            if self.on_page and self.on_page > 1:
+                # the page is past the end of the records (or there are none), so the count
+                #   has to come from its own query
+                self._record_count = self.count_records()
+                if self.on_page > self.page_count:
+                    self.on_page = self.page_count
+                    return self.records_with_window_count()
+            else:
+                self._record_count = 0
+            return rows
+
+        self._record_count = rows[0][-1]
+
+        # give the records the same shape they would have had without the window column
+        if len(descriptions) == 1 and descriptions[0]['expr'] is descriptions[0]['entity']:
+            return [row[0] for row in rows]
+        if self.row_mode_on:
+            # the columns the rows were fetched with, see iter_rows()
+            row_type = _row_type(list(rows[0].keys())[:-1])
+        else:
+            row_type = lightweight_named_tuple('result', [d['name'] for d in descriptions])
+        return [row_type(row[:-1]) for row in rows]
+
+    def _record_value(self, record, key):
+        try:
+            return record[key]
+        except (TypeError, KeyError):
+            return getattr(record, key)
+
+    def _page_totals_from_records(self):
+        """
+            Sum and average page totals can be done from the records already fetched instead of
+            another query. Returns None if any subtotal needs SQL.
+        """
+        totals = []
+        for colname, (sa_aggregate_func, colobj) in six.iteritems(self.subtotal_cols):
+            if sa_aggregate_func is not sum_ and sa_aggregate_func is not avg_:
+                return None
+            try:
+                values = [self._record_value(record, colname) for record in self.records]
+            except AttributeError:
+                return None
+            # NULLs are ignored, as in SQL
+            values = [value for value in values if value is not None]
+            if not values:
+                totals.append(None)
+            elif sa_aggregate_func is avg_:
+                totals.append(sum(values) / len(values))
+            else:
+                totals.append(sum(values))
+        return _result_row(list(self.subtotal_cols.keys()), totals)
+
+    def _totals_col_results(self, page_totals_only, with_count=False, workload='totals'):
         SUB = self.build_query(for_count=(not page_totals_only)).subquery()
 
         cols = []
@@ -704,30 +1563,369 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
                 labeled_aggregate_col = sa_aggregate_func.label(colname)
             cols.append(labeled_aggregate_col)
 
-        return self.manager.sa_query(*cols).select_entity_from(SUB).first()
+        if with_count:
+            cols.append(sasql.func.count().label('_record_count'))
+
+        query = self._bind_query(self.manager.sa_query(*cols).select_entity_from(SUB), workload)
+        with self.query_budget(workload, query):
+            return query.first()
 
     @property
     def page_totals(self):
         if self._page_totals is None:
-            self._page_totals = self._totals_col_results(page_totals_only=True)
+            self._page_totals = self._page_totals_from_records()
+        if self._page_totals is None:
+            self._page_totals = self.fetch_page_totals()
         return self._page_totals
 
+    def fetch_page_totals(self):
+        """ Page totals from the database, or None when they run over their query budget """
+        if 'totals' in self.budgets_exceeded:
+            return None
+        try:
+            return self.cached_result(
+                'page_totals', self.build_query(),
+                lambda: self._totals_col_results(page_totals_only=True)
+            )
+        except QueryBudgetExceeded as e:
+            if e.phase != 'totals':
+                raise
+            self.query_budget_exceeded(e)
+
     @property
     def grand_totals(self):
-        if self._grand_totals is None:
-            self._grand_totals = self._totals_col_results(page_totals_only=False)
+        if self._grand_totals is None and 'totals' not in self.budgets_exceeded:
+            try:
+                self._grand_totals = self.cached_result(
+                    'grand_totals', self.build_query(for_count=True),
+                    lambda: self._totals_col_results(page_totals_only=False)
+                )
+            except QueryBudgetExceeded as e:
+                if e.phase != 'totals':
+                    raise
+                self.query_budget_exceeded(e)
         return self._grand_totals
 
+    def facet_columns(self):
+        return [
+            col for col in six.itervalues(self.filtered_cols)
+            if isinstance(col.filter, OptionsFilterBase)
+        ]
+
+    def facet_counts(self):
+        """
+            Count the records matching each option of the options filters, with every active
+            filter applied except the option's own. Returns {column key: {option key: count}}.
+        """
+        if self._facet_counts is not None:
+            return self._facet_counts
+        columns = self.facet_columns()
+        counts = {}
+
+        # filters that aren't active all count the rows of the same query
+        shared = [col for col in columns if not col.filter.is_active]
+        dialect = self.manager.db.engine.dialect
+        counter = getattr(self, 'facet_counts_{0}'.format(dialect.name), None)
+        if counter is not None and len(shared) > 1:
+            query = self.facet_query()
+            counts.update(self.cached_result(
+                'facets', query, lambda: counter(query, shared)
+            ))
+            columns = [col for col in columns if col not in shared]
+
+        for col in columns:
+            query = self.facet_query(exclude=col)
+            counts[col.key] = self.cached_result(
+                'facet_{0}'.format(col.key), query,
+                lambda: self.count_facet(query, col)
+            )
+        self._facet_counts = counts
+        return counts
+
+    def facet_counts_for(self, filter):
+        """
+            The option counts for a filter of the grid, or None when facet_counts_on is off
+        """
+        if not self.facet_counts_on:
+            return None
+        for col in self.facet_columns():
+            if col.filter is filter:
+                return self.facet_counts().get(col.key)
+
+    def facet_query(self, exclude=None):
+        """
+            The count query with every active filter applied except exclude's
+        """
+        active = [
+            col for col in six.itervalues(self.filtered_cols)
+            if col.filter.is_active and col is not exclude
+        ]
+        has_filters = bool(active) or self.search_active
+        query = self.query_base(True, has_filters)
+        query = self.query_prep(query, True, has_filters)
+        for col in active:
+            query = col.filter.apply(query)
+        query = self.query_search(query)
+        return query.enable_eagerloads(False).order_by(None)
+
+    def count_facet(self, query, column):
+        # SELECT facet, count(*) FROM (query) GROUP BY facet
+        sub = query.add_columns(column.filter.sa_col.label('_facet')).subquery()
+        facet_query = self._bind_query(
+            self.manager.sa_query(sub.c._facet, sasql.func.count()).group_by(sub.c._facet),
+            'count'
+        )
+        with self.query_budget('count', facet_query):
+            return dict(
+                (column.filter.option_key(value), count) for value, count in facet_query
+            )
+
+    def facet_counts_postgresql(self, query, columns):
+        # one pass over the rows groups by each facet column, GROUPING() tells which of them a
+        #   result row is for
+        labels = ['_facet{0}'.format(index) for index in range(len(columns))]
+        sub = query.add_columns(*[
+            col.filter.sa_col.label(label) for col, label in zip(columns, labels)
+        ]).subquery()
+        exprs = [sub.c[label] for label in labels]
+        facet_query = self._bind_query(
+            self.manager.sa_query(*(
+                exprs + [sasql.func.grouping(expr) for expr in exprs] + [sasql.func.count()]
+            )).group_by(sasql.func.grouping_sets(*exprs)),
+            'count'
+        )
+        counts = dict((col.key, {}) for col in columns)
+        with self.query_budget('count', facet_query):
+            for row in facet_query:
+                for index, col in enumerate(columns):
+                    if row[len(columns) + index] == 0:
+                        counts[col.key][col.filter.option_key(row[index])] = row[-1]
+        return counts
+
+    @classmethod
+    def cache_namespace(cls):
+        return '{0}.{1}'.format(cls.__module__, cls.__name__)
+
+    @classmethod
+    def invalidate_cache(cls):
+        """
+            Drop the cached results for every instance of this grid class, e.g. after the data
+            it shows has changed.
+        """
+        if cls.result_cache is not None:
+            cls.result_cache.invalidate(cls.cache_namespace())
+
+    def cache_key(self, kind, query):
+        """
+            Key for a query's results: the kind of result, the compiled SQL, and the bound
+            parameters.
+        """
+        compiled = self.compiled_statement(query)
+        params = sorted((key, repr(value)) for key, value in six.iteritems(compiled.params))
+        digest = hashlib.sha1(six.text_type(compiled).encode('utf-8'))
+        digest.update(repr(params).encode('utf-8'))
+        return '{0}:{1}'.format(kind, digest.hexdigest())
+
+    def cached_result(self, kind, query, create):
+        """
+            Return create(), going through result_cache when the grid has one.
+        """
+        if self.result_cache is None:
+            return create()
+        return self.result_cache.fetch(
+            self.cache_namespace(), self.cache_key(kind, query), create, self.cache_ttl
+        )
+
+    @classmethod
+    def prefetch_pool(cls):
+        """
+            The grid class's thread pool for prefetching, and the semaphore that bounds the
+            prefetches it runs at once
+        """
+        pool = cls.__dict__.get('_prefetch_pool')
+        if pool is None:
+            with _prefetch_pool_lock:
+                pool = cls.__dict__.get('_prefetch_pool')
+                if pool is None:
+                    pool = (
+                        ThreadPoolExecutor(max_workers=cls.prefetch_workers),
+                        threading.BoundedSemaphore(cls.prefetch_workers),
+                    )
+                    cls._prefetch_pool = pool
+        return pool
+
+    def prefetch_adjacent_page(self):
+        """
+            Start fetching the next page's records into result_cache when prefetch_next_page is
+            on. Nothing is fetched when this is the last page, the next page is already cached,
+            or the grid class has prefetch_workers prefetches running.
+        """
+        if not self.prefetch_next_page or self.result_cache is None or self.keyset_on \
+                or not (self.pager_on and self.per_page) or self.render_target != 'html':
+            return
+        if len(self.records) < self.per_page \
+                or (self.record_count_exact and self.on_page >= self.page_count):
+            return
+        factory = getattr(self.manager, 'concurrent_session_factory', lambda: None)()
+        if factory is None:
+            return
+        context = self.concurrent_context()
+        on_page = self.on_page
+        self.on_page = on_page + 1
+        try:
+            query = self.page_records_query()
+            key = self.cache_key('records', query)
+        finally:
+            self.on_page = on_page
+        namespace = self.cache_namespace()
+
+        executor, running = self.prefetch_pool()
+        if not running.acquire(False):
+            return
+
+        def prefill():
+            self.result_cache.prefill(
+                namespace, key, lambda: self.fetch_records(query), self.cache_ttl
+            )
+
+        def prefetch():
+            try:
+                self._run_in_session(factory, prefill, context)
+            finally:
+                running.release()
+        # an error is left on the future, the next page is then fetched when it is requested
+        self.prefetch_future = executor.submit(prefetch)
+
     @property
     def page_count(self):
         if self.per_page is None:
             return 1
         return max(0, self.record_count - 1) // self.per_page + 1
 
+    @property
+    def keyset_column(self):
+        # read from the class, ORM attributes are descriptors and can't be read on an instance
+        return self.__class__.keyset_key
+
+    @property
+    def keyset_on(self):
+        return self.keyset_column is not None
+
+    @property
+    def keyset_seeking(self):
+        return bool(
+            self.keyset_on and self.pager_on and self.per_page
+            and self.paging_cursor is not None
+        )
+
+    def keyset_sort_keys(self):
+        """
+            The (key, flag_desc) pairs from order_by that will actually be applied to the query,
+            with redundant keys removed.
+        """
+        sort_keys = []
+        for key, flag_desc in self.order_by:
+            if key in self.key_column_map and key not in [sk[0] for sk in sort_keys]:
+                sort_keys.append((key, flag_desc))
+        return sort_keys
+
+    def keyset_order(self):
+        """
+            List of (SA expression, flag_desc) tuples that fully order the query in keyset mode.
+            Returns None if any sorted column has no SA expression to seek on.
+        """
+        order = []
+        for key, flag_desc in self.keyset_sort_keys():
+            expr = self.key_column_map[key].expr
+            if expr is None:
+                return None
+            order.append((expr, flag_desc))
+        order.append((self.keyset_column, False))
+        return order
+
+    def keyset_cursor(self, record, direction):
+        """
+            Cursor string to seek from record to the next ('n') or previous ('p') page. Returns
+            None if a cursor can not be made for the record, in which case offset paging is used.
+        """
+        order = self.keyset_order() if self.keyset_on else None
+        if order is None:
+            return None
+        names = ['_keyset{0}'.format(idx) for idx in range(len(order))]
+        try:
+            values = [getattr(record, name) for name in names]
+        except AttributeError:
+            # records were not fetched by the keyset query (e.g. given by set_records())
+            return None
+        # NULLs don't compare, so seeking past them would skip rows
+        if any(v is None for v in values):
+            return None
+        return encode_cursor(self.keyset_sort_keys(), values, direction)
+
     def build_query(self, for_count=False):
+        """
+            The query for the records (or to count them), reused while the grid's filters, sort,
+            and paging stay the same. Times are recorded in webgrid.cache.query_stats.
+        """
+        key = (self.query_shape_key(for_count), self.query_values_key(for_count))
+        query = self._built_queries.get(key)
+        if query is None:
+            query = query_stats.timed('build', lambda: self._build_query(for_count))
+            self._built_queries[key] = query
+        else:
+            query_stats.reused('build')
+        return query
+
+    def query_shape_key(self, for_count=False):
+        """
+            Everything besides parameter values that build_query() depends on. Grids whose
+            query_base() or query_prep() change with other state (e.g. the user's permissions)
+            should add it.
+        """
+        active_filters = tuple(
+            (key, col.filter.op) for key, col in six.iteritems(self.filtered_cols)
+            if col.filter.is_active
+        ) + (self.search_active,)
+        if for_count:
+            return self.__class__, True, active_filters, self.render_target
+        direction = self.paging_cursor['direction'] if self.keyset_seeking else None
+        return (
+            self.__class__, False, active_filters, self.render_target, tuple(self.order_by),
+            bool(self.pager_on and self.per_page), direction,
+        )
+
+    def query_values_key(self, for_count=False):
+        values = [
+            col.filter.query_key() for col in six.itervalues(self.filtered_cols)
+            if col.filter.is_active
+        ]
+        if self.search_active:
+            values.append(self.search_value)
+        if not for_count and self.pager_on:
+            values.extend([self.per_page, self.on_page])
+            if self.keyset_seeking:
+                values.append(self.paging_cursor['values'])
+        return repr(values)
+
+    def compiled_statement(self, query):
+        """
+            Compile a query from build_query() for the manager's dialect, once per query
+        """
+        entry = self._compiled_queries.get(id(query))
+        if entry is not None and entry[0] is query:
+            query_stats.reused('compile')
+            return entry[1]
+        dialect = self.manager.db.engine.dialect
+        compiled = query_stats.timed('compile', lambda: query.statement.compile(dialect=dialect))
+        # hold the query so its id is not reused while the entry exists
+        self._compiled_queries[id(query)] = (query, compiled)
+        return compiled
+
+    def _build_query(self, for_count=False):
         has_filters = self.has_filters
-        query = self.query_base(self.has_sort, has_filters)
-        query = self.query_prep(query, self.has_sort or for_count, has_filters)
+        has_sort = self.has_sort or self.keyset_on
+        query = self.query_base(has_sort, has_filters)
+        query = self.query_prep(query, has_sort or for_count, has_filters)
 
         if has_filters:
             query = self.query_filters(query)
@@ -735,7 +1933,10 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
         if for_count:
             return query
 
-        query = self.query_sort(query)
+        if self.keyset_on:
+            query = self.query_keyset_sort(query)
+        else:
+            query = self.query_sort(query)
         if self.pager_on:
             query = self.query_paging(query)
 
@@ -743,10 +1944,11 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
 
     def set_records(self, records):
         self._record_count = len(records)
+        self._record_count_kind = 'exact'
         self._records = records
 
     def query_base(self, has_sort, has_filters):
-        cols = [col.expr for col in self.columns if col.expr is not None]
+        cols = [col.expr for col in self.query_columns() if col.expr is not None]
         return self.manager.sa_query(*cols)
 
     def query_prep(self, query, has_sort, has_filters):
@@ -756,14 +1958,67 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
         for col in six.itervalues(self.filtered_cols):
             if col.filter.is_active:
                 query = col.filter.apply(query)
-        return query
+        return self.query_search(query)
+
+    def query_search(self, query):
+        if not self.search_active:
+            return query
+        return query.filter(sasql.or_(*[
+            col.filter.search_clause(self.search_value) for col in self.search_columns()
+        ]))
 
     def query_paging(self, query):
+        if self.keyset_seeking and self.keyset_order() is not None:
+            return self.query_keyset_seek(query).limit(self.per_page)
         if self.on_page and self.per_page:
             offset = (self.on_page - 1) * self.per_page
             query = query.offset(offset).limit(self.per_page)
         return query
 
+    def query_keyset_seek(self, query):
+        """
+            Filter the query to the rows after (or before, when paging backwards) the seek values
+            in the cursor.
+        """
+        order = self.keyset_order()
+        values = self.paging_cursor['values']
+        backwards = self.paging_cursor['direction'] == 'p'
+        # a row is "after" the cursor when it sorts greater on an ascending column, so flip the
+        #   comparison for descending columns and again when paging backwards
+        greater = [flag_desc == backwards for expr, flag_desc in order]
+
+        if all(greater) or not any(greater):
+            # uniform direction can use a row value comparison, which the database can satisfy
+            #   directly from a composite index
+            row = sasql.tuple_(*[expr for expr, flag_desc in order])
+            seek_values = sasql.tuple_(*[
+                sasql.literal(value, expr.type) for (expr, flag_desc), value in zip(order, values)
+            ])
+            return query.filter(row > seek_values if greater[0] else row < seek_values)
+
+        clauses = []
+        for idx, (expr, flag_desc) in enumerate(order):
+            equal_parts = [
+                prev_expr == prev_value
+                for (prev_expr, prev_desc), prev_value in zip(order[:idx], values[:idx])
+            ]
+            compare = expr > values[idx] if greater[idx] else expr < values[idx]
+            clauses.append(sasql.and_(*(equal_parts + [compare])))
+        return query.filter(sasql.or_(*clauses))
+
+    def query_keyset_sort(self, query):
+        order = self.keyset_order()
+        if order is None:
+            # a sorted column can't be used for seeking, but the key still makes the order total
+            return self.query_sort(query).order_by(self.keyset_column)
+
+        backwards = self.keyset_seeking and self.paging_cursor['direction'] == 'p'
+        for idx, (expr, flag_desc) in enumerate(order):
+            query = query.order_by(expr.desc() if flag_desc != backwards else expr)
+            # select the seek values under known names so cursors can be made from the records
+            query = query.add_columns(expr.label('_keyset{0}'.format(idx)))
+        return query
+
     def query_sort(self, query):
         redundant = []
         for key, flag_desc in self.order_by:
@@ -782,7 +2037,7 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
             # any of the grid's query string args can be used to
             #   override the session behavior (except export_to)
             r = re.compile(
-                self.qs_prefix + r'(op\(.*\))'
+                self.qs_prefix + r'(op\(.*\)|search$)'
             )
             return any(r.match(a) for a in args.keys())
 
@@ -794,7 +2049,7 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
 
         def args_have_page(args):
             r = re.compile(
-                self.qs_prefix + '(onpage|perpage)'
+                self.qs_prefix + '(onpage|perpage|cursor)'
             )
             return any(r.match(a) for a in args.keys())
 
@@ -822,6 +2077,7 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
                 if args_have_page(args):
                     session_args['onpage'] = args.get('onpage')
                     session_args['perpage'] = args.get('perpage')
+                    session_args['cursor'] = args.get('cursor')
                 # override sorting if it exists in the query
                 if args_have_sort(args):
                     session_args['sort1'] = args.get('sort1')
@@ -870,6 +2126,10 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
                     invalid_msg = filter.format_invalid(e, col)
                     self.user_warnings.append(invalid_msg)
 
+        search_qsk = self.prefix_qs_arg_key('search')
+        if self.search_all_on and search_qsk in args:
+            self.set_search(args[search_qsk])
+
         # paging
         pp_qsk = self.prefix_qs_arg_key('perpage')
         if pp_qsk in args:
@@ -883,7 +2143,10 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
             on_page = self.apply_validator(fev.Int, args[op_qsk], op_qsk)
             if on_page is None or on_page < 1:
                 on_page = 1
-            if on_page > self.page_count:
+            # the window count is only known once the page is fetched, so an on_page that is
+            #   too high gets corrected then
+            if not self.window_count_on and on_page > self.page_count \
+                    and self.record_count_exact:
                 on_page = self.page_count
             self.on_page = on_page
 
@@ -897,6 +2160,15 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
         if sort_qs_values:
             self.set_sort(*sort_qs_values)
 
+        # keyset paging cursor (must come after sorting, a cursor only applies to its sort order)
+        cursor_qsk = self.prefix_qs_arg_key('cursor')
+        if self.keyset_on and args.get(cursor_qsk):
+            try:
+                self.set_cursor(args[cursor_qsk])
+            except ValueError:
+                invalid_msg = _('"{arg}" grid argument invalid, ignoring', arg=cursor_qsk)
+                self.user_warnings.append(invalid_msg)
+
         # handle other file formats
         export_qsk = self.prefix_qs_arg_key('export_to')
         self.set_export_to(args.get(export_qsk, None))
@@ -924,9 +2196,27 @@ class BaseGrid(six.with_metaclass(_DeclarativeMeta, object)):
         if not self.export_to:
             raise ValueError('No export format set')
         exporter = getattr(self, self.export_to)
-        if self.export_to in ['xls', 'xlsx']:
-            return exporter.as_response(wb, sheet_name)
-        return exporter.as_response()
+        per_page, on_page, cursor = self.per_page, self.on_page, self.paging_cursor
+        try:
+            if self.export_to in ['xls', 'xlsx']:
+                return exporter.as_response(wb, sheet_name)
+            return exporter.as_response()
+        except QueryBudgetExceeded as e:
+            if e.phase != 'export':
+                raise
+            self.query_budget_exceeded(e)
+            self.set_paging(per_page, on_page)
+            self.paging_cursor = cursor
+            return self.export_deferred(e)
+
+    def export_deferred(self, error):
+        """
+            Called when an export runs over its query budget. Override to queue the export to
+            run in the background and return a response for the request. By default, the grid
+            is set back to render its HTML page with the warning, and None is returned.
+        """
+        self.export_to = None
+        self.set_render_target(None)
 
     def get_session_store(self, args, session_override=False):
         # check args for a session key. If the key is present,
@@ -0,0 +1,198 @@
+"""
+    Grids for asyncio (e.g. ASGI) applications.
+
+    SQLAlchemy sessions are synchronous, so AsyncBaseGrid runs its queries on the manager's
+    thread pool, each on a session of its own, and the event loop is never blocked. Once
+    `await grid.build()` returns, the records, count, and totals are fetched and the renderers
+    use them without going back to the database.
+"""
+from __future__ import absolute_import
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import functools
+from os import path
+
+from blazeutils.datastructures import BlankObject
+import jinja2 as jinja
+from sqlalchemy.orm import Query, scoped_session, sessionmaker
+from werkzeug.datastructures import MultiDict
+
+from webgrid import BaseGrid
+
+_request_state = contextvars.ContextVar('webgrid_request_state')
+
+
+class AsyncWebGrid(object):
+    """
+        Grid manager for asyncio applications, the counterpart to webgrid.flask.WebGrid.
+
+        Call bind_request() at the start of handling each request (usually from framework
+        middleware) with a werkzeug-style request object. Messages from flash_message() are
+        collected on the request state for the application to display.
+    """
+    jinja_loader = jinja.PackageLoader('webgrid', 'templates')
+    static_url_prefix = '/static/webgrid'
+
+    def __init__(self, engine=None, max_workers=None, workload_binds=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.workload_binds = dict(workload_binds or {})
+        self._workload_sessions = {}
+        self.jinja_environment = jinja.Environment(
+            loader=self.jinja_loader,
+            autoescape=True
+        )
+        self.init_engine(engine)
+
+    def init_engine(self, engine):
+        # grids read the dialect from manager.db.engine
+        self.db = BlankObject(engine=engine)
+        self.session_factory = None
+        if engine is not None:
+            self.session_factory = sessionmaker(bind=engine, expire_on_commit=False)
+
+    def concurrent_session_factory(self):
+        return self.session_factory
+
+    def workload_session(self, workload):
+        """
+            Session for grid queries of a workload ('page', 'count', 'totals', or 'export') on
+            the engine workload_binds maps it to, or None to use the primary engine. Sessions
+            belong to the pool thread, and grids commit them when their task is done.
+        """
+        engine = self.workload_binds.get(workload)
+        if engine is None:
+            return None
+        if engine not in self._workload_sessions:
+            self._workload_sessions.setdefault(
+                engine, scoped_session(sessionmaker(bind=engine, expire_on_commit=False))
+            )
+        return self._workload_sessions[engine]()
+
+    def sa_query(self, *args, **kwargs):
+        # queries are given a session on the thread that runs them
+        return Query(args, **kwargs)
+
+    async def run_sync(self, func, *args, **kwargs):
+        """
+            Run func on the thread pool, in the current request's context
+        """
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, func, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    def bind_request(self, request, args=None, session=None):
+        """
+            Set the request grids in the current context use. The query string args default to
+            request.args, and session is the dict-like store for grids with session_on.
+        """
+        state = BlankObject(
+            request=request,
+            args=MultiDict(request.args if args is None else args),
+            session=session if session is not None else {},
+            messages=[],
+        )
+        _request_state.set(state)
+        return state
+
+    def request_state(self):
+        try:
+            return _request_state.get()
+        except LookupError:
+            raise RuntimeError('no request is bound, call bind_request() first')
+
+    def request(self):
+        return self.request_state().request
+
+    def request_args(self):
+        return self.request_state().args
+
+    def web_session(self):
+        return self.request_state().session
+
+    def flash_message(self, category, message):
+        self.request_state().messages.append((category, message))
+
+    def static_path(self):
+        return path.join(path.dirname(__file__), 'static')
+
+    def static_url(self, url_tail):
+        return '{0}/{1}'.format(self.static_url_prefix, url_tail)
+
+    def options_url(self, grid, column_key):
+        # no options endpoint, so searchable filters can only show their selected options
+        return None
+
+    def file_as_response(self, data_stream, file_name, mime_type):
+        """
+            Exported files are returned as a (stream, headers) pair for the application to turn
+            into its framework's response
+        """
+        headers = [
+            ('Content-Type', mime_type),
+            ('Content-Disposition', 'attachment; filename={0}'.format(file_name)),
+        ]
+        return data_stream, headers
+
+
+class AsyncBaseGrid(BaseGrid):
+    """
+        Grid whose database work is awaitable. Use with AsyncWebGrid, or another manager with
+        run_sync() and concurrent_session_factory().
+    """
+
+    async def run_sync(self, func, *args, **kwargs):
+        """
+            Run func on the manager's thread pool with a session bound for the grid's queries
+        """
+        task = functools.partial(func, *args, **kwargs)
+        try:
+            return await self.manager.run_sync(
+                self._run_in_session, self.manager.concurrent_session_factory(), task
+            )
+        finally:
+            self.flash_deferred_warnings()
+
+    def _bind_query(self, query, workload=None):
+        if getattr(self._thread_state, 'session', None) is None:
+            raise RuntimeError('AsyncBaseGrid queries run in run_sync(), await build() or one of'
+                               ' the get_*() methods first')
+        return super(AsyncBaseGrid, self)._bind_query(query, workload)
+
+    async def build(self):
+        await self.run_sync(self.build_sync)
+
+    def build_sync(self):
+        self.apply_qs_args()
+        self.before_query_hook()
+        self.prefetch()
+
+    def prefetch(self):
+        """
+            Fetch what rendering the grid will use. Exports stream their records when rendered,
+            so only the count and grand totals are fetched for them.
+        """
+        self.run_queries()
+        if not self.export_to:
+            self.load_batches(self.records)
+        self.record_count
+        if self.subtotal_cols and self.subtotals in ('page', 'all') and not self.export_to:
+            self.page_totals
+        if self.subtotal_cols and self.subtotals in ('grand', 'all'):
+            self.grand_totals
+
+    async def get_records(self):
+        return await self.run_sync(lambda: self.records)
+
+    async def get_record_count(self):
+        return await self.run_sync(lambda: self.record_count)
+
+    async def get_page_totals(self):
+        return await self.run_sync(lambda: self.page_totals)
+
+    async def get_grand_totals(self):
+        return await self.run_sync(lambda: self.grand_totals)
+
+    async def export_as_response(self, wb=None, sheet_name=None):
+        return await self.run_sync(BaseGrid.export_as_response, self, wb, sheet_name)
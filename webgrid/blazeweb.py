@@ -68,6 +68,10 @@ class WebGrid(object):
         data.seek(0)
         self.file_as_response(data, file_name, 'application/vnd.ms-excel')
 
+    def options_url(self, grid, column_key):
+        # no options endpoint, so searchable filters can only show their selected options
+        return None
+
     def render_template(self, endpoint, **kwargs):
         try:
             return getcontent(endpoint, **kwargs)
@@ -0,0 +1,210 @@
+from __future__ import absolute_import
+
+from collections import OrderedDict
+import threading
+import time
+import timeit
+
+from blazeutils.strings import randchars
+
+
+class _Missing(object):
+    """
+        A sentinal object to indicate a key is not in the cache
+    """
+    pass
+
+
+class ResultCache(object):
+    """
+        Interface for caching grid query results (record counts, records, and totals).
+
+        A backend implements get(), set(), and delete(). Namespaces, invalidation, and the hit/miss
+        counters are built on those three, so a shared cache (memcached, redis, etc.) only needs
+        to wrap its client. Values are lists of result rows and tuples, which pickle; ORM entities
+        in the rows will come back detached from the session.
+    """
+    missing = _Missing
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, key):
+        """ Return the value stored for key, or `self.missing` """
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        """ Store value for key, expiring after ttl seconds if ttl is not None """
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def _generation_key(self, namespace):
+        return '{0}:generation'.format(namespace)
+
+    def generation(self, namespace):
+        """
+            Token that is part of every key in the namespace. Replacing it in invalidate() orphans
+            the old entries, which then age out, so backends don't have to support deleting by
+            prefix.
+        """
+        gen_key = self._generation_key(namespace)
+        generation = self.get(gen_key)
+        if generation is self.missing:
+            generation = randchars(8)
+            self.set(gen_key, generation)
+        return generation
+
+    def invalidate(self, namespace):
+        self.set(self._generation_key(namespace), randchars(8))
+
+    def _full_key(self, namespace, key):
+        return '{0}:{1}:{2}'.format(namespace, self.generation(namespace), key)
+
+    def fetch(self, namespace, key, create, ttl=None):
+        """
+            Return the value cached for key in namespace. On a miss, call create() and cache what
+            it returns.
+        """
+        full_key = self._full_key(namespace, key)
+        value = self.get(full_key)
+        if value is not self.missing:
+            self._count('hits')
+            return value
+        self._count('misses')
+        value = create()
+        self.set(full_key, value, ttl)
+        return value
+
+    def prefill(self, namespace, key, create, ttl=None):
+        """
+            Cache create() for key in namespace unless a value is already cached. For results
+            fetched ahead of being asked for, so hits and misses are not counted.
+        """
+        full_key = self._full_key(namespace, key)
+        if self.get(full_key) is self.missing:
+            self.set(full_key, create(), ttl)
+
+    def _count(self, counter):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.hits = 0
+            self.misses = 0
+
+
+class MemoryCache(ResultCache):
+    """
+        In-process cache with least-recently-used eviction once max_size entries are stored.
+    """
+
+    def __init__(self, max_size=1000):
+        super(MemoryCache, self).__init__()
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return self.missing
+            expires, value = self._entries[key]
+            if expires is not None and expires <= time.time():
+                del self._entries[key]
+                return self.missing
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class QueryStats(object):
+    """
+        Counts and timings for the queries grids build and compile. A query reused by a grid
+        for the same filters, sort, and paging saves the time it took to make it. Queries
+        cancelled by query_budgets are counted in timeouts.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.builds = 0
+            self.build_seconds = 0.0
+            self.build_reuses = 0
+            self.compiles = 0
+            self.compile_seconds = 0.0
+            self.compile_reuses = 0
+            # queries cancelled for running over a grid's query_budgets, by phase
+            self.timeouts = {}
+
+    def timed(self, kind, func):
+        """ Call func, counting its run time as a build or compile """
+        start = timeit.default_timer()
+        result = func()
+        elapsed = timeit.default_timer() - start
+        with self._lock:
+            setattr(self, kind + 's', getattr(self, kind + 's') + 1)
+            setattr(self, kind + '_seconds', getattr(self, kind + '_seconds') + elapsed)
+        return result
+
+    def reused(self, kind):
+        with self._lock:
+            setattr(self, kind + '_reuses', getattr(self, kind + '_reuses') + 1)
+
+    def timed_out(self, phase):
+        with self._lock:
+            self.timeouts[phase] = self.timeouts.get(phase, 0) + 1
+
+    def saved_seconds(self, kind):
+        """ Estimated time saved by reuse, at the average time per build or compile """
+        count = getattr(self, kind + 's')
+        if not count:
+            return 0.0
+        return getattr(self, kind + '_seconds') / count * getattr(self, kind + '_reuses')
+
+    @property
+    def summary(self):
+        return dict(
+            (
+                kind,
+                {
+                    'count': getattr(self, kind + 's'),
+                    'seconds': getattr(self, kind + '_seconds'),
+                    'reuses': getattr(self, kind + '_reuses'),
+                    'saved_seconds': self.saved_seconds(kind),
+                }
+            )
+            for kind in ('build', 'compile')
+        )
+
+
+query_stats = QueryStats()
@@ -2,7 +2,8 @@ from __future__ import absolute_import
 import calendar
 import datetime as dt
 from decimal import Decimal as D
-import inspect
+from functools import lru_cache
+import json
 
 from blazeutils import tolist
 from blazeutils.dates import ensure_date, ensure_datetime
@@ -10,10 +11,13 @@ from dateutil.parser import parse
 from dateutil.relativedelta import relativedelta, SU
 import formencode
 import formencode.validators as feval
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm.attributes import QueryableAttribute
 from sqlalchemy.sql import or_, and_
 import sqlalchemy as sa
 import six
 
+from .cache import MemoryCache
 from .extensions import (
     gettext,
     lazy_gettext as _
@@ -63,6 +67,7 @@ class ops(object):
     last_month = Operator('lastmonth', _('last month'), None)
     select_month = Operator('selmonth', _('select month'), 'select+input')
     this_year = Operator('thisyear', _('this year'), None)
+    search = Operator('search', _('matches'), 'input')
 
 
 class FilterBase(object):
@@ -76,6 +81,13 @@ class FilterBase(object):
     # does this filter take a list of values in it's set() method
     receives_list = False
 
+    def __new__(cls, *args, **kwargs):
+        # store the exact arguments the filter was constructed with, for new_instance()
+        filter = super(FilterBase, cls).__new__(cls)
+        filter._vargs = list(args)
+        filter._kwargs = kwargs
+        return filter
+
     def __init__(self, sa_col, default_op=None, default_value1=None, default_value2=None,
                  dialect=None):
         # attributes from static instance
@@ -95,23 +107,13 @@ class FilterBase(object):
         self._op_keys = None
         self.error = False
 
-        # find the outermost call to a subclass's init method so we can store the exact arguments
-        # used to construct it
-        outermost = None
-        frame = inspect.currentframe()
-        # Can't use inspect.stack() here because when called from within a Jinja template,
-        # inspect.getframeinfo raises an exception
-        while frame:
-            if frame.f_code.co_name != '__init__' or \
-                    not isinstance(frame.f_locals.get('self'), FilterBase):
-                break
-            outermost = inspect.getargvalues(frame)
-            frame = frame.f_back
-
-        self._vargs = [outermost.locals[a] for a in outermost.args[1:]] + \
-            list(outermost.locals[outermost.varargs] if outermost.varargs else [])
-
-        self._kwargs = outermost.locals[outermost.keywords] if outermost.keywords else {}
+    def query_key(self):
+        """
+            The state apply() builds the query from, for BaseGrid.build_query() to tell when
+            a query can be reused. Subclasses whose apply() reads other state add it.
+        """
+        return (self.op, self.value1, self.value2, self.value1_set_with, self.value2_set_with,
+                self._vargs, self._kwargs)
 
     @property
     def is_active(self):
@@ -202,6 +204,8 @@ class FilterBase(object):
         """
         cls = self.__class__
         new_filter = cls(*self._vargs, **self._kwargs)
+        for attr in self.init_attrs_for_instance:
+            setattr(new_filter, attr, getattr(self, attr))
         new_filter.dialect = kwargs.get('dialect')
         return new_filter
 
@@ -215,6 +219,23 @@ class OptionsFilterBase(FilterBase):
     input_types = 'select'
     receives_list = True
     options_from = ()
+    # above this many values, is/!is compare against a single array or JSON parameter on
+    #   PostgreSQL and SQLite instead of binding every value. See in_clause().
+    in_list_threshold = 500
+    # keep the lists options_from() returns (often from a query) in options_cache, so they
+    #   aren't fetched again for every grid. Lists are kept per filter class and constructor
+    #   arguments, for options_cache_ttl seconds or until invalidate_options() is called.
+    cache_options = False
+    # shared by all option filters in the process, unless a subclass gives its own
+    options_cache = MemoryCache(max_size=500)
+    options_cache_ttl = 300
+    # for filters with too many options to render them all. Only the selected options are
+    #   rendered, and others are found as the user types, through the manager's options
+    #   endpoint (see search_options()). options_from() must return a query of (key, label)
+    #   rows, which submitted values are checked against instead of a list of every key.
+    searchable = False
+    # most options the endpoint returns for a search
+    search_limit = 20
 
     def __init__(self, sa_col, value_modifier='auto', default_op=None, default_value1=None,
                  default_value2=None):
@@ -226,21 +247,103 @@ class OptionsFilterBase(FilterBase):
         # attributes that will start fresh for each instance
         self._options_seq = None
         self._options_keys = None
+        self._options_key_set = None
 
     def new_instance(self, **kwargs):
         filter = FilterBase.new_instance(self, **kwargs)
         filter.setup_validator()
         return filter
 
+    def fetch_options(self):
+        try:
+            return self.options_from()
+        except TypeError as e:
+            if 'is not callable' not in str(e):
+                raise
+            return self.options_from
+
+    @classmethod
+    def options_cache_namespace(cls):
+        return 'options:{0}.{1}'.format(cls.__module__, cls.__name__)
+
+    def options_cache_key(self):
+        def arg_key(arg):
+            # SQLAlchemy columns and expressions are keyed by their SQL, which (unlike their
+            #   repr) is the same in every process
+            if isinstance(arg, (sa.sql.ClauseElement, QueryableAttribute)):
+                return str(arg)
+            return repr(arg)
+        key = ','.join([arg_key(arg) for arg in self._vargs] + [
+            '{0}={1}'.format(name, arg_key(arg)) for name, arg in sorted(self._kwargs.items())
+        ])
+        locale = self.options_cache_locale()
+        if locale is not None:
+            key = '{0}:{1}'.format(key, locale)
+        return key
+
+    def options_cache_locale(self):
+        """
+            For filters with translated labels, return the current locale so that options are
+            cached for each locale
+        """
+        return None
+
+    @classmethod
+    def invalidate_options(cls):
+        """ Drop the cached options of every instance of the class, e.g. after they change """
+        cls.options_cache.invalidate(cls.options_cache_namespace())
+
+    def options_query_columns(self):
+        """ The options query of a searchable filter, with its key and label expressions """
+        query = self.fetch_options()
+        key_col, label_col = [desc['expr'] for desc in query.column_descriptions[:2]]
+        return query, key_col, label_col
+
+    def search_options(self, term, limit=None):
+        """ Options of a searchable filter whose labels start with term """
+        query, key_col, label_col = self.options_query_columns()
+        limit = min(limit or self.search_limit, self.search_limit)
+        pattern = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        query = query.filter(label_col.ilike(u'{0}%'.format(pattern), escape='\\'))
+        return [tuple(option) for option in query.limit(limit)]
+
+    def selected_options(self):
+        if not self.value1:
+            return []
+        query, key_col, label_col = self.options_query_columns()
+        return [tuple(option) for option in
+                query.filter(self.in_clause(query, key_col, self.value1))]
+
+    def existing_keys(self, values):
+        """ The values a searchable filter has options for, checked in the database """
+        if not values:
+            return values
+        query, key_col, label_col = self.options_query_columns()
+        query = query.with_entities(key_col).order_by(None)
+        query = query.filter(self.in_clause(query, key_col, values))
+        found = set(key for key, in query)
+        return [value for value in values if value in found]
+
+    def sample_option_keys(self):
+        # enough keys to guess their type, without loading every option of searchable filters
+        if self.searchable:
+            return [option[0] for option in self.fetch_options().limit(1)]
+        return self.option_keys
+
     @property
     def options_seq(self):
         if self._options_seq is None:
-            try:
-                self._options_seq = self.options_from()
-            except TypeError as e:
-                if 'is not callable' not in str(e):
-                    raise
-                self._options_seq = self.options_from
+            if self.searchable:
+                self._options_seq = self.selected_options()
+            elif self.cache_options:
+                self._options_seq = self.options_cache.fetch(
+                    self.options_cache_namespace(),
+                    self.options_cache_key(),
+                    lambda: [tuple(option) for option in self.fetch_options()],
+                    self.options_cache_ttl,
+                )
+            else:
+                self._options_seq = self.fetch_options()
             if self.default_op:
                 self._options_seq = [(-1, _('-- All --'))] + list(self._options_seq)
         return self._options_seq
@@ -251,15 +354,27 @@ class OptionsFilterBase(FilterBase):
             self._options_keys = [k for k, v in self.options_seq]
         return self._options_keys
 
+    @property
+    def option_key_set(self):
+        # for checking submitted values in constant time
+        if self._options_key_set is None:
+            try:
+                self._options_key_set = frozenset(self.option_keys)
+            except TypeError:
+                # unhashable keys, fall back to scanning the list
+                self._options_key_set = self.option_keys
+        return self._options_key_set
+
     def setup_validator(self):
         # make an educated guess about what type the unicode values sent in on
         # a set() operation should be converted to
         if self.value_modifier == 'auto' or self.value_modifier is None:
-            if self.value_modifier and len(self.option_keys) == 0:
+            option_keys = self.sample_option_keys()
+            if self.value_modifier and len(option_keys) == 0:
                 raise ValueError(_('value_modifier argument set to "auto", but '
                                    'the options set is empty and the type can therefore not '
                                    'be determined for {name}', name=self.__class__.__name__))
-            first_key = self.option_keys[0]
+            first_key = option_keys[0]
             if isinstance(first_key, six.string_types) or self.value_modifier is None:
                 self.value_modifier = feval.UnicodeString
             elif isinstance(first_key, int):
@@ -296,16 +411,29 @@ class OptionsFilterBase(FilterBase):
 
         self.value1 = []
         if values is not None:
+            seen = set()
             for v in values:
                 try:
                     v = self.process(v)
-                    if v is not _NoValue:
-                        self.value1.append(v)
+                    if v is _NoValue:
+                        continue
+                    # drop repeated values, which pasted lists of IDs often contain
+                    try:
+                        if v in seen:
+                            continue
+                        seen.add(v)
+                    except TypeError:
+                        pass
+                    self.value1.append(v)
                 except formencode.Invalid:
                     # A normal user should be selecting from the options given,
                     # so if we encounter an Invalid exception, we are going to
                     # assume the value is erronious and just ignore it
                     pass
+        if self.searchable:
+            self.value1 = self.existing_keys(self.value1)
+            # render the newly selected options
+            self._options_seq = self._options_keys = self._options_key_set = None
 
         # if there are no values after processing, the operator is irrelevent
         # and should be set to None so that it is as if the filter
@@ -316,28 +444,74 @@ class OptionsFilterBase(FilterBase):
         if self.op in (ops.is_, ops.not_is) and not (self.value1 or self.default_op):
             self.op = None
 
+    def option_key(self, value):
+        """ The option key for a value of the filter's column, as read from the database """
+        return value
+
     def process(self, value):
         if self.value_modifier is not None:
             value = self.value_modifier.to_python(value)
-            if value not in self.option_keys:
+            # searchable filters check their values together, in set()
+            if not self.searchable and value not in self.option_key_set:
                 return _NoValue
             if self.default_op and value == -1:
                 return _NoValue
         return value
 
+    def in_clause(self, query, sa_col=None, values=None):
+        """
+            Condition for the column matching one of the filter's values, or for sa_col
+            matching one of values. Up to in_list_threshold values are bound separately in an
+            IN list. Past that, the in_list_<dialect> method for the dialect is used if there
+            is one. Other dialects keep the IN list.
+        """
+        sa_col = self.sa_col if sa_col is None else sa_col
+        values = self.value1 if values is None else values
+        if len(values) <= self.in_list_threshold:
+            return sa_col.in_(values)
+        dialect_name = self.dialect.name if self.dialect else None
+        in_list = getattr(self, 'in_list_{0}'.format(dialect_name), None)
+        if in_list is None:
+            return sa_col.in_(values)
+        return in_list(query, sa_col, values)
+
+    def in_list_postgresql(self, query, sa_col, values):
+        # a single array parameter keeps the statement the same for any number of values
+        values = sa.bindparam('in_list', values, unique=True,
+                              type_=postgresql.ARRAY(sa_col.type))
+        return sa_col == sa.any_(values)
+
+    def in_list_sqlite(self, query, sa_col, values):
+        bound = self.bind_values(sa_col, values)
+        if bound is None:
+            return sa_col.in_(values)
+        json_values = sa.bindparam('in_list', json.dumps(bound), unique=True)
+        return sa_col.in_(
+            sa.select([sa.literal_column('value')]).select_from(sa.func.json_each(json_values))
+        )
+
+    def bind_values(self, sa_col, values):
+        """ The values as the column type binds them, or None if they aren't JSON types """
+        processor = sa_col.type.bind_processor(self.dialect)
+        values = [processor(value) for value in values] if processor else values
+        if all(isinstance(value, six.string_types + six.integer_types + (float,))
+               for value in values):
+            return list(values)
+        return None
+
     def apply(self, query):
         if self.op == ops.is_:
             if len(self.value1) == 1:
                 return query.filter(self.sa_col == self.value1[0])
             elif len(self.value1) > 1:
-                return query.filter(self.sa_col.in_(self.value1))
+                return query.filter(self.in_clause(query))
             else:
                 return query
         if self.op == ops.not_is:
             if len(self.value1) == 1:
                 return query.filter(self.sa_col != self.value1[0])
             elif len(self.value1) > 1:
-                return query.filter(~self.sa_col.in_(self.value1))
+                return query.filter(~self.in_clause(query))
             else:
                 return query
         return FilterBase.apply(self, query)
@@ -388,6 +562,9 @@ class OptionsEnumFilter(OptionsFilterBase):
     def options_from(self):
         return [(x.name, x.value) for x in self.enum_type]
 
+    def option_key(self, value):
+        return value.name if isinstance(value, self.enum_type) else value
+
     def new_instance(self, **kwargs):
         new_inst = super(OptionsEnumFilter, self).new_instance(**kwargs)
         new_inst.enum_type = self.enum_type
@@ -401,10 +578,53 @@ class OptionsEnumFilter(OptionsFilterBase):
 
 
 class TextFilter(FilterBase):
+    """
+        Filter for text columns. Equality is case-insensitive, and `case_strategy` picks how,
+        each with an index that serves it (see index_ddl()):
+
+        - "upper" (default): compares `upper(col)` to `upper(value)` on PostgreSQL and SQLite,
+          which uses an index on `upper(col)`.
+        - "collation": compares with `col COLLATE collation` (e.g. NOCASE on SQLite or a
+          nondeterministic ICU collation on PostgreSQL), or plainly when `collation` is None
+          because the column is already case-insensitive (e.g. citext).
+        - "shadow": compares `value.upper()` to `shadow_col`, a column kept holding the
+          upper-cased text.
+    """
     operators = (ops.eq, ops.not_eq, ops.contains, ops.not_contains, ops.empty, ops.not_empty)
+    case_strategies = ('upper', 'collation', 'shadow')
+
+    def __init__(self, sa_col, default_op=None, default_value1=None, default_value2=None,
+                 dialect=None, case_strategy='upper', collation=None, shadow_col=None):
+        FilterBase.__init__(self, sa_col, default_op=default_op, default_value1=default_value1,
+                            default_value2=default_value2, dialect=dialect)
+        if case_strategy not in self.case_strategies:
+            raise ValueError('case_strategy must be one of: {0}'.format(
+                ', '.join(self.case_strategies)))
+        if case_strategy == 'shadow' and shadow_col is None:
+            raise ValueError('shadow_col is needed for the shadow case_strategy')
+        self.case_strategy = case_strategy
+        self.collation = collation
+        self.shadow_col = shadow_col
 
     @property
     def comparisons(self):
+        if self.case_strategy == 'collation':
+            def collated(col):
+                return col.collate(self.collation) if self.collation else col
+            return {
+                ops.eq: lambda col, value: collated(col) == value,
+                ops.not_eq: lambda col, value: collated(col) != value,
+                ops.contains: lambda col, value: col.ilike(u'%{}%'.format(value)),
+                ops.not_contains: lambda col, value: ~col.ilike(u'%{}%'.format(value))
+            }
+        if self.case_strategy == 'shadow':
+            shadow = self.shadow_col
+            return {
+                ops.eq: lambda col, value: shadow == value.upper(),
+                ops.not_eq: lambda col, value: shadow != value.upper(),
+                ops.contains: lambda col, value: shadow.like(u'%{}%'.format(value.upper())),
+                ops.not_contains: lambda col, value: ~shadow.like(u'%{}%'.format(value.upper()))
+            }
         if self.dialect and self.dialect.name in ('postgresql', 'sqlite'):
             return {
                 ops.eq: lambda col, value: sa.func.upper(col) == sa.func.upper(value),
@@ -437,6 +657,141 @@ class TextFilter(FilterBase):
             return query.filter(self.comparisons[self.op](self.sa_col, self.value1))
         return FilterBase.apply(self, query)
 
+    def index_ddl(self, dialect_name):
+        """
+            SQL statements creating the index that serves the filter's equality comparisons
+            on the dialect, built from the column's table metadata
+        """
+        column = getattr(self.sa_col, 'expression', self.sa_col)
+        if self.case_strategy == 'shadow':
+            column = getattr(self.shadow_col, 'expression', self.shadow_col)
+            expression, suffix = column, 'shadow'
+        elif self.case_strategy == 'collation':
+            expression = column.collate(self.collation) if self.collation else column
+            suffix = (self.collation or 'ci').lower()
+        else:
+            expression, suffix = sa.func.upper(column), 'upper'
+        index = sa.Index('ix_{0}_{1}_{2}'.format(column.table.name, column.name, suffix),
+                         expression)
+        # the index was only wanted for its DDL, keep it out of the table's metadata
+        column.table.indexes.discard(index)
+        dialect = sa.dialects.registry.load(dialect_name)()
+        return [str(sa.schema.CreateIndex(index).compile(dialect=dialect))]
+
+
+class FullTextFilter(FilterBase):
+    """
+        Searches a text column through an index instead of scanning it with LIKE.
+
+        In the default "fulltext" mode, records match when they contain all of the words
+        searched for. On PostgreSQL, the query is `to_tsvector(config, col) @@ plainto_tsquery()`.
+        A GIN index on that expression (see index_ddl()) serves it, or `vector` can name a
+        stored tsvector column. On SQLite, the words are matched in the FTS5 table `fts_table`,
+        whose rowids are the fts_key column (by default, the primary key of the column's table).
+
+        The "trigram" mode matches the text anywhere in the column like TextFilter's contains
+        does. It is served by a pg_trgm GIN index on PostgreSQL, or an FTS5 table with the
+        trigram tokenizer on SQLite (for searches of three or more characters).
+
+        Other databases, and SQLite without an fts_table, fall back to LIKE.
+    """
+    operators = (ops.search, ops.empty, ops.not_empty)
+    modes = ('fulltext', 'trigram')
+
+    def __init__(self, sa_col, mode='fulltext', config='english', vector=None, fts_table=None,
+                 fts_key=None, default_op=None, default_value1=None, default_value2=None):
+        FilterBase.__init__(self, sa_col, default_op=default_op, default_value1=default_value1,
+                            default_value2=default_value2)
+        if mode not in self.modes:
+            raise ValueError('mode must be one of: {0}'.format(', '.join(self.modes)))
+        self.mode = mode
+        self.config = config
+        self.vector = vector
+        self.fts_table = fts_table
+        self.fts_key = fts_key
+
+    @property
+    def column(self):
+        # the table column (e.g. of an ORM attribute) for DDL and keys
+        return getattr(self.sa_col, 'expression', self.sa_col)
+
+    @property
+    def fts_key_col(self):
+        if self.fts_key is not None:
+            return self.fts_key
+        return list(self.column.table.primary_key)[0]
+
+    def process(self, value, is_value2):
+        if is_value2 or value is None:
+            return None
+        return value.strip() or None
+
+    def fts_match_query(self, value):
+        """ FTS5 query for the value, quoted so that punctuation isn't read as query syntax """
+        def quote(text):
+            return '"{0}"'.format(text.replace('"', '""'))
+        if self.mode == 'trigram':
+            return quote(value)
+        return ' '.join(quote(word) for word in value.split())
+
+    def search_clause(self, value):
+        """ The SQL condition for records matching value """
+        dialect_name = self.dialect.name if self.dialect else None
+        if dialect_name == 'postgresql' and self.mode == 'fulltext':
+            config = sa.literal_column("'{0}'".format(self.config.replace("'", "''")))
+            vector = self.vector if self.vector is not None \
+                else sa.func.to_tsvector(config, self.sa_col)
+            return vector.op('@@')(sa.func.plainto_tsquery(config, value))
+        if dialect_name == 'sqlite' and self.fts_table \
+                and (self.mode == 'fulltext' or len(value) >= 3):
+            matches = sa.select([sa.literal_column('rowid')]) \
+                .select_from(sa.table(self.fts_table)) \
+                .where(sa.literal_column(self.fts_table).op('MATCH')(self.fts_match_query(value)))
+            return self.fts_key_col.in_(matches)
+        # trigram indexes serve ILIKE on PostgreSQL
+        return self.sa_col.ilike(u'%{}%'.format(value))
+
+    def apply(self, query):
+        if self.op == self.default_op and not self.value1:
+            return query
+        if self.op == ops.search:
+            return query.filter(self.search_clause(self.value1))
+        if self.op == ops.empty:
+            return query.filter(or_(self.sa_col.is_(None), self.sa_col == u''))
+        if self.op == ops.not_empty:
+            return query.filter(and_(self.sa_col.isnot(None), self.sa_col != u''))
+        return FilterBase.apply(self, query)
+
+    def index_ddl(self, dialect_name):
+        """
+            SQL statements creating the index the filter's searches use on the dialect. An
+            SQLite FTS5 table is built from the rows present; keep it up to date with triggers
+            or by running the 'rebuild' statement again.
+        """
+        column = self.column
+        table = column.table.name
+        if dialect_name == 'postgresql':
+            if self.mode == 'trigram':
+                return [
+                    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+                    'CREATE INDEX ix_{0}_{1}_trgm ON {0} USING gin ({1} gin_trgm_ops)'.format(
+                        table, column.name),
+                ]
+            return [
+                "CREATE INDEX ix_{0}_{1}_fts ON {0} USING gin (to_tsvector('{2}', {1}))".format(
+                    table, column.name, self.config),
+            ]
+        if dialect_name == 'sqlite':
+            if not self.fts_table:
+                raise ValueError('fts_table is needed for an SQLite full-text index')
+            options = ", tokenize='trigram'" if self.mode == 'trigram' else ''
+            return [
+                "CREATE VIRTUAL TABLE {0} USING fts5({1}, content='{2}', content_rowid='{3}'{4})"
+                .format(self.fts_table, column.name, table, self.fts_key_col.name, options),
+                "INSERT INTO {0}({0}) VALUES ('rebuild')".format(self.fts_table),
+            ]
+        raise ValueError('no full-text index for dialect: {0}'.format(dialect_name))
+
 
 class NumberFilterBase(FilterBase):
     operators = (ops.eq, ops.not_eq, ops.less_than_equal, ops.greater_than_equal, ops.empty,
@@ -472,6 +827,41 @@ class NumberFilter(NumberFilterBase):
         return D(value)
 
 
+# formats the filters' inputs are rendered in, followed by ISO 8601
+DATETIME_INPUT_FORMATS = (
+    '%m/%d/%Y',
+    '%m/%d/%Y %I:%M %p',
+    '%Y-%m-%d',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S.%f',
+)
+
+
+@lru_cache(maxsize=4096)
+def _parse_datetime(value, formats, fallback, today):
+    for input_format in formats:
+        try:
+            return dt.datetime.strptime(value, input_format)
+        except ValueError:
+            pass
+    if not fallback:
+        raise ValueError('{0!r} does not match the input formats'.format(value))
+    # dateutil fills in missing parts of the date from today, which is part of the cache key
+    return parse(value)
+
+
+def parse_datetime(value, formats=DATETIME_INPUT_FORMATS, fallback=True):
+    """
+        Parse value with the first of the strptime formats it matches, or else with dateutil's
+        slower and more lenient parser if fallback is set. Results are cached for all filters,
+        since saved searches apply the same values over and over.
+    """
+    return _parse_datetime(value, tuple(formats), fallback, dt.date.today())
+
+
 class _DateMixin(object):
     options_from = [
         (1, _('01-Jan')), (2, _('02-Feb')), (3, _('03-Mar')), (4, _('04-Apr')),
@@ -620,6 +1010,10 @@ class DateFilter(FilterBase, _DateMixin):
         ops.last_month, ops.this_year
     )
     input_types = 'input', 'select', 'input2'
+    # strptime formats tried in order on submitted values, before falling back to dateutil's
+    #   parser. Set parse_fallback to False to accept only these formats.
+    input_formats = DATETIME_INPUT_FORMATS
+    parse_fallback = True
 
     def __init__(self, sa_col, _now=None, default_op=None, default_value1=None,
                  default_value2=None):
@@ -800,7 +1194,7 @@ class DateFilter(FilterBase, _DateMixin):
             return filter_value
 
         try:
-            d = ensure_date(parse(value))
+            d = ensure_date(self.parse(value))
 
             if isinstance(d, (dt.date, dt.datetime)) and d.year < 1900:
                 return feval.Int(min=1900).to_python(d.year)
@@ -813,6 +1207,9 @@ class DateFilter(FilterBase, _DateMixin):
 
             raise formencode.Invalid(gettext('invalid date'), value, self)
 
+    def parse(self, value):
+        return parse_datetime(value, self.input_formats, self.parse_fallback)
+
 
 class DateTimeFilter(DateFilter):
     def __init__(self, sa_col, _now=None, default_op=None, default_value1=None,
@@ -822,6 +1219,12 @@ class DateTimeFilter(DateFilter):
                                              default_value1=default_value1,
                                              default_value2=default_value2)
 
+    def query_key(self):
+        # a date without a time matches the whole day
+        return super(DateTimeFilter, self).query_key() + (
+            self._has_date_only1, self._has_date_only2
+        )
+
     def format_display_vals(self):
         ops_single_val = (
             ops.eq.key,
@@ -883,7 +1286,7 @@ class DateTimeFilter(DateFilter):
             return None
 
         try:
-            dt_value = parse(value)
+            dt_value = self.parse(value)
         except ValueError:
             raise formencode.Invalid(gettext('invalid date'), value, self)
 
@@ -1020,6 +1423,8 @@ class TimeFilter(FilterBase):
 
     # !!!: localize
     time_format = '%I:%M %p'
+    # formats accepted besides time_format, e.g. '%H:%M'
+    input_formats = ()
 
     def apply(self, query):
         if self.op == self.default_op and self.value1 is None:
@@ -1057,7 +1462,8 @@ class TimeFilter(FilterBase):
             return None
 
         try:
-            return dt.datetime.strptime(value, self.time_format).time()
+            formats = (self.time_format,) + tuple(self.input_formats)
+            return parse_datetime(value, formats, fallback=False).time()
         except ValueError:
             raise formencode.Invalid(_('invalid time'), value, self)
 
@@ -1,11 +1,16 @@
 from __future__ import absolute_import
 
+from contextlib import contextmanager
 import io
 import warnings
 from os import path
 
-from flask import request, session, flash, Blueprint, url_for, send_file
+from flask import (
+    request, session, flash, Blueprint, url_for, send_file, abort, jsonify, current_app, g
+)
 import jinja2 as jinja
+from sqlalchemy.orm import scoped_session, sessionmaker
+import six
 
 from webgrid.extensions import translation_manager
 
@@ -17,8 +22,17 @@ except ImportError:
 
 class WebGrid(object):
     jinja_loader = jinja.PackageLoader('webgrid', 'templates')
-
-    def __init__(self, db=None):
+    # URL of the endpoint searching the options of searchable option filters
+    options_url_rule = '/webgrid/options/<grid_key>/<column_key>'
+
+    def __init__(self, db=None, workload_binds=None):
+        # maps workloads ('page', 'count', 'totals', 'export') to the engine, or the key of an
+        #   engine in SQLALCHEMY_BINDS, their grid queries run on. e.g. counts and exports can go
+        #   to a read replica while pages are read from the primary.
+        self.workload_binds = dict(workload_binds or {})
+        self._workload_sessions = {}
+        # grids whose searchable filters the options endpoint serves, see register_grid()
+        self.registered_grids = {}
         self.init_db(db)
         self.jinja_environment = jinja.Environment(
             loader=self.jinja_loader,
@@ -31,6 +45,54 @@ class WebGrid(object):
     def sa_query(self, *args, **kwargs):
         return self.db.session.query(*args, **kwargs)
 
+    def concurrent_session_factory(self):
+        """
+            Session maker for running grid queries on other threads, or None if they can't be
+            (each thread would get its own in-memory SQLite database).
+        """
+        engine = self.db.get_engine()
+        if engine.url.drivername.startswith('sqlite') \
+                and engine.url.database in (None, '', ':memory:'):
+            return None
+        return sessionmaker(bind=engine, expire_on_commit=False)
+
+    def concurrent_context(self):
+        """
+            Pushes the current app's context on the threads concurrent grid queries run on, so
+            db.session and the engines are available there.
+        """
+        app = current_app._get_current_object()
+
+        @contextmanager
+        def context():
+            with app.app_context():
+                # the records a thread fetched outlive its app context
+                g.webgrid_keep_workload_sessions = True
+                yield
+        return context
+
+    def workload_session(self, workload):
+        """
+            Session for grid queries of a workload, or None to run them on db.session. Sessions
+            are per thread and are removed when the app context tears down.
+        """
+        bind = self.workload_binds.get(workload)
+        if bind is None:
+            return None
+        if isinstance(bind, six.string_types):
+            bind = self.db.get_engine(bind=bind)
+        if bind not in self._workload_sessions:
+            self._workload_sessions.setdefault(
+                bind, scoped_session(sessionmaker(bind=bind, expire_on_commit=False))
+            )
+        return self._workload_sessions[bind]()
+
+    def remove_workload_sessions(self, exc=None):
+        if g.get('webgrid_keep_workload_sessions'):
+            return
+        for sessions in list(self._workload_sessions.values()):
+            sessions.remove()
+
     def request_args(self):
         return request.args
 
@@ -49,6 +111,46 @@ class WebGrid(object):
     def static_url(self, url_tail):
         return url_for('webgrid.static', filename=url_tail)
 
+    def grid_key(self, grid):
+        grid_cls = grid if isinstance(grid, type) else type(grid)
+        return '{0}.{1}'.format(grid_cls.__module__, grid_cls.__name__)
+
+    def register_grid(self, grid_cls):
+        """
+            Serve the options of grid_cls's searchable filters from the options endpoint. Can
+            be used as a class decorator.
+        """
+        self.registered_grids[self.grid_key(grid_cls)] = grid_cls
+        return grid_cls
+
+    def options_allowed(self, grid_cls):
+        """
+            Whether the current user may search the options of grid_cls's filters. Denied
+            unless overridden, apply the same checks as the views showing the grid.
+        """
+        return False
+
+    def options_url(self, grid, column_key):
+        return url_for('webgrid.options', grid_key=self.grid_key(grid), column_key=column_key)
+
+    def options_view(self, grid_key, column_key):
+        grid_cls = self.registered_grids.get(grid_key)
+        if grid_cls is None:
+            abort(404)
+        if not self.options_allowed(grid_cls):
+            abort(403)
+        column = grid_cls().filtered_cols.get(column_key)
+        if column is None or not getattr(column.filter, 'searchable', False):
+            abort(404)
+        try:
+            limit = int(request.args.get('limit', 0)) or None
+        except ValueError:
+            limit = None
+        options = column.filter.search_options(request.args.get('q', ''), limit)
+        return jsonify(options=[
+            {'value': key, 'label': six.text_type(label)} for key, label in options
+        ])
+
     def init_app(self, app):
         bp = Blueprint(
             'webgrid',
@@ -56,7 +158,9 @@ class WebGrid(object):
             static_folder='static',
             static_url_path=app.static_url_path + '/webgrid'
         )
+        bp.add_url_rule(self.options_url_rule, 'options', self.options_view)
         app.register_blueprint(bp)
+        app.teardown_appcontext(self.remove_workload_sessions)
         configure_jinja_environment(app.jinja_env, translation_manager)
 
     def file_as_response(self, data_stream, file_name, mime_type):
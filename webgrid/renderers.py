@@ -89,7 +89,9 @@ class HTML(object):
     def render(self):
         if not self.can_render():
             raise RenderLimitExceeded('Unable to render HTML table')
-        return self.load_content('grid.html')
+        content = self.load_content('grid.html')
+        self.grid.prefetch_adjacent_page()
+        return content
 
     def grid_otag(self):
         return _HTML.div(_closed=False, **self.grid.hah)
@@ -183,13 +185,25 @@ class HTML(object):
             ident = '{0}_select1'.format(col.key)
             current_selected = tolist(filter.value1) or []
             multiple = None
+            attrs = {}
+            options_url = self.filtering_options_url(col)
+            if options_url:
+                # searched for in the multi-select UI
+                attrs['data-options-url'] = options_url
+                multiple = 'multiple'
             if len(current_selected) > 1:
                 multiple = 'multiple'
             inputs += tags.select(field_name, current_selected,
-                                  self.filtering_filter_options(filter), multiple=multiple)
+                                  self.filtering_filter_options(filter), multiple=multiple,
+                                  **attrs)
             inputs += self.filtering_toggle_image()
         return inputs
 
+    def filtering_options_url(self, col):
+        if not getattr(col.filter, 'searchable', False):
+            return None
+        return self.manager.options_url(self.grid, col.key)
+
     def filtering_toggle_image(self):
         img_url = self.manager.static_url('bullet_toggle_plus.png')
         img_tag = tags.image(img_url, 'multi-select toggle', 16, 16, class_='toggle-button')
@@ -198,13 +212,21 @@ class HTML(object):
     def filtering_filter_options(self, filter):
         # webhelpers2 doesn't allow options to be lists or tuples anymore. If this is the case,
         # turn it into an Option list
+        counts = self.grid.facet_counts_for(filter)
         return [
             (tags.Option(
-                option[1],
+                self.filtering_option_label(option, counts),
                 value=option[0]
             ) if isinstance(option, (tuple, list)) else option) for option in filter.options_seq
         ]
 
+    def filtering_option_label(self, option, counts):
+        key, label = option[0], option[1]
+        # -1 is the "-- All --" option of filters with a default operator
+        if counts is None or key == -1:
+            return label
+        return '{0} ({1:,})'.format(label, counts.get(key, 0))
+
     def filtering_col_inputs2(self, col):
         filter = col.filter
         field_name = 'v2({0})'.format(col.key)
@@ -218,6 +240,10 @@ class HTML(object):
                                   id=ident)
         return inputs
 
+    def filtering_search_input(self):
+        return _HTML.input(name=self.grid.prefix_qs_arg_key('search'), type='text',
+                           value=self.grid.search_value or '', class_='search-all')
+
     def filtering_add_filter_select(self):
         options = [tags.Option(literal('&nbsp;'), value='')]
         for col in six.itervalues(self.grid.filtered_cols):
@@ -237,13 +263,18 @@ class HTML(object):
 
     def confirm_export(self):
         count = self.grid.record_count
-        if self.grid.unconfirmed_export_limit is None:
+        limit = self.grid.unconfirmed_export_limit
+        if limit is None:
             confirmation_required = False
+        elif self.grid.record_count_kind in ('capped', 'unknown'):
+            # all we know is there are more than count_cap records, or nothing at all
+            confirmation_required = True
         else:
-            confirmation_required = count > self.grid.unconfirmed_export_limit
+            confirmation_required = count > limit
         return jsonmod.dumps({
             'confirm_export': confirmation_required,
-            'record_count': count
+            # shown to the user, marked as paging_record_count() marks it
+            'record_count': self.paging_record_count()
         })
 
     def header_sorting(self):
@@ -282,10 +313,31 @@ class HTML(object):
     def header_paging(self):
         return self.load_content('header_paging.html')
 
+    def count_display(self, count):
+        """
+            Mark a count derived from the grid's record count when that count is not exact:
+            "10,000+" when it was capped, "~10,000" when it was estimated.
+        """
+        kind = self.grid.record_count_kind
+        if kind == 'capped':
+            return '{0:,}+'.format(count)
+        if kind == 'estimated':
+            return '~{0:,}'.format(count)
+        return count
+
+    def paging_record_count(self):
+        if self.grid.record_count_kind == 'capped':
+            # the count stopped one past the cap, so all we know is there are more than the cap
+            return self.count_display(self.grid.count_cap)
+        return self.count_display(self.grid.record_count)
+
     def paging_select_options(self):
         options = []
-        for page in range(1, self.grid.page_count + 1):
-            label = _('{page} of {page_count}', page=page, page_count=self.grid.page_count)
+        page_count = self.grid.page_count
+        page_count_label = self.count_display(page_count)
+        # when the count isn't exact, the current page may be past the pages it implies
+        for page in range(1, max(page_count, self.grid.on_page or 1) + 1):
+            label = _('{page} of {page_count}', page=page, page_count=page_count_label)
             options.append(tags.Option(label, value=page))
         return options
 
@@ -298,7 +350,7 @@ class HTML(object):
         return _HTML.input(type='text', name=pp_qsk, value=self.grid.per_page)
 
     def paging_url_first(self):
-        return self.current_url(onpage=1, perpage=self.grid.per_page)
+        return self.current_url(onpage=1, perpage=self.grid.per_page, cursor=None)
 
     def paging_img_first(self):
         img_url = self.manager.static_url('b_firstpage.png')
@@ -308,9 +360,18 @@ class HTML(object):
         img_url = self.manager.static_url('bd_firstpage.png')
         return _HTML.img(src=img_url, width=16, height=13, alt='<<')
 
+    def paging_cursor(self, record, direction):
+        if record is None:
+            return None
+        return self.grid.keyset_cursor(record, direction)
+
     def paging_url_prev(self):
         prev_page = self.grid.on_page - 1
-        return self.current_url(onpage=prev_page, perpage=self.grid.per_page)
+        cursor = None
+        # the first page is cheap to reach with an offset of zero, so it doesn't need a cursor
+        if self.grid.keyset_on and prev_page > 1:
+            cursor = self.paging_cursor(next(iter(self.grid.records), None), 'p')
+        return self.current_url(onpage=prev_page, perpage=self.grid.per_page, cursor=cursor)
 
     def paging_img_prev(self):
         img_url = self.manager.static_url('b_prevpage.png')
@@ -320,9 +381,19 @@ class HTML(object):
         img_url = self.manager.static_url('bd_prevpage.png')
         return _HTML.img(src=img_url, width=8, height=13, alt='<')
 
+    def paging_has_next(self):
+        if self.grid.on_page < self.grid.page_count:
+            return True
+        # without an exact count, a full page means there may be another one after it
+        return not self.grid.record_count_exact and self.grid.per_page is not None \
+            and len(self.grid.records) >= self.grid.per_page
+
     def paging_url_next(self):
         next_page = self.grid.on_page + 1
-        return self.current_url(onpage=next_page, perpage=self.grid.per_page)
+        cursor = None
+        if self.grid.keyset_on and self.grid.records:
+            cursor = self.paging_cursor(self.grid.records[-1], 'n')
+        return self.current_url(onpage=next_page, perpage=self.grid.per_page, cursor=cursor)
 
     def paging_img_next(self):
         img_url = self.manager.static_url('b_nextpage.png')
@@ -333,7 +404,8 @@ class HTML(object):
         return _HTML.img(src=img_url, width=8, height=13, alt='>')
 
     def paging_url_last(self):
-        return self.current_url(onpage=self.grid.page_count, perpage=self.grid.per_page)
+        return self.current_url(onpage=self.grid.page_count, perpage=self.grid.per_page,
+                                cursor=None)
 
     def paging_img_last(self):
         img_url = self.manager.static_url('b_lastpage.png')
@@ -392,13 +464,14 @@ class HTML(object):
         for rownum, record in enumerate(self.grid.records):
             rows.append(self.table_tr(rownum, record))
         # process subtotals (if any)
+        # totals are None when they ran over the grid's query budget
         if rows and self.grid.subtotals in ('page', 'all') and \
-                self.grid.subtotal_cols:
+                self.grid.subtotal_cols and self.grid.page_totals is not None:
             rows.append(
                 self.table_pagetotals(rownum + 1, self.grid.page_totals)
             )
         if rows and self.grid.subtotals in ('grand', 'all') and \
-                self.grid.subtotal_cols:
+                self.grid.subtotal_cols and self.grid.grand_totals is not None:
             rows.append(
                 self.table_grandtotals(rownum + 2, self.grid.grand_totals)
             )
@@ -481,10 +554,8 @@ class HTML(object):
         col_hah = HTMLAttributes(col.body.hah)
 
         # allow column stylers to set attributes
-        for styler, cname in self.grid._colstylers:
-            for_column = self.grid.column(cname)
-            if col.key == for_column.key:
-                styler(self.grid, col_hah, record)
+        for styler in col.col_stylers:
+            styler(self.grid, col_hah, record)
 
         # extract the value from the record for this column and prep
         col_value = col.render('html', record, col_hah)
@@ -552,6 +623,7 @@ class HTML(object):
         url_args = {}
         url_args['perpage'] = None
         url_args['onpage'] = None
+        url_args['cursor'] = None
         url_args['sort1'] = None
         url_args['sort2'] = None
         url_args['sort3'] = None
@@ -590,7 +662,8 @@ class XLS(object):
         return self.build_sheet()
 
     def can_render(self):
-        total_rows = self.grid.record_count + 1
+        # an unknown count (see BaseGrid.count_over_budget) isn't checked
+        total_rows = (self.grid.record_count or 0) + 1
         if self.grid.subtotals != 'none':
             total_rows += 1
         return total_rows <= 65536 and sum(1 for _ in self.grid.iter_columns('xls')) <= 256
@@ -661,9 +734,10 @@ class XLS(object):
     def body_records(self, xlh):
         # turn off paging
         self.grid.set_paging(None, None)
+        self.grid.set_render_target('xls')
 
         rownum = 0
-        for rownum, record in enumerate(self.grid.records):
+        for rownum, record in enumerate(self.grid.iter_records()):
             self.record_row(xlh, rownum, record)
 
         # totals
@@ -689,9 +763,12 @@ class XLS(object):
                 continue
             if firstcol:
                 numrecords = self.grid.record_count
-                bufferval = ngettext('Totals ({num} record):',
-                                     'Totals ({num} records):',
-                                     numrecords)
+                if numrecords is None:
+                    bufferval = _('Totals:')
+                else:
+                    bufferval = ngettext('Totals ({num} record):',
+                                         'Totals ({num} records):',
+                                         numrecords)
                 xlh.ws.write_merge(
                     xlh.rownum,
                     xlh.rownum,
@@ -803,7 +880,8 @@ class XLSX(object):
             return self.build_sheet(wb)
 
     def can_render(self):
-        total_rows = self.grid.record_count + 1
+        # an unknown count (see BaseGrid.count_over_budget) isn't checked
+        total_rows = (self.grid.record_count or 0) + 1
         if self.grid.subtotals != 'none':
             total_rows += 1
         return total_rows <= 1048576 and sum(1 for _ in self.grid.iter_columns('xlsx')) <= 16384
@@ -831,9 +909,10 @@ class XLSX(object):
     def body_records(self, xlh, wb):
         # turn off paging
         self.grid.set_paging(None, None)
+        self.grid.set_render_target('xlsx')
 
         rownum = 0
-        for rownum, record in enumerate(self.grid.records):
+        for rownum, record in enumerate(self.grid.iter_records()):
             self.record_row(xlh, rownum, record, wb)
 
         # totals
@@ -865,10 +944,13 @@ class XLSX(object):
                 continue
             if firstcol:
                 numrecords = self.grid.record_count
-                bufferval = 'Totals ({0} record{1}):'.format(
-                    numrecords,
-                    's' if numrecords != 1 else '',
-                )
+                if numrecords is None:
+                    bufferval = 'Totals:'
+                else:
+                    bufferval = 'Totals ({0} record{1}):'.format(
+                        numrecords,
+                        's' if numrecords != 1 else '',
+                    )
                 if colspan > 1:
                     xlh.ws.merge_range(
                         xlh.rownum,
@@ -938,8 +1020,9 @@ class CSV(object):
     def body_records(self):
         # turn off paging
         self.grid.set_paging(None, None)
+        self.grid.set_render_target('csv')
 
-        for rownum, record in enumerate(self.grid.records):
+        for rownum, record in enumerate(self.grid.iter_records()):
             row = []
             for col in self.grid.iter_columns('csv'):
                 row.append(col.render('csv', record))
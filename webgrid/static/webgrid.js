@@ -80,6 +80,9 @@ function datagrid_activate_mselect_ui(jq_select) {
         jq_select.parent().find('.ms-parent > button, .ms-drop').each(function() {
             $(this).css('width', $(this).width() + 60);
         });
+        if (jq_select.data('options-url')) {
+            datagrid_wire_option_search(jq_select);
+        }
     }
     jq_select.attr('multiple', 'multiple');
     if ( use_all_opt ) {
@@ -87,6 +90,44 @@ function datagrid_activate_mselect_ui(jq_select) {
     }
 }
 
+/*
+ datagrid_wire_option_search()
+
+ Called when the multi-select UI is created for a select whose filter has too many
+ options to render. Typing in the search box fetches matching options from the
+ select's data-options-url and adds them to the select.
+
+*/
+function datagrid_wire_option_search(jq_select) {
+    var mselect = jq_select.data('multipleSelect');
+    var timer = null;
+    // the drop element stays while the search box is rebuilt by refresh
+    mselect.$drop.on('keyup', '.ms-search input', function() {
+        var term = $.trim($(this).val());
+        clearTimeout(timer);
+        if (term == '') return;
+        timer = setTimeout(function() {
+            $.getJSON(jq_select.data('options-url'), {q: term}, function(data) {
+                var added = false;
+                $.each(data.options, function(idx, option) {
+                    var value = String(option.value);
+                    if (jq_select.find('option').filter(function() {
+                        return this.value == value;
+                    }).length == 0) {
+                        jq_select.append($('<option>').val(value).text(option.label));
+                        added = true;
+                    }
+                });
+                if (added) {
+                    jq_select.multipleSelect('refresh');
+                    mselect.$searchInput.val(term).focus();
+                    mselect.filter();
+                }
+            });
+        }, 250);
+    });
+}
+
 /*
  datagrid_add_filter()
 
@@ -0,0 +1,189 @@
+"""
+    Timing comparisons for grid query strategies. These are not collected as tests, run them
+    with:
+
+        python -m webgrid.tests.benchmarks [benchmark name ...]
+"""
+from __future__ import absolute_import, print_function
+
+import inspect
+import multiprocessing
+from os import path
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+import sqlalchemy as sa
+
+from webgrid import Column
+from webgrid.cache import MemoryCache, query_stats
+from webgrid.filters import DateFilter, FilterBase, IntFilter, OptionsFilterBase, TextFilter
+from webgrid_ta.app import create_app
+from webgrid_ta.grids import Grid
+from webgrid_ta.model.entities import Person
+
+from .helpers import FileDBManager
+
+
+def report(name, seconds, renders):
+    print('{0:<40} {1:>10.1f} ms/render'.format(name, seconds * 1000 / renders))
+
+
+def concurrent_queries(rows=50000, renders=10, latencies=(0, 0.05)):
+    """
+        Count, records, and totals queries for a filtered page of a file-backed SQLite table,
+        run one after another and then at the same time.
+
+        SQLite runs in-process, so the queries only overlap as far as there are CPU cores for
+        them. Each statement can also be delayed by a simulated network round trip (seconds in
+        latencies), which is where a database server gains the most.
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        manager = FileDBManager(path.join(tmpdir, 'bench.db'))
+        manager.engine.execute(Person.__table__.insert(), [
+            {'firstname': 'fn{0}'.format(x), 'numericcol': x % 100, 'floatcol': x % 7 + 1}
+            for x in range(rows)
+        ])
+
+        class BenchGrid(Grid):
+            subtotals = 'all'
+            Column('First Name', Person.firstname, TextFilter)
+            Column('Numeric', Person.numericcol, has_subtotal=True)
+            Column('Ratio', Person.floatcol.label('ratio'),
+                   has_subtotal='sum(numericcol) / sum(ratio)')
+
+            def query_prep(self, query, has_sort, has_filters):
+                return query.order_by(Person.firstname)
+
+        BenchGrid.manager = manager
+
+        def render(concurrent):
+            g = BenchGrid()
+            g.concurrent_queries = concurrent
+            g.set_filter('firstname', 'contains', '7')
+            g.run_queries()
+            g.record_count, g.records, g.page_totals, g.grand_totals
+
+        print('{0} rows, {1} renders, {2} CPUs'.format(rows, renders, multiprocessing.cpu_count()))
+        for latency in latencies:
+            def round_trip(*args):
+                time.sleep(latency)
+            sa.event.listen(manager.engine, 'before_cursor_execute', round_trip)
+            for label, concurrent in (('sequential', None), ('concurrent (4 threads)', 4)):
+                render(concurrent)
+                report(
+                    '{0}, {1:.0f} ms latency'.format(label, latency * 1000),
+                    timeit.timeit(lambda: render(concurrent), number=renders),
+                    renders
+                )
+            sa.event.remove(manager.engine, 'before_cursor_execute', round_trip)
+    finally:
+        manager.session.close()
+        manager.engine.dispose()
+        shutil.rmtree(tmpdir)
+
+
+def query_reuse(renders=200):
+    """
+        Query build and compile counts for rendering a page of PeopleGrid with totals and a
+        result cache, as reported by webgrid.cache.query_stats
+    """
+    from webgrid_ta.grids import PeopleGrid
+    from webgrid_ta.model import load_db
+    load_db()
+
+    class BenchGrid(PeopleGrid):
+        subtotals = 'all'
+        result_cache = MemoryCache()
+
+    query_stats.reset()
+    for x in range(renders):
+        g = BenchGrid()
+        g.set_filter('firstname', 'contains', str(x % 10))
+        g.html()
+
+    print('{0} renders'.format(renders))
+    for kind, stats in sorted(query_stats.summary.items()):
+        print('{0:<8} {count:>6} made {reuses:>6} reused {seconds:>8.3f}s spent'
+              ' {saved_seconds:>8.3f}s saved'.format(kind, **stats))
+
+
+def _capture_init_args(filter):
+    # the previous FilterBase.__init__ code: find the outermost __init__ call of the filter
+    #   and store the arguments it was called with
+    outermost = None
+    frame = inspect.currentframe().f_back
+    while frame:
+        if frame.f_code.co_name != '__init__' or \
+                not isinstance(frame.f_locals.get('self'), FilterBase):
+            break
+        outermost = inspect.getargvalues(frame)
+        frame = frame.f_back
+
+    filter._vargs = [outermost.locals[a] for a in outermost.args[1:]] + \
+        list(outermost.locals[outermost.varargs] if outermost.varargs else [])
+    filter._kwargs = outermost.locals[outermost.keywords] if outermost.keywords else {}
+
+
+def grid_construction(filters=30, constructions=300):
+    """
+        Constructing a grid with filters on all of its columns. "previous" runs copies of the
+        code this replaced, which looked up each filter's arguments by walking its __init__
+        frames and each column's __init__ argument names with inspect on every construction.
+    """
+    class StateFilter(OptionsFilterBase):
+        options_from = (('in', 'IN'), ('ky', 'KY'))
+
+    filter_classes = (TextFilter, IntFilter, DateFilter, StateFilter)
+    filter_cols = (Person.firstname, Person.id, Person.due_date, Person.state)
+
+    def previous_filter(filter_cls):
+        def __init__(self, *args, **kwargs):
+            filter_cls.__init__(self, *args, **kwargs)
+            _capture_init_args(self)
+        return type(filter_cls.__name__, (filter_cls,), {'__init__': __init__})
+
+    class PreviousColumn(Column):
+        @classmethod
+        def init_arg_names(cls):
+            return inspect.getfullargspec(cls.__init__).args
+
+    def grid_class(previous):
+        column_cls = PreviousColumn if previous else Column
+        classes = [previous_filter(cls) if previous else cls for cls in filter_classes]
+
+        class BenchGrid(Grid):
+            for x in range(filters):
+                column_cls('Column {0}'.format(x), Person.firstname.label('col{0}'.format(x)),
+                           classes[x % 4](filter_cols[x % 4]))
+            del x
+        return BenchGrid
+
+    print('{0} filters, {1} constructions'.format(filters, constructions))
+    for label, previous in (('previous', True), ('current', False)):
+        BenchGrid = grid_class(previous)
+        BenchGrid()
+        seconds = min(timeit.repeat(BenchGrid, number=constructions, repeat=5))
+        print('{0:<40} {1:>10.3f} ms/grid'.format(label, seconds * 1000 / constructions))
+
+
+BENCHMARKS = {
+    'concurrent_queries': concurrent_queries,
+    'grid_construction': grid_construction,
+    'query_reuse': query_reuse,
+}
+
+
+def main(names):
+    app = create_app(config='Test')
+    with app.test_request_context():
+        for name in names or sorted(BENCHMARKS):
+            print('== {0}'.format(name))
+            BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
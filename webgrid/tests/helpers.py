@@ -8,6 +8,7 @@ import sqlalchemy.orm
 from werkzeug.datastructures import MultiDict
 import wrapt
 
+from webgrid.flask import WebGrid
 from webgrid_ta.model import db
 
 cdir = opath.dirname(__file__)
@@ -26,6 +27,25 @@ class ModelBase(object):
         db_sess_scope.pop()
 
 
+class FileDBManager(WebGrid):
+    """
+        Manager for grids on a file-backed SQLite database, which (unlike the in-memory test
+        database) can be shared by connections on other threads
+    """
+
+    def __init__(self, db_path, **kwargs):
+        super(FileDBManager, self).__init__(db, **kwargs)
+        self.engine = sqlalchemy.create_engine('sqlite:///{0}'.format(db_path))
+        db.Model.metadata.create_all(self.engine)
+        self.session = sqlalchemy.orm.Session(bind=self.engine)
+
+    def sa_query(self, *args, **kwargs):
+        return self.session.query(*args, **kwargs)
+
+    def concurrent_session_factory(self):
+        return sqlalchemy.orm.sessionmaker(bind=self.engine, expire_on_commit=False)
+
+
 def query_to_str(statement, bind=None):
     """
         returns a string of a sqlalchemy.orm.Query with parameters bound
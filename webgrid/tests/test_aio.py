@@ -0,0 +1,136 @@
+from __future__ import absolute_import
+
+from os import path
+import shutil
+import sys
+import tempfile
+import threading
+
+
+if sys.version_info >= (3, 7):
+    import asyncio
+
+    from nose.tools import eq_, raises
+    import sqlalchemy as sa
+    from werkzeug.test import EnvironBuilder
+    from werkzeug.wrappers import Request
+
+    from webgrid import Column
+    from webgrid.aio import AsyncBaseGrid, AsyncWebGrid
+    from webgrid.filters import TextFilter
+    from webgrid.renderers import CSV
+    from webgrid_ta.model.entities import Email, Person, db
+
+    def make_request(url):
+        return Request(EnvironBuilder(url).get_environ())
+
+    class TestAsyncGrid(object):
+        @classmethod
+        def setup_class(cls):
+            cls.tmpdir = tempfile.mkdtemp()
+            engine = sa.create_engine('sqlite:///{0}'.format(path.join(cls.tmpdir, 'grid.db')))
+            db.Model.metadata.create_all(engine)
+            session = sa.orm.Session(bind=engine)
+            for x in range(5):
+                person = Person(firstname='fn{0}'.format(x), numericcol=x)
+                person.emails.append(Email(email='fn{0}@example.com'.format(x)))
+                session.add(person)
+            session.commit()
+            session.close()
+            cls.manager = AsyncWebGrid(engine)
+
+            class AG(AsyncBaseGrid):
+                manager = cls.manager
+                subtotals = 'all'
+                allowed_export_targets = {'csv': CSV}
+                Column('First Name', Person.firstname, TextFilter)
+                Column('Numeric', Person.numericcol, has_subtotal=True)
+
+                def query_prep(self, query, has_sort, has_filters):
+                    return query.add_entity(Person).order_by(Person.id)
+            cls.AG = AG
+
+        @classmethod
+        def teardown_class(cls):
+            cls.manager.db.engine.dispose()
+            shutil.rmtree(cls.tmpdir)
+
+        def setup(self):
+            self.threads = []
+            sa.event.listen(self.manager.db.engine, 'before_cursor_execute', self.record_thread)
+
+        def teardown(self):
+            sa.event.remove(self.manager.db.engine, 'before_cursor_execute', self.record_thread)
+
+        def record_thread(self, *args):
+            self.threads.append(threading.current_thread().ident)
+
+        def run(self, coro_func, url='/'):
+            async def in_request():
+                self.manager.bind_request(make_request(url))
+                return await coro_func()
+            return asyncio.run(in_request())
+
+        def test_build_prefetches(self):
+            async def build():
+                g = self.AG(per_page=2)
+                await g.build()
+                executed = len(self.threads)
+                html = g.html()
+                eq_(len(self.threads), executed)
+                return g, html, threading.current_thread().ident
+
+            g, html, loop_thread = self.run(build, '/?onpage=2')
+            assert self.threads
+            assert loop_thread not in self.threads
+            assert 'fn3' in html
+
+            eq_(g.record_count, 5)
+            eq_([r.firstname for r in g.records], ['fn2', 'fn3'])
+            eq_(g.page_totals.numericcol, 5)
+            eq_(g.grand_totals.numericcol, 10)
+            # lazy loads work on the prefetched entities
+            eq_(g.records[0].Person.emails[0].email, 'fn2@example.com')
+            # the lazy load checked out a connection on this thread, give it back
+            sa.orm.object_session(g.records[0].Person).close()
+
+        def test_awaitable_results(self):
+            async def results():
+                g = self.AG(per_page=2)
+                g.set_filter('firstname', 'eq', 'fn1')
+                return (
+                    await g.get_record_count(),
+                    [r.firstname for r in await g.get_records()],
+                    (await g.get_grand_totals()).numericcol,
+                )
+
+            eq_(self.run(results), (1, ['fn1'], 1))
+
+        def test_flash_message(self):
+            async def build():
+                g = self.AG()
+                await g.build()
+                return self.manager.request_state().messages
+
+            messages = self.run(build, '/?op(firstname)=foo&v1(firstname)=bar')
+            eq_(len(messages), 1)
+            assert messages[0][1].startswith('First Name: Value must be one of')
+
+        def test_export(self):
+            async def export():
+                g = self.AG()
+                await g.build()
+                return g, await g.export_as_response()
+
+            g, (stream, headers) = self.run(export, '/?export_to=csv')
+            assert g._records is None
+            eq_(dict(headers)['Content-Type'], 'text/csv')
+            eq_(len(stream.read().decode('utf-8').splitlines()), 6)
+
+        @raises(RuntimeError)
+        def test_no_request(self):
+            self.manager.request_args()
+
+        @raises(RuntimeError)
+        def test_sync_access_needs_session(self):
+            self.AG().records
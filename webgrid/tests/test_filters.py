@@ -3,13 +3,17 @@ import datetime as dt
 from decimal import Decimal as D
 
 from blazeutils.testing import raises
+from dateutil.parser import parse
 import formencode
+import mock
 from nose.tools import eq_, assert_raises
+from sqlalchemy.dialects import mssql, mysql, oracle, postgresql
 from .helpers import query_to_str
 
+from webgrid.cache import MemoryCache
 from webgrid.filters import Operator
 from webgrid.filters import OptionsFilterBase, TextFilter, IntFilter, NumberFilter, DateFilter, \
-    DateTimeFilter, FilterBase, TimeFilter, YesNoFilter, OptionsEnumFilter
+    DateTimeFilter, FilterBase, TimeFilter, YesNoFilter, OptionsEnumFilter, FullTextFilter
 from webgrid_ta.model.entities import ArrowRecord, Person, db, AccountType
 
 from .helpers import ModelBase
@@ -174,6 +178,151 @@ class TestTextFilterWithCaseSensitiveDialect(CheckFilterBase):
         self.assert_in_query(query, "WHERE lower(persons.firstname) NOT LIKE lower('%foo%')")
 
 
+class TestTextFilterCaseStrategies(CheckFilterBase):
+    def get_filter(self, dialect_name='sqlite', **kwargs):
+        class MockDialect:
+            name = dialect_name
+        return TextFilter(Person.firstname, **kwargs).new_instance(dialect=MockDialect())
+
+    def test_collation(self):
+        tf = self.get_filter(case_strategy='collation', collation='NOCASE')
+        tf.set('eq', 'foo')
+        self.assert_filter_query(tf, 'WHERE (persons.firstname COLLATE "NOCASE") = \'foo\'')
+        tf.set('!eq', 'foo')
+        self.assert_filter_query(tf, 'WHERE (persons.firstname COLLATE "NOCASE") != \'foo\'')
+
+    def test_case_insensitive_column(self):
+        tf = self.get_filter('postgresql', case_strategy='collation')
+        tf.set('eq', 'foo')
+        self.assert_filter_query(tf, "WHERE persons.firstname = 'foo'")
+
+    def test_shadow(self):
+        tf = self.get_filter(case_strategy='shadow', shadow_col=Person.lastname)
+        tf.set('eq', 'foo')
+        self.assert_filter_query(tf, "WHERE persons.last_name = 'FOO'")
+        tf.set('contains', 'foo')
+        self.assert_filter_query(tf, "WHERE persons.last_name LIKE '%FOO%'")
+
+    def test_positional_args(self):
+        # the FilterBase arguments keep their positions
+        tf = TextFilter(Person.firstname, 'contains', 'foo').new_instance()
+        eq_(tf.case_strategy, 'upper')
+        tf.set(None, None)
+        eq_((tf.op, tf.value1), ('contains', 'foo'))
+
+    def test_bad_strategy(self):
+        with assert_raises(ValueError):
+            TextFilter(Person.firstname, case_strategy='lower')
+        with assert_raises(ValueError):
+            TextFilter(Person.firstname, case_strategy='shadow')
+
+    def test_index_ddl(self):
+        eq_(TextFilter(Person.firstname).index_ddl('postgresql'),
+            ['CREATE INDEX ix_persons_firstname_upper ON persons (upper(firstname))'])
+        eq_(TextFilter(Person.firstname, case_strategy='collation', collation='NOCASE')
+            .index_ddl('sqlite'),
+            ['CREATE INDEX ix_persons_firstname_nocase ON persons (firstname COLLATE "NOCASE")'])
+        eq_(TextFilter(Person.firstname, case_strategy='collation').index_ddl('postgresql'),
+            ['CREATE INDEX ix_persons_firstname_ci ON persons (firstname)'])
+        eq_(TextFilter(Person.firstname, case_strategy='shadow', shadow_col=Person.lastname)
+            .index_ddl('sqlite'),
+            ['CREATE INDEX ix_persons_last_name_shadow ON persons (last_name)'])
+        # the DDL doesn't add indexes to the model's metadata
+        eq_(Person.__table__.indexes, set())
+
+    def check_index_used(self, index_name, **kwargs):
+        tf = TextFilter(Person.firstname, **kwargs)
+        for stmt in tf.index_ddl('sqlite'):
+            db.session.execute(stmt)
+        try:
+            tf = tf.new_instance(dialect=db.engine.dialect)
+            tf.set('eq', 'bOB')
+            query = tf.apply(db.session.query(Person.firstname))
+            eq_([row.firstname for row in query], ['Bob'])
+            compiled = query.statement.compile(dialect=db.engine.dialect,
+                                               compile_kwargs={'literal_binds': True})
+            plan = db.session.execute('EXPLAIN QUERY PLAN {0}'.format(compiled)).fetchall()
+            assert 'USING COVERING INDEX {0}'.format(index_name) in plan[0][-1] \
+                or 'USING INDEX {0}'.format(index_name) in plan[0][-1], plan
+        finally:
+            db.session.execute('DROP INDEX {0}'.format(index_name))
+
+    def test_sqlite_indexes_used(self):
+        Person.delete_cascaded()
+        Person.testing_create('Bob')
+        Person.testing_create('Alice')
+        self.check_index_used('ix_persons_firstname_upper')
+        self.check_index_used('ix_persons_firstname_nocase', case_strategy='collation',
+                              collation='NOCASE')
+
+
+class TestFullTextFilter(CheckFilterBase):
+    def get_filter(self, dialect_name='sqlite', **kwargs):
+        class MockDialect:
+            name = dialect_name
+        return FullTextFilter(Person.firstname, **kwargs).new_instance(dialect=MockDialect())
+
+    def test_like_fallback(self):
+        ff = self.get_filter()
+        ff.set('search', ' foo ')
+        eq_(ff.value1, 'foo')
+        self.assert_filter_query(ff, "WHERE lower(persons.firstname) LIKE lower('%foo%')")
+
+    def test_sqlite_fts(self):
+        ff = self.get_filter(fts_table='persons_fts')
+        ff.set('search', 'foo "bar')
+        self.assert_filter_query(
+            ff, 'WHERE persons.id IN (SELECT rowid \nFROM persons_fts \nWHERE persons_fts MATCH '
+            '\'"foo" """bar"\')'
+        )
+
+    def test_sqlite_trigram(self):
+        ff = self.get_filter(mode='trigram', fts_table='persons_trgm')
+        ff.set('search', 'foo bar')
+        self.assert_filter_query(ff, 'WHERE persons_trgm MATCH \'"foo bar"\'')
+
+        # the trigram tokenizer can't match fewer than three characters
+        ff.set('search', 'fo')
+        self.assert_filter_query(ff, "WHERE lower(persons.firstname) LIKE lower('%fo%')")
+
+    def test_postgresql(self):
+        ff = self.get_filter('postgresql', config='simple')
+        ff.set('search', 'foo')
+        self.assert_filter_query(
+            ff, "WHERE to_tsvector('simple', persons.firstname) @@ plainto_tsquery('simple', 'foo')"
+        )
+
+    def test_empty(self):
+        ff = self.get_filter()
+        ff.set('empty', None)
+        self.assert_filter_query(ff, "WHERE persons.firstname IS NULL OR persons.firstname = ''")
+
+    def test_no_value(self):
+        ff = self.get_filter()
+        ff.set('search', '  ')
+        assert not ff.is_active
+
+    def test_bad_mode(self):
+        with assert_raises(ValueError):
+            FullTextFilter(Person.firstname, mode='soundex')
+
+    def test_index_ddl(self):
+        eq_(FullTextFilter(Person.lastname).index_ddl('postgresql'), [
+            "CREATE INDEX ix_persons_last_name_fts ON persons "
+            "USING gin (to_tsvector('english', last_name))"
+        ])
+        eq_(FullTextFilter(Person.lastname, mode='trigram').index_ddl('postgresql')[1],
+            'CREATE INDEX ix_persons_last_name_trgm ON persons USING gin (last_name gin_trgm_ops)')
+        eq_(FullTextFilter(Person.lastname, mode='trigram', fts_table='persons_trgm')
+            .index_ddl('sqlite'), [
+                "CREATE VIRTUAL TABLE persons_trgm USING fts5(last_name, content='persons', "
+                "content_rowid='id', tokenize='trigram')",
+                "INSERT INTO persons_trgm(persons_trgm) VALUES ('rebuild')",
+        ])
+        with assert_raises(ValueError):
+            FullTextFilter(Person.lastname).index_ddl('sqlite')
+
+
 class TestNumberFilters(CheckFilterBase):
     """
         Testing IntFilter mostly because the other classes inherit from the same base,
@@ -860,6 +1009,54 @@ class TestDateTimeFilter(CheckFilterBase):
         eq_(filter.description, 'Jan 2012')
 
 
+class TestDateParsing(CheckFilterBase):
+    def test_strict_formats(self):
+        with mock.patch('webgrid.filters.parse') as m_parse:
+            for value in ('12/31/2018', '2018-12-31', '2018-12-31T10:00:00.5'):
+                filter = DateFilter(Person.due_date)
+                filter.set('eq', value)
+                eq_(filter.value1, dt.date(2018, 12, 31))
+            filter = DateTimeFilter(Person.createdts)
+            filter.set('eq', '12/31/2018 10:30 PM')
+            eq_(filter.value1, dt.datetime(2018, 12, 31, 22, 30))
+        assert not m_parse.called
+
+    def test_fallback_cached(self):
+        with mock.patch('webgrid.filters.parse', wraps=parse) as m_parse:
+            for _ in range(3):
+                filter = DateFilter(Person.due_date)
+                filter.set('eq', 'Dec 30 2018')
+                eq_(filter.value1, dt.date(2018, 12, 30))
+        eq_(m_parse.call_count, 1)
+
+    def test_no_fallback(self):
+        class StrictDateFilter(DateTimeFilter):
+            input_formats = ('%d.%m.%Y', '%d.%m.%Y %H:%M')
+            parse_fallback = False
+
+        filter = StrictDateFilter(Person.createdts)
+        filter.set('eq', '31.12.2018 14:30')
+        eq_(filter.value1, dt.datetime(2018, 12, 31, 14, 30))
+
+        filter = StrictDateFilter(Person.createdts)
+        with assert_raises(formencode.Invalid):
+            filter.set('eq', '12/31/2018')
+
+    def test_time_formats(self):
+        class TwentyFourHourFilter(TimeFilter):
+            input_formats = ('%H:%M',)
+
+        filter = TwentyFourHourFilter(Person.start_time)
+        filter.set('eq', '14:30')
+        eq_(filter.value1, dt.time(14, 30))
+        filter.set('eq', '2:30 pm')
+        eq_(filter.value1, dt.time(14, 30))
+
+        filter = TimeFilter(Person.start_time)
+        with assert_raises(formencode.Invalid):
+            filter.set('eq', '14:30')
+
+
 class TestTimeFilter(CheckFilterBase):
     def test_eq(self):
         filter = TimeFilter(Person.start_time)
@@ -1042,6 +1239,133 @@ class TestOptionsFilter(CheckFilterBase):
         self.assert_filter_query(filter, "WHERE persons.sortorder IN (1, 2)")
 
 
+class TestLargeInList(CheckFilterBase):
+    class IDFilter(OptionsFilterBase):
+        in_list_threshold = 2
+
+        def options_from(self):
+            return [(person.id, person.firstname) for person in Person.query]
+
+    @classmethod
+    def setup_class(cls):
+        super(TestLargeInList, cls).setup_class()
+        Person.delete_cascaded()
+        cls.ids = [Person.testing_create('fn{0}'.format(i)).id for i in range(4)]
+
+    def get_filter(self, op, values, dialect=None):
+        filter = self.IDFilter(Person.id).new_instance(dialect=dialect or db.engine.dialect)
+        filter.set(op, [str(value) for value in values])
+        return filter
+
+    def names(self, filter):
+        return sorted(row.firstname for row in filter.apply(db.session.query(Person.firstname)))
+
+    def test_below_threshold(self):
+        filter = self.get_filter('is', self.ids[:2])
+        self.assert_filter_query(filter, 'WHERE persons.id IN ({0}, {1})'.format(*self.ids))
+
+    def test_sqlite_json(self):
+        filter = self.get_filter('is', self.ids[:3])
+        self.assert_filter_query(filter, 'WHERE persons.id IN (SELECT value \nFROM json_each(')
+        eq_(self.names(filter), ['fn0', 'fn1', 'fn2'])
+
+        filter = self.get_filter('!is', self.ids[:3])
+        eq_(self.names(filter), ['fn3'])
+
+    def test_postgresql_array(self):
+        filter = self.get_filter('is', self.ids[:3], dialect=postgresql.dialect())
+        clause = filter.in_clause(db.session.query(Person.id))
+        eq_(str(clause.compile(dialect=postgresql.dialect())),
+            'persons.id = ANY (%(in_list_1)s::INTEGER[])')
+
+    def test_other_dialects_in_list(self):
+        # dialects without a verified in_list_<dialect> keep the bound IN list
+        for dialect in (mssql.dialect(), oracle.dialect(), mysql.dialect()):
+            filter = self.get_filter('is', self.ids[:3], dialect=dialect)
+            clause = filter.in_clause(db.session.query(Person.id))
+            sql = str(clause.compile(dialect=dialect))
+            assert sql.startswith('persons.id IN ('), sql
+            assert 'TEMPORARY' not in sql and 'SELECT' not in sql, sql
+
+    def test_values_parsed_once(self):
+        filter = self.get_filter('is', self.ids[:2] * 3 + ['foo', -5])
+        eq_(filter.value1, self.ids[:2])
+
+
+class TestOptionsCache(CheckFilterBase):
+    def get_filter_cls(self, **attrs):
+        calls = []
+
+        class CountingFilter(OptionsFilterBase):
+            cache_options = True
+            options_cache = MemoryCache()
+
+            def options_from(self):
+                calls.append(1)
+                return db.session.query(Person.id, Person.firstname).order_by(Person.id)
+
+        for name, value in attrs.items():
+            setattr(CountingFilter, name, value)
+        return CountingFilter, calls
+
+    @classmethod
+    def setup_class(cls):
+        super(TestOptionsCache, cls).setup_class()
+        Person.delete_cascaded()
+        cls.person_id = Person.testing_create('fn1').id
+
+    def test_cached(self):
+        CountingFilter, calls = self.get_filter_cls()
+        static = CountingFilter(Person.id)
+        filter = static.new_instance()
+        eq_(filter.options_seq, [(self.person_id, 'fn1')])
+        filter = static.new_instance()
+        filter.set('is', [str(self.person_id)])
+        eq_(filter.value1, [self.person_id])
+        eq_(len(calls), 1)
+
+        # cached per constructor arguments
+        CountingFilter(Person.sortorder).new_instance()
+        CountingFilter(Person.id, default_op='is').new_instance()
+        eq_(len(calls), 3)
+
+    def test_invalidate(self):
+        CountingFilter, calls = self.get_filter_cls()
+        CountingFilter(Person.id).new_instance()
+        CountingFilter.invalidate_options()
+        CountingFilter(Person.id).new_instance()
+        eq_(len(calls), 2)
+
+    def test_ttl(self):
+        CountingFilter, calls = self.get_filter_cls(options_cache_ttl=0)
+        CountingFilter(Person.id).new_instance()
+        CountingFilter(Person.id).new_instance()
+        eq_(len(calls), 2)
+
+    def test_size_bound(self):
+        CountingFilter, calls = self.get_filter_cls(options_cache=MemoryCache(max_size=2))
+        CountingFilter(Person.id).new_instance()
+        CountingFilter(Person.sortorder).new_instance()
+        CountingFilter(Person.id).new_instance()
+        eq_(len(calls), 3)
+
+    def test_per_locale(self):
+        locale = ['en']
+        CountingFilter, calls = self.get_filter_cls(
+            options_cache_locale=lambda self: locale[0])
+        CountingFilter(Person.id).new_instance()
+        locale[0] = 'es'
+        CountingFilter(Person.id).new_instance()
+        CountingFilter(Person.id).new_instance()
+        eq_(len(calls), 2)
+
+    def test_off(self):
+        CountingFilter, calls = self.get_filter_cls(cache_options=False)
+        CountingFilter(Person.id).new_instance()
+        CountingFilter(Person.id).new_instance()
+        eq_(len(calls), 2)
+
+
 class TestEnumFilter(CheckFilterBase):
     @raises(ValueError)
     def test_create_without_enum_type(self):
@@ -1097,6 +1421,56 @@ class TestIntrospect(CheckFilterBase):
 
         assert tf1 is not tf2
 
+    def test_new_instance_replays_args(self):
+        tf1 = TextFilter(Person.firstname, 'eq', case_strategy='collation')
+        tf1.set('eq', 'foo')
+
+        init_calls = []
+
+        class SpyFilter(TextFilter):
+            def __init__(self, *args, **kwargs):
+                init_calls.append(args)
+                super(SpyFilter, self).__init__(*args, **kwargs)
+
+        tf2 = tf1.new_instance(dialect='dialect')
+        eq_(tf2.case_strategy, 'collation')
+        eq_(tf2._default_op, 'eq')
+        eq_(tf2.dialect, 'dialect')
+        # the per-request state starts fresh
+        eq_(tf2.op, None)
+        eq_(tf2.value1, None)
+
+        # arguments are recorded once, subclasses' __init__ gets them again
+        sf1 = SpyFilter(Person.firstname, 'eq')
+        sf1.new_instance()
+        eq_(init_calls, [(Person.firstname, 'eq'), (Person.firstname, 'eq')])
+
+    def test_new_instance_options_state(self):
+        class DateOptions(OptionsFilterBase):
+            def options_from(self):
+                return [(1, 'One')]
+
+        df1 = DateOptions(Person.sortorder).new_instance()
+        eq_(df1.option_keys, [1])
+        df2 = df1.new_instance()
+        assert df2._options_keys is not df1._options_keys
+        eq_(df2.option_keys, [1])
+
+    def test_new_instance_init_attrs(self):
+        class TestFilter(FilterBase):
+            init_attrs_for_instance = ('label',)
+
+            def __init__(self, sa_col):
+                super(TestFilter, self).__init__(sa_col)
+                self.seen = []
+
+        tf1 = TestFilter(Person.firstname)
+        tf1.label = 'First'
+        tf1.seen.append(1)
+        tf2 = tf1.new_instance()
+        eq_(tf2.label, 'First')
+        eq_(tf2.seen, [])
+
 
 class TestYesNoFilter(CheckFilterBase):
     def test_y(self):
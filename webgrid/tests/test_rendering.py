@@ -7,11 +7,15 @@ from io import BytesIO
 import six
 
 import arrow
+import flask
+import mock
 from nose.tools import eq_, raises
 from six.moves import range
 import xlrd
 import csv
 import xlsxwriter
+from werkzeug.datastructures import MultiDict
+from werkzeug.urls import url_decode
 
 from webgrid import (
     Column,
@@ -176,6 +180,22 @@ class TestHtmlRenderer(object):
         mg.set_records(key_data)
         eq_html(mg.html.table(), 'basic_table.html')
 
+    @inrequest('/')
+    def test_column_decorators_resolved(self):
+        mg = CarGrid()
+        eq_(mg.column('color').col_filters, [CarGrid.pink_is_ugly])
+        eq_(mg.column('model').col_stylers, [CarGrid.highlight_1500])
+        eq_(mg.column('make').col_filters, [])
+
+        mg.set_records([{'id': 1, 'make': 'ford', 'model': '1500', 'color': 'pink',
+                         'dealer': 'bob', 'dealer_id': '7', 'active': True}])
+        # cells use the resolved functions, without looking up columns
+        with mock.patch.object(mg, 'column') as m_column:
+            html = mg.html.table()
+        assert not m_column.called
+        assert 'pink :(' in html
+        assert 'class="model red"' in html
+
     @inrequest('/')
     def test_people_html(self):
         pg = PeopleGrid()
@@ -275,6 +295,28 @@ class TestHtmlRenderer(object):
         g = self.get_grid()
         eq_('/thepage?onpage=5&perpage=1', g.html.paging_url_last())
 
+    @inrequest('/thepage?perpage=1&onpage=2&cursor=stale')
+    def test_paging_urls_keyset(self):
+        class KG(PeopleGrid):
+            keyset_key = Person.id
+
+        g = KG()
+        g.apply_qs_args()
+        assert 'cursor=' not in g.html.paging_url_first()
+        assert 'cursor=' not in g.html.paging_url_last()
+        # the first page doesn't need a cursor
+        eq_(g.html.paging_url_prev(), '/thepage?onpage=1&perpage=1')
+
+        next_url = g.html.paging_url_next()
+        assert next_url.startswith('/thepage?cursor='), next_url
+        assert next_url.endswith('&onpage=3&perpage=1'), next_url
+
+        flask.request.args = MultiDict(url_decode(next_url.split('?')[1]))
+        g = KG()
+        g.apply_qs_args()
+        eq_(len(g.records), 1)
+        assert 'cursor=' in g.html.paging_url_prev()
+
     @inrequest('/thepage?foo=bar&onpage=5&perpage=10&sort1=1&sort2=2&sort3=3&op(name)=eq&v1(name)'
                '=bob&v2(name)=fred')
     def test_reset_url(self):
@@ -451,6 +493,61 @@ class TestHtmlRenderer(object):
         g.unconfirmed_export_limit = None
         eq_(json.loads(g.html.confirm_export()), {'confirm_export': False, 'record_count': 3})
 
+    @inrequest('/thepage')
+    def test_confirm_export_inexact_count(self):
+        class CG(PeopleGrid):
+            count_strategy = 'capped'
+            count_cap = 1
+            unconfirmed_export_limit = 5
+
+        # there are more than count_cap records, which may be more than the limit
+        g = CG()
+        eq_(json.loads(g.html.confirm_export()), {'confirm_export': True, 'record_count': '1+'})
+
+        class EG(CG):
+            count_strategy = 'estimated'
+
+            def estimate_count_sqlite(self, query):
+                return 1000
+
+        g = EG()
+        eq_(json.loads(g.html.confirm_export()),
+            {'confirm_export': True, 'record_count': '~1,000'})
+
+    @inrequest('/thepage?perpage=1&onpage=2')
+    def test_capped_count_paging(self):
+        class CG(PeopleGrid):
+            count_strategy = 'capped'
+            count_cap = 1
+
+        g = CG()
+        g.apply_qs_args()
+        eq_(g.html.paging_record_count(), '1+')
+        eq_(g.html.paging_select_options()[1].label, '2 of 2+')
+        # more records may follow a full page, but the last page isn't known
+        assert g.html.paging_has_next()
+        html = g.html()
+        assert '<a class="next"' in html
+        assert '<a class="last"' not in html
+
+        g.count_cap = 10000
+        g.clear_record_cache()
+        eq_(g.html.paging_record_count(), 3)
+        assert '<a class="last"' in g.html()
+
+    @inrequest('/thepage')
+    def test_estimated_count_display(self):
+        class EG(PeopleGrid):
+            count_strategy = 'estimated'
+            count_cap = 10
+
+            def estimate_count_sqlite(self, query):
+                return 12345
+
+        g = EG()
+        eq_(g.html.paging_record_count(), '~12,345')
+        eq_(g.html.paging_select_options()[0].label, '1 of ~247')
+
     @inrequest('/thepage')
     def test_grid_rendering(self):
         g = PeopleGrid()
@@ -792,6 +889,14 @@ class TestCSVRenderer(object):
         assert data[0][2] == 'Active'
         assert data[1][0] == 'fn004'
 
+    def test_records_streamed(self):
+        g = PeopleCSVGrid()
+        csv_data = g.csv.build_csv()
+        csv_data.seek(0)
+        rows = csv_data.read().decode('utf-8').splitlines()
+        eq_(len(rows), g.record_count + 1)
+        assert g._records is None
+
     def test_it_renders_date_time_with_tz(self):
         ArrowRecord.query.delete()
         ArrowRecord.testing_create(
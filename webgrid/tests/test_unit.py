@@ -2,19 +2,31 @@ from __future__ import absolute_import
 
 from datetime import datetime
 from decimal import Decimal
+import gc
 from os import path
+import shutil
+import tempfile
+import threading
 
 import flask
 from mock import mock
 from nose.tools import eq_
+from six.moves.urllib.parse import urlencode
+import sqlalchemy as sa
+from sqlalchemy import exc as sa_exc
 import sqlalchemy.sql as sasql
+from sqlalchemy.dialects import postgresql
 from werkzeug.datastructures import MultiDict
 
-from webgrid import Column, BoolColumn, YesNoColumn
-from webgrid.filters import TextFilter, IntFilter
-from webgrid_ta.model.entities import Person, Status, db
-from webgrid_ta.grids import Grid, PeopleGrid
-from .helpers import assert_in_query, assert_not_in_query, query_to_str, inrequest
+from webgrid import Column, BoolColumn, QueryBudgetExceeded, YesNoColumn, _Explain
+from webgrid.cache import MemoryCache, ResultCache, query_stats
+from webgrid.filters import DateTimeFilter, FullTextFilter, IntFilter, OptionsEnumFilter, TextFilter
+from webgrid.flask import WebGrid
+from webgrid_ta.model.entities import AccountType, Email, Person, Status, db
+from webgrid_ta.grids import EmailsColumn, FirstNameColumn, Grid, PeopleGrid, StatusFilter
+from .helpers import (
+    assert_in_query, assert_not_in_query, query_to_str, inrequest, FileDBManager
+)
 from webgrid.renderers import CSV
 
 
@@ -305,6 +317,1710 @@ class TestGrid(object):
             eq_(str(exc), 'No export format set')
 
 
+class TestKeysetPaging(object):
+    class KG(Grid):
+        keyset_key = Person.id
+        per_page = 2
+        Column('ID', Person.id)
+        Column('First Name', Person.firstname)
+        Column('Last Name', Person.lastname)
+
+    @classmethod
+    def setup_class(cls):
+        Status.delete_cascaded()
+        for firstname, lastname in (('ann', 'b'), ('bob', 'a'), ('bob', 'c'), ('cat', 'a'),
+                                    ('cat', 'b'), ('dan', 'a'), ('eve', 'c')):
+            Person.testing_create(firstname, lastname=lastname)
+
+    def offset_pages(self, *sort):
+        g = self.KG()
+        g.set_sort(*sort)
+        pages = []
+        for page in range(1, g.page_count + 1):
+            g.set_paging(2, page)
+            pages.append([r.id for r in g.records])
+        return pages
+
+    def cursor_pages(self, *sort):
+        g = self.KG()
+        g.set_sort(*sort)
+        pages = [[r.id for r in g.records]]
+        for page in range(2, g.page_count + 1):
+            cursor = g.keyset_cursor(g.records[-1], 'n')
+            g.set_paging(2, page, cursor)
+            pages.append([r.id for r in g.records])
+        return g, pages
+
+    def test_tiebreaker_sort(self):
+        g = self.KG()
+        assert_in_query(g, 'ORDER BY persons.id')
+
+        g.set_sort('firstname')
+        assert_in_query(g, 'ORDER BY persons.firstname, persons.id')
+
+    def test_query_prep_told_grid_sorts(self):
+        class KG(self.KG):
+            def query_prep(self, query, has_sort, has_filters):
+                assert has_sort
+                return query
+
+        KG().build_query()
+
+    def test_seek_query(self):
+        g = self.KG()
+        g.set_sort('firstname')
+        g.set_paging(2, 2, g.keyset_cursor(g.records[-1], 'n'))
+        assert_in_query(g, "WHERE (persons.firstname, persons.id) > ('bob', ")
+        assert_in_query(g, 'LIMIT 2 OFFSET 0')
+
+    def test_seek_query_mixed_directions(self):
+        g = self.KG()
+        g.set_sort('firstname', '-lastname')
+        g.set_paging(2, 2, g.keyset_cursor(g.records[-1], 'n'))
+        assert_in_query(g, "WHERE persons.firstname > 'bob' OR persons.firstname = 'bob'"
+                           " AND persons.last_name < 'c' OR persons.firstname = 'bob'"
+                           " AND persons.last_name = 'c' AND persons.id > ")
+
+    def test_pages_match_offset_paging(self):
+        for sort in ((), ('firstname',), ('-firstname',), ('firstname', '-lastname'),
+                     ('-lastname', 'firstname')):
+            g, pages = self.cursor_pages(*sort)
+            eq_(pages, self.offset_pages(*sort))
+
+    def test_previous_page(self):
+        g, pages = self.cursor_pages('lastname', '-firstname')
+        eq_(len(pages), 4)
+        prev_cursor = g.keyset_cursor(g.records[0], 'p')
+        g.set_paging(2, 3, prev_cursor)
+        eq_([r.id for r in g.records], pages[2])
+
+    def test_cursor_dropped_when_sort_changes(self):
+        g = self.KG()
+        g.set_sort('firstname')
+        g.set_paging(2, 2, g.keyset_cursor(g.records[-1], 'n'))
+        assert g.paging_cursor is not None
+
+        g.set_sort('lastname')
+        assert g.paging_cursor is None
+        assert_in_query(g, 'OFFSET 2')
+
+    def test_unseekable_sort_uses_offset(self):
+        class KG(self.KG):
+            Column('Legacy', 'legacy')
+
+            def query_prep(self, query, has_sort, has_filters):
+                return query.add_columns(Person.firstname.label('legacy'))
+
+        g = KG()
+        g.set_sort('legacy')
+        assert g.keyset_cursor(g.records[-1], 'n') is None
+        assert_in_query(g, 'ORDER BY legacy ASC, persons.id')
+
+    @inrequest('/foo?onpage=2&cursor=notacursor')
+    def test_qs_invalid_cursor(self):
+        g = self.KG()
+        g.apply_qs_args()
+        assert g.paging_cursor is None
+        eq_(g.user_warnings[0], '"cursor" grid argument invalid, ignoring')
+
+    def test_qs_cursor(self):
+        g = self.KG()
+        g.set_sort('-firstname')
+        cursor = g.keyset_cursor(g.records[-1], 'n')
+
+        @inrequest('/foo?onpage=2&sort1=-firstname&cursor={0}'.format(cursor))
+        def check():
+            g = self.KG()
+            g.apply_qs_args()
+            eq_(g.paging_cursor['direction'], 'n')
+            eq_([r.firstname for r in g.records], ['cat', 'cat'])
+        check()
+
+
+class StatementsRecorded(object):
+    """ Records the SQL statements run by each test """
+
+    def setup(self):
+        self.statements = []
+        sa.event.listen(db.engine, 'before_cursor_execute', self.record_statement)
+
+    def teardown(self):
+        sa.event.remove(db.engine, 'before_cursor_execute', self.record_statement)
+
+    def record_statement(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+
+class TestWindowCount(StatementsRecorded):
+    class WG(Grid):
+        window_count = True
+        per_page = 2
+        Column('First Name', Person.firstname, TextFilter)
+
+        def query_prep(self, query, has_sort, has_filters):
+            return query.add_columns(Person.id).order_by(Person.id)
+
+    @classmethod
+    def setup_class(cls):
+        Status.delete_cascaded()
+        for x in range(5):
+            Person.testing_create('fn{0}'.format(x))
+
+    def test_one_round_trip(self):
+        g = self.WG()
+        g.set_paging(2, 2)
+        eq_(g.record_count, 5)
+        eq_([r.firstname for r in g.records], ['fn2', 'fn3'])
+        eq_(len(self.statements), 1)
+        assert 'count(*) OVER ()' in self.statements[0]
+
+    def test_window_column_stripped(self):
+        g = self.WG()
+        record = g.records[0]
+        eq_(record.keys(), ['firstname', 'id'])
+        eq_(len(record), 2)
+
+    def test_single_entity(self):
+        class WG(self.WG):
+            def query_base(self, has_sort, has_filters):
+                return self.manager.sa_query(Person)
+
+            def query_prep(self, query, has_sort, has_filters):
+                return query.order_by(Person.id)
+
+        g = WG()
+        assert isinstance(g.records[0], Person)
+        eq_(g.record_count, 5)
+
+    def test_empty_first_page(self):
+        g = self.WG()
+        g.set_filter('firstname', 'eq', 'nobody')
+        eq_(g.records, [])
+        eq_(g.record_count, 0)
+        eq_(len(self.statements), 1)
+
+    def test_page_past_the_end(self):
+        g = self.WG()
+        g.set_paging(2, 10)
+        eq_([r.firstname for r in g.records], ['fn4'])
+        eq_(g.on_page, 3)
+        eq_(g.record_count, 5)
+        # empty page, separate count, then the last page
+        eq_(len(self.statements), 3)
+
+    def test_only_when_paging(self):
+        g = self.WG()
+        g.set_paging(None, None)
+        eq_(len(g.records), 5)
+        eq_(g.record_count, 5)
+        eq_(len(self.statements), 2)
+        assert 'OVER' not in self.statements[0]
+
+
+class TestCountStrategy(object):
+    class CG(Grid):
+        count_strategy = 'capped'
+        count_cap = 3
+        Column('First Name', Person.firstname, TextFilter)
+
+    @classmethod
+    def setup_class(cls):
+        Status.delete_cascaded()
+        for x in range(5):
+            Person.testing_create('fn{0}'.format(x))
+
+    def test_exact(self):
+        g = self.CG()
+        g.count_strategy = 'exact'
+        eq_(g.record_count, 5)
+        assert g.record_count_exact
+
+    def test_capped_over_cap(self):
+        g = self.CG()
+        eq_(g.record_count, 4)
+        eq_(g.record_count_kind, 'capped')
+        assert not g.record_count_exact
+
+    def test_capped_under_cap(self):
+        g = self.CG()
+        g.set_filter('firstname', 'contains', 'fn1')
+        eq_(g.record_count, 1)
+        eq_(g.record_count_kind, 'exact')
+
+    def test_capped_query(self):
+        g = self.CG()
+        query = g.build_query(for_count=True).limit(g.count_cap + 1)
+        assert_in_query(query, 'LIMIT 4')
+
+    def test_estimated_uses_dialect_hook(self):
+        class EG(self.CG):
+            count_strategy = 'estimated'
+
+            def estimate_count_sqlite(self, query):
+                return 1000
+
+        g = EG()
+        eq_(g.record_count, 1000)
+        eq_(g.record_count_kind, 'estimated')
+        eq_(g.page_count, 20)
+
+    def test_estimated_falls_back_to_capped(self):
+        class EG(self.CG):
+            count_strategy = 'estimated'
+
+        g = EG()
+        eq_(g.record_count, 4)
+        eq_(g.record_count_kind, 'capped')
+
+        # small estimates are counted
+        EG.estimate_count_sqlite = lambda self, query: 2
+        g = EG()
+        eq_(g.record_count, 4)
+        eq_(g.record_count_kind, 'capped')
+
+    def test_explain_postgresql(self):
+        query = db.session.query(Person.id).filter(Person.account_type == AccountType.admin)
+        sql = str(_Explain(query.statement, 'FORMAT JSON').compile(dialect=postgresql.dialect()))
+        assert sql.startswith('EXPLAIN (FORMAT JSON) SELECT persons.id'), sql
+        assert 'persons.account_type = %(account_type_1)s' in sql, sql
+
+    def test_explain_binds_processed(self):
+        # the enum parameter is only usable after its type's bind processing
+        query = db.session.query(Person.id).filter(Person.account_type == AccountType.admin)
+        assert db.session.connection().execute(_Explain(query.statement)).fetchall()
+
+    def test_clear_record_cache_resets_kind(self):
+        g = self.CG()
+        assert not g.record_count_exact
+        g.set_filter('firstname', 'eq', 'fn1')
+        assert g.record_count_exact
+
+    @inrequest('/foo?perpage=1&onpage=100')
+    def test_qs_onpage_not_clamped_when_inexact(self):
+        g = self.CG()
+        g.apply_qs_args()
+        eq_(g.on_page, 100)
+
+
+class TestTotalsRoundTrips(StatementsRecorded):
+    class TG(Grid):
+        subtotals = 'all'
+        per_page = 2
+        Column('First Name', Person.firstname, TextFilter)
+        Column('Numeric', Person.numericcol, has_subtotal=True)
+        Column('Float', Person.floatcol, has_subtotal='avg')
+
+        def query_prep(self, query, has_sort, has_filters):
+            return query.order_by(Person.id)
+
+    @classmethod
+    def setup_class(cls):
+        Status.delete_cascaded()
+        Person.testing_create(numericcol=1, floatcol=1)
+        Person.testing_create(numericcol=2, floatcol=None)
+        Person.testing_create(numericcol=3, floatcol=3)
+        Person.testing_create(numericcol=4, floatcol=5)
+
+    def test_two_round_trips(self):
+        g = self.TG()
+        eq_(g.record_count, 4)
+        eq_(len(g.records), 2)
+        eq_(g.page_totals.numericcol, 3)
+        eq_(g.page_totals.floatcol, 1)
+        eq_(g.grand_totals.numericcol, 10)
+        eq_(g.grand_totals.floatcol, 3)
+        eq_(len(self.statements), 2)
+        assert 'count(*) AS _record_count' in self.statements[0]
+
+    def test_page_totals_match_sql(self):
+        g = self.TG()
+        g.set_paging(2, 2)
+        eq_(g.page_totals, g._totals_col_results(page_totals_only=True))
+        eq_(g.page_totals.floatcol, 4)
+
+    def test_grand_totals_not_in_count(self):
+        class TG(self.TG):
+            subtotals = 'page'
+
+        g = TG()
+        g.record_count
+        assert '_record_count' not in self.statements[0]
+
+    def test_page_totals_sql_fallback(self):
+        class TG(self.TG):
+            Column('Ratio', Person.numericcol.label('ratio'),
+                   has_subtotal='sum(numericcol) / sum(floatcol)')
+
+        g = TG()
+        g.records
+        g.page_totals
+        eq_(len(self.statements), 2)
+
+    def test_filter_resets_grand_totals(self):
+        g = self.TG()
+        eq_(g.grand_totals.numericcol, 10)
+        g.set_filter('firstname', 'eq', 'nobody')
+        eq_(g.record_count, 0)
+        eq_(g.grand_totals.numericcol, None)
+
+
+class DictCache(ResultCache):
+    """ Stand-in for a shared cache backend """
+
+    def __init__(self):
+        super(DictCache, self).__init__()
+        self.data = {}
+        self.ttls = {}
+
+    def get(self, key):
+        return self.data.get(key, self.missing)
+
+    def set(self, key, value, ttl=None):
+        self.data[key] = value
+        self.ttls[key] = ttl
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class TestResultCache(StatementsRecorded):
+    class CG(Grid):
+        result_cache = MemoryCache()
+        subtotals = 'all'
+        per_page = 2
+        Column('First Name', Person.firstname, TextFilter)
+        Column('Numeric', Person.numericcol, has_subtotal=True)
+
+        def query_prep(self, query, has_sort, has_filters):
+            return query.order_by(Person.id)
+
+    @classmethod
+    def setup_class(cls):
+        Status.delete_cascaded()
+        for x in range(5):
+            Person.testing_create('fn{0}'.format(x), numericcol=x)
+
+    def setup(self):
+        self.CG.result_cache.clear()
+        self.CG.result_cache.reset_stats()
+        super(TestResultCache, self).setup()
+
+    def render_values(self, g):
+        return (
+            g.record_count, [r.firstname for r in g.records],
+            g.page_totals.numericcol, g.grand_totals.numericcol
+        )
+
+    def test_hit(self):
+        eq_(self.render_values(self.CG()), (5, ['fn0', 'fn1'], 1, 10))
+        eq_(len(self.statements), 2)
+        eq_(self.CG.result_cache.stats, {'hits': 0, 'misses': 2})
+
+        eq_(self.render_values(self.CG()), (5, ['fn0', 'fn1'], 1, 10))
+        eq_(len(self.statements), 2)
+        eq_(self.CG.result_cache.stats, {'hits': 2, 'misses': 2})
+
+    def test_keyed_on_params(self):
+        g = self.CG()
+        g.set_filter('firstname', 'eq', 'fn1')
+        eq_(g.record_count, 1)
+
+        g = self.CG()
+        g.set_filter('firstname', 'eq', 'fn2')
+        eq_([r.firstname for r in g.records], ['fn2'])
+        eq_(self.CG.result_cache.hits, 0)
+
+        g = self.CG()
+        g.set_paging(2, 2)
+        eq_([r.firstname for r in g.records], ['fn2', 'fn3'])
+        eq_(self.CG.result_cache.hits, 0)
+
+    def test_invalidate(self):
+        self.CG().records
+        self.CG.invalidate_cache()
+        self.CG().records
+        eq_(len(self.statements), 2)
+        eq_(self.CG.result_cache.stats, {'hits': 0, 'misses': 2})
+
+    def test_invalidate_is_per_grid(self):
+        class OtherGrid(self.CG):
+            pass
+
+        self.CG().records
+        OtherGrid.invalidate_cache()
+        self.CG().records
+        eq_(self.CG.result_cache.hits, 1)
+
+    @mock.patch('webgrid.cache.time')
+    def test_ttl(self, m_time):
+        m_time.time.return_value = 1000
+        self.CG().records
+        m_time.time.return_value = 1000 + self.CG.cache_ttl
+        self.CG().records
+        eq_(len(self.statements), 2)
+
+    def test_unpaged_records_not_cached(self):
+        g = self.CG()
+        g.set_paging(None, None)
+        eq_(len(g.records), 5)
+        eq_(self.CG.result_cache.stats, {'hits': 0, 'misses': 0})
+
+    def test_window_count(self):
+        class WG(self.CG):
+            window_count = True
+            subtotals = 'none'
+
+        eq_(WG().record_count, 5)
+        eq_(WG().record_count, 5)
+        eq_(len(self.statements), 1)
+
+    def test_shared_backend(self):
+        class SG(self.CG):
+            result_cache = DictCache()
+            cache_ttl = 60
+
+        eq_(self.render_values(SG()), (5, ['fn0', 'fn1'], 1, 10))
+        eq_(self.render_values(SG()), (5, ['fn0', 'fn1'], 1, 10))
+        eq_(len(self.statements), 2)
+        eq_(SG.result_cache.stats, {'hits': 2, 'misses': 2})
+        eq_(set(SG.result_cache.ttls.values()), {None, 60})
+
+
+class TestMemoryCache(object):
+    def test_lru(self):
+        cache = MemoryCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        eq_(cache.get('a'), 1)
+        cache.set('c', 3)
+        eq_(len(cache), 2)
+        assert cache.get('b') is cache.missing
+        eq_(cache.get('a'), 1)
+        eq_(cache.get('c'), 3)
+
+    def test_fetch_counts(self):
+        cache = MemoryCache()
+        eq_(cache.fetch('ns', 'k', lambda: 1), 1)
+        eq_(cache.fetch('ns', 'k', lambda: 2), 1)
+        eq_(cache.stats, {'hits': 1, 'misses': 1})
+        cache.invalidate('ns')
+        eq_(cache.fetch('ns', 'k', lambda: 3), 3)
+
+    def test_caches_none(self):
+        cache = MemoryCache()
+        cache.fetch('ns', 'k', lambda: None)
+        eq_(cache.fetch('ns', 'k', lambda: 1), None)
+
+
+class TestIterRecords(object):
+    class IG(Grid):
+        Column('First Name', Person.firstname, TextFilter)
+
+        def query_prep(self, query, has_sort, has_filters):
+            return query.order_by(Person.id)
+
+    @classmethod
+    def setup_class(cls):
+        Status.delete_cascaded()
+        for x in range(5):
+            Person.testing_create('fn{0}'.format(x))
+
+    def test_paged(self):
+        g = self.IG(per_page=2)
+        eq_([r.firstname for r in g.iter_records()], ['fn0', 'fn1'])
+        assert g._records is not None
+
+    def test_unpaged_streams(self):
+        g = self.IG()
+        g.set_paging(None, None)
+        yield_per = sa.orm.Query.yield_per
+        with mock.patch.object(sa.orm.Query, 'yield_per', autospec=True,
+                               side_effect=yield_per) as m_yield_per:
+            records = g.iter_records(batch_size=2)
+            eq_([r.firstname for r in records], ['fn0', 'fn1', 'fn2', 'fn3', 'fn4'])
+        eq_(m_yield_per.call_args[0][1], 2)
+        assert g._records is None
+
+    def test_uses_fetched_records(self):
+        g = self.IG()
+        g.set_paging(None, None)
+        g.set_records([1, 2])
+        eq_(list(g.iter_records()), [1, 2])
+
+
+class TestColumnProjection(object):
+    class PG(Grid):
+        column_projection = True
+        Column('First Name', Person.firstname, TextFilter)
+        Column('Last Name', Person.lastname, TextFilter, render_in='xls')
+        Column('Sort Order', Person.sortorder, render_in='xls')
+        Column('State', Person.state, render_in='xlsx')
+
+    @classmethod
+    def setup_class(cls):
+        Status.delete_cascaded()
+        Status.testing_create('pending')
+        Status.testing_create('in process')
+        Person.testing_create('fn0', status=Status.testing_create('complete'))
+        Person.testing_create('fn1')
+
+    def select_clause(self, g):
+        return query_to_str(g.build_query()).split('FROM')[0]
+
+    def test_html(self):
+        select = self.select_clause(self.PG())
+        assert 'persons.firstname' in select
+        assert 'persons.sortorder' not in select
+        assert 'persons.state' not in select
+
+    def test_export_target(self):
+        g = self.PG()
+        g.set_export_to('xls')
+        select = self.select_clause(g)
+        assert 'persons.sortorder' in select
+        assert 'persons.state' not in select
+
+        g.set_render_target('xlsx')
+        select = self.select_clause(g)
+        assert 'persons.sortorder' not in select
+        assert 'persons.state' in select
+
+    def test_sort_and_filter_columns(self):
+        g = self.PG()
+        g.set_sort('sortorder')
+        g.set_filter('lastname', 'eq', 'foo')
+        select = self.select_clause(g)
+        assert 'persons.sortorder' in select
+        assert 'persons.last_name' in select
+        assert 'persons.state' not in select
+
+    def test_subtotal_columns(self):
+        class PG(self.PG):
+            Column('Float', Person.floatcol, render_in='xls', has_subtotal=True)
+
+        assert 'persons.floatcol' in self.select_clause(PG())
+
+    def test_projection_off(self):
+        class PG(self.PG):
+            column_projection = False
+
+        select = self.select_clause(PG())
+        assert 'persons.sortorder' in select
+        assert 'persons.state' in select
+
+    @inrequest('/')
+    def test_off_by_default(self):
+        # a link reading a column that's only rendered in exports
+        class PG(Grid):
+            Column('ID', Person.id, render_in='xls')
+            FirstNameColumn('First Name', Person.firstname)
+
+        Person.testing_create('fn0')
+        g = PG()
+        assert 'persons.id' in self.select_clause(g)
+        assert '/person-edit/{0}'.format(g.records[0].id) in g.html()
+
+    def test_export(self):
+        g = PeopleGrid()
+        g.set_export_to('xlsx')
+        g.xlsx.build_sheet()
+        eq_(g.render_target, 'xlsx')
+
+
+class TestRowMode(StatementsRecorded):
+    class RG(Grid):
+        row_mode = True
+        per_page = 2
+        Column('First Name', Person.firstname, TextFilter)
+        Column('Status', Status.label.label('status'))
+
+        def query_prep(self, query, has_sort, has_filters):
+            return query.add_columns(Person.id).add_entity(Person) \
+                .outerjoin(Person.status).order_by(Person.id)
+
+    @classmethod
+    def setup_class(cls):
+        Status.delete_cascaded()
+        Person.testing_create('fn0', status=Status.testing_create('in process'))
+        for x in range(1, 5):
+            Person.testing_create('fn{0}'.format(x))
+
+    def test_records_are_tuples(self):
+        g = self.RG()
+        record = g.records[0]
+        eq_(tuple(record), ('fn0', 'in process', record.id))
+        eq_(record.keys(), ['firstname', 'status', 'id'])
+        assert 'persons.createdts' not in self.statements[0]
+
+    def test_positional_extraction(self):
+        g = self.RG()
+        record = g.records[0]
+        eq_(record._row_positions, {'firstname': 0, 'status': 1, 'id': 2})
+        eq_(g.column('status').extract_data(record), 'in process')
+        eq_(g.column('firstname').render('html', record), 'fn0')
+
+    def test_no_identity_map(self):
+        db.session.expunge_all()
+        self.RG().records
+        eq_(len(db.session.identity_map), 0)
+
+    def test_needs_entity(self):
+        class PersonEmailsColumn(Column):
+            needs_entity = True
+
+            def extract_data(self, record):
+                return ', '.join(e.email for e in record.Person.emails)
+
+        class RG(self.RG):
+            PersonEmailsColumn('Emails')
+
+        g = RG()
+        record = g.records[0]
+        assert isinstance(record.Person, Person)
+        eq_(g.columns[-1].extract_data(record), '')
+
+    def test_batch_loads(self):
+        class RG(self.RG):
+            EmailsColumn('Emails')
+
+        g = RG()
+        record = g.records[0]
+        assert not isinstance(record, Person)
+        eq_(g.columns[-1].extract_data(record), '')
+
+    def test_window_count(self):
+        class RG(self.RG):
+            window_count = True
+
+        g = RG()
+        g.set_paging(2, 2)
+        eq_([r.firstname for r in g.records], ['fn2', 'fn3'])
+        eq_(g.record_count, 5)
+        eq_(g.records[0]._row_positions, {'firstname': 0, 'status': 1, 'id': 2})
+        eq_(len(self.statements), 1)
+
+    def test_streamed(self):
+        g = self.RG()
+        g.set_paging(None, None)
+        records = list(g.iter_records(batch_size=2))
+        eq_([r.firstname for r in records], ['fn0', 'fn1', 'fn2', 'fn3', 'fn4'])
+        assert not isinstance(records[0], Person)
+
+    def test_html(self):
+        self.RG().html()
+
+    def test_duplicate_columns(self):
+        # Core selects persons.id once, the later columns keep their positions
+        class RG(Grid):
+            row_mode = True
+            Column('ID', Person.id)
+            Column('First Name', Person.firstname)
+
+            def query_prep(self, query, has_sort, has_filters):
+                return query.add_columns(Person.id, Person.lastname, Person.state) \
+                    .order_by(Person.id)
+
+        person = Person.query.order_by(Person.id).first()
+        for window_count in (False, True):
+            g = RG(per_page=2)
+            g.window_count = window_count
+            record = g.records[0]
+            eq_(record._row_positions, {'id': 0, 'firstname': 1, 'lastname': 2, 'state': 3})
+            eq_((record.id, record.lastname, record.state),
+                (person.id, person.lastname, person.state))
+
+    @inrequest('/')
+    def test_keyset_html(self):
+        class PG(PeopleGrid):
+            row_mode = True
+            keyset_key = Person.id
+
+        PG().html()
+
+
+class TestConcurrentQueries(object):
+    @classmethod
+    def setup_class(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.manager = FileDBManager(path.join(cls.tmpdir, 'grid.db'))
+        for x in range(5):
+            cls.manager.session.add(Person(firstname='fn{0}'.format(x), numericcol=x, floatcol=x))
+        cls.manager.session.commit()
+
+        class CG(Grid):
+            manager = cls.manager
+            concurrent_queries = 4
+            subtotals = 'all'
+            per_page = 2
+            Column('First Name', Person.firstname, TextFilter)
+            Column('Numeric', Person.numericcol, has_subtotal=True)
+            Column('Ratio', Person.floatcol.label('ratio'),
+                   has_subtotal='sum(numericcol) / sum(ratio)')
+
+            def query_prep(self, query, has_sort, has_filters):
+                return query.order_by(Person.id)
+        cls.CG = CG
+
+    @classmethod
+    def teardown_class(cls):
+        cls.manager.session.close()
+        cls.manager.engine.dispose()
+        shutil.rmtree(cls.tmpdir)
+
+    def setup(self):
+        self.threads = set()
+        self.statements = 0
+        sa.event.listen(self.manager.engine, 'before_cursor_execute', self.record_thread)
+
+    def teardown(self):
+        sa.event.remove(self.manager.engine, 'before_cursor_execute', self.record_thread)
+
+    def record_thread(self, *args):
+        self.threads.add(threading.current_thread().ident)
+        self.statements += 1
+
+    def render_values(self, g):
+        return (
+            g.record_count, [r.firstname for r in g.records],
+            g.page_totals.numericcol, g.grand_totals.numericcol
+        )
+
+    @inrequest('/')
+    def test_concurrent(self):
+        g = self.CG()
+        g.build()
+        # count with grand totals, records, and page totals, all on pool threads
+        eq_(self.statements, 3)
+        assert threading.current_thread().ident not in self.threads
+        eq_(self.render_values(g), (5, ['fn0', 'fn1'], 1, 10))
+
+    @inrequest('/')
+    def test_matches_sequential(self):
+        class CG(self.CG):
+            concurrent_queries = None
+
+        g = CG()
+        g.build()
+        eq_(self.threads, {threading.current_thread().ident})
+        eq_(self.render_values(g), (5, ['fn0', 'fn1'], 1, 10))
+
+    @inrequest('/')
+    def test_window_count(self):
+        class CG(self.CG):
+            window_count = True
+
+        g = CG()
+        eq_([task.__name__ for task in g.query_tasks()],
+            ['records', 'page_totals', 'grand_totals'])
+        g.build()
+        eq_(self.render_values(g), (5, ['fn0', 'fn1'], 1, 10))
+
+    @inrequest('/')
+    def test_records_usable(self):
+        class CG(self.CG):
+            def query_prep(self, query, has_sort, has_filters):
+                return query.add_entity(Person).order_by(Person.id)
+
+        g = CG()
+        g.build()
+        # the worker's session isn't collected while the grid is in use
+        gc.collect()
+        eq_(g.records[0].Person.emails, [])
+        # the lazy load checked out a connection on this thread, give it back
+        sa.orm.object_session(g.records[0].Person).close()
+
+    @inrequest('/')
+    def test_error_raised(self):
+        class CG(self.CG):
+            def fetch_page_totals(self):
+                raise ValueError('totals')
+
+        g = CG()
+        try:
+            g.build()
+            assert False
+        except ValueError as e:
+            eq_(str(e), 'totals')
+
+    @inrequest('/')
+    def test_fallback(self):
+        class CG(Grid):
+            concurrent_queries = 4
+            Column('First Name', Person.firstname)
+
+        # the in-memory test database can't be used from other threads
+        assert CG.manager.concurrent_session_factory() is None
+        g = CG()
+        g.build()
+        assert g._records is None
+
+
+class TestConcurrentFlaskManager(object):
+    """ Concurrent queries with the Flask manager, on a file-backed database """
+    @classmethod
+    def setup_class(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.app = flask.Flask(__name__)
+        cls.app.config['SQLALCHEMY_DATABASE_URI'] = \
+            'sqlite:///' + path.join(cls.tmpdir, 'grid.db')
+        cls.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        cls.app.secret_key = 'only-testing'
+        db.init_app(cls.app)
+        with cls.app.app_context():
+            db.create_all()
+            session = sa.orm.Session(bind=db.get_engine())
+            for x in range(5):
+                session.add(Person(firstname='fn{0}'.format(x), numericcol=x))
+            session.commit()
+            session.close()
+
+        class CG(Grid):
+            manager = WebGrid(db)
+            concurrent_queries = 2
+            per_page = 2
+            Column('First Name', Person.firstname, TextFilter)
+            Column('Numeric', Person.numericcol)
+
+            def query_prep(self, query, has_sort, has_filters):
+                return query.add_entity(Person).order_by(Person.id)
+        cls.CG = CG
+
+    @classmethod
+    def teardown_class(cls):
+        with cls.app.app_context():
+            db.get_engine().dispose()
+        shutil.rmtree(cls.tmpdir)
+
+    def test_build(self):
+        threads = set()
+
+        def record_thread(*args):
+            threads.add(threading.current_thread().ident)
+
+        with self.app.test_request_context('/'):
+            engine = db.get_engine()
+            sa.event.listen(engine, 'before_cursor_execute', record_thread)
+            try:
+                g = self.CG()
+                g.build()
+            finally:
+                sa.event.remove(engine, 'before_cursor_execute', record_thread)
+            assert threading.current_thread().ident not in threads
+            eq_(g.record_count, 5)
+            eq_([r.firstname for r in g.records], ['fn0', 'fn1'])
+            # the worker's app context didn't close the records' session
+            eq_(g.records[0].Person.emails, [])
+            sa.orm.object_session(g.records[0].Person).close()
+
+
+class TestQueryReuse(object):
+    class QG(Grid):
+        result_cache = MemoryCache()
+        Column('First Name', Person.firstname, TextFilter)
+        Column('Numeric', Person.numericcol)
+
+    def setup(self):
+        query_stats.reset()
+        self.QG.result_cache.clear()
+
+    def test_same_state(self):
+        g = self.QG()
+        assert g.build_query() is g.build_query()
+        assert g.build_query(for_count=True) is g.build_query(for_count=True)
+        assert g.build_query() is not g.build_query(for_count=True)
+        eq_(query_stats.builds, 2)
+        eq_(query_stats.build_reuses, 4)
+
+    def test_state_changes(self):
+        g = self.QG()
+        query = g.build_query()
+        # filters set by apply_qs_args() don't go through set_filter()
+        g.column('firstname').filter.set('eq', 'foo')
+        filtered = g.build_query()
+        assert filtered is not query
+        g.column('firstname').filter.set('eq', 'bar')
+        assert g.build_query() is not filtered
+        g.on_page = 2
+        assert_in_query(g.build_query(), 'OFFSET 50')
+
+    def test_filter_state_changes(self):
+        # the same value, but a date alone matches the whole day
+        class QG(self.QG):
+            Column('Created', Person.createdts, DateTimeFilter)
+
+        g = QG()
+        g.set_filter('createdts', 'eq', '2020-01-01')
+        assert_in_query(g.build_query(), 'BETWEEN')
+        g.set_filter('createdts', 'eq', '2020-01-01 00:00')
+        assert_not_in_query(g.build_query(), 'BETWEEN')
+        assert_in_query(g.build_query(), 'persons.createdts = ')
+
+    def test_shape_key(self):
+        g1 = self.QG()
+        g1.set_filter('firstname', 'eq', 'foo')
+        g2 = self.QG()
+        g2.set_filter('firstname', 'eq', 'bar')
+        eq_(g1.query_shape_key(), g2.query_shape_key())
+        assert g1.query_values_key() != g2.query_values_key()
+
+        g2.set_filter('firstname', 'contains', 'bar')
+        assert g1.query_shape_key() != g2.query_shape_key()
+        g2.set_filter('firstname', 'eq', 'foo')
+        g2.set_sort('numericcol')
+        assert g1.query_shape_key() != g2.query_shape_key()
+        # sorting does not change the count query
+        eq_(g1.query_shape_key(for_count=True), g2.query_shape_key(for_count=True))
+
+    def test_compiled_once(self):
+        g = self.QG()
+        g.records
+        g.records
+        g.clear_record_cache()
+        g.records
+        eq_(query_stats.compiles, 1)
+        eq_(query_stats.compile_reuses, 1)
+        summary = query_stats.summary['compile']
+        eq_(summary['count'], 1)
+        assert summary['saved_seconds'] > 0
+
+
+class TestLeanCount(StatementsRecorded):
+    @classmethod
+    def setup_class(cls):
+        Status.delete_cascaded()
+        status = Status.testing_create()
+        cls.status_id = status.id
+        Person.testing_create('fn1', status=status)
+        Person.testing_create('fn2', lastname='same')
+        Person.testing_create('fn3', lastname='same')
+
+    def count_sql(self, g):
+        self.statements[:] = []
+        g.record_count
+        eq_(len(self.statements), 1)
+        return self.statements[0]
+
+    def test_people_grid(self):
+        g = PeopleGrid()
+        sql = self.count_sql(g)
+        eq_(g.record_count, 3)
+        assert sql.startswith('SELECT count(*)'), sql
+        assert 'statuses' not in sql
+        assert 'ORDER BY' not in sql
+        assert '(SELECT' not in sql
+
+    def test_join_kept_for_filter(self):
+        g = PeopleGrid()
+        g.set_filter('status', 'is', [self.status_id])
+        sql = self.count_sql(g)
+        eq_(g.record_count, 1)
+        assert 'LEFT OUTER JOIN statuses' in sql
+
+    def test_join_kept_without_declaration(self):
+        class PG(PeopleGrid):
+            count_prunable_joins = ()
+
+        sql = self.count_sql(PG())
+        assert 'LEFT OUTER JOIN statuses' in sql
+        assert 'ORDER BY' not in sql
+
+    def test_capped(self):
+        class PG(PeopleGrid):
+            count_strategy = 'capped'
+            count_cap = 1
+
+        g = PG()
+        sql = self.count_sql(g)
+        eq_(g.record_count, 2)
+        assert 'statuses' not in sql
+        assert 'LIMIT' in sql
+
+    def test_distinct_counts_rows(self):
+        class DG(Grid):
+            Column('Last Name', Person.lastname)
+
+            def query_prep(self, query, has_sort, has_filters):
+                return query.distinct()
+
+        g = DG()
+        sql = self.count_sql(g)
+        eq_(g.record_count, 2)
+        assert 'DISTINCT' in sql
+
+
+class TestWorkloadRouting(object):
+    """ Two SQLite files stand in for a primary database and a read replica """
+    @classmethod
+    def setup_class(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.replica = sa.create_engine(
+            'sqlite:///{0}'.format(path.join(cls.tmpdir, 'replica.db')),
+            poolclass=sa.pool.QueuePool, connect_args={'check_same_thread': False}
+        )
+        db.Model.metadata.create_all(cls.replica)
+        cls.replica.execute(Person.__table__.insert(), [
+            {'firstname': 'replica{0}'.format(x), 'numericcol': 10} for x in range(5)
+        ])
+        cls.primary = FileDBManager(path.join(cls.tmpdir, 'primary.db'))
+        cls.primary.engine.execute(Person.__table__.insert(), [
+            {'firstname': 'primary{0}'.format(x), 'numericcol': 1} for x in range(3)
+        ])
+
+    @classmethod
+    def teardown_class(cls):
+        cls.primary.session.close()
+        cls.primary.engine.dispose()
+        cls.replica.dispose()
+        shutil.rmtree(cls.tmpdir)
+
+    def grid(self, **workload_binds):
+        manager = FileDBManager(path.join(self.tmpdir, 'primary.db'), workload_binds=dict(
+            (workload, self.replica) for workload in workload_binds
+        ))
+        self.managers.append(manager)
+
+        class RG(Grid):
+            subtotals = 'grand'
+            Column('First Name', Person.firstname)
+            Column('Numeric', Person.numericcol, has_subtotal=True)
+
+            def query_prep(self, query, has_sort, has_filters):
+                return query.order_by(Person.id)
+        RG.manager = manager
+        return RG()
+
+    def setup(self):
+        self.managers = []
+
+    def teardown(self):
+        for manager in self.managers:
+            manager.remove_workload_sessions()
+            manager.session.close()
+            manager.engine.dispose()
+
+    def test_not_routed(self):
+        g = self.grid()
+        eq_(g.record_count, 3)
+        eq_(g.grand_totals.numericcol, 3)
+        eq_(len(g.records), 3)
+
+    def test_count_routed(self):
+        g = self.grid(count=True)
+        # grand totals come with the exact count
+        eq_(g.record_count, 5)
+        eq_(g.grand_totals.numericcol, 50)
+        eq_(g.records[0].firstname, 'primary0')
+
+    def test_page_routed(self):
+        g = self.grid(page=True)
+        eq_(g.record_count, 3)
+        eq_([r.firstname for r in g.records][:2], ['replica0', 'replica1'])
+
+    def test_totals_routed(self):
+        g = self.grid(totals=True)
+        eq_(g.grand_totals.numericcol, 50)
+        eq_(g.record_count, 3)
+
+    def test_export_routed(self):
+        g = self.grid(export=True)
+        eq_(g.records[0].firstname, 'primary0')
+        g.set_paging(None, None)
+        g.set_render_target('csv')
+        eq_(g.record_count, 5)
+        eq_(len(list(g.iter_records())), 5)
+        eq_(g.grand_totals.numericcol, 50)
+
+    @inrequest('/')
+    def test_concurrent(self):
+        g = self.grid(count=True)
+        g.concurrent_queries = 2
+        g.run_queries()
+        eq_(g.record_count, 5)
+        eq_(len(g.records), 3)
+        # the replica session used on the pool thread was committed
+        eq_(self.replica.pool.checkedout(), 0)
+
+
+class TestQueryBudgets(object):
+    # a budget the queries can't meet
+    spent = 0.000001
+
+    @classmethod
+    def setup_class(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.manager = FileDBManager(path.join(cls.tmpdir, 'grid.db'))
+        cls.manager.engine.execute(Person.__table__.insert(), [
+            {'firstname': 'fn{0:04d}'.format(x), 'numericcol': 1} for x in range(3000)
+        ])
+
+        class BG(Grid):
+            manager = cls.manager
+            subtotals = 'grand'
+            per_page = 10
+            Column('First Name', Person.firstname, TextFilter)
+            Column('Numeric', Person.numericcol, has_subtotal=True)
+
+            def query_prep(self, query, has_sort, has_filters):
+                return query.order_by(Person.id)
+        cls.BG = BG
+
+    @classmethod
+    def teardown_class(cls):
+        cls.manager.session.close()
+        cls.manager.engine.dispose()
+        shutil.rmtree(cls.tmpdir)
+
+    def setup(self):
+        query_stats.reset()
+
+    def grid(self, **budgets):
+        g = self.BG()
+        g.query_budgets = budgets
+        return g
+
+    @inrequest('/')
+    def test_within_budget(self):
+        g = self.grid(count=60, page=60, totals=60)
+        eq_(g.record_count, 3000)
+        eq_(g.record_count_kind, 'exact')
+        eq_(g.grand_totals.numericcol, 3000)
+        eq_(len(g.records), 10)
+        eq_(g.budgets_exceeded, set())
+        eq_(query_stats.timeouts, {})
+
+    @inrequest('/')
+    def test_count_estimated(self):
+        g = self.grid(count=self.spent)
+        g.set_paging(10, 3)
+        eq_(g.record_count, 31)
+        eq_(g.record_count_kind, 'estimated')
+        eq_(g.budgets_exceeded, {'count'})
+        eq_(query_stats.timeouts, {'count': 1})
+        eq_(g.user_warnings,
+            ['Counting the records took too long, the count shown is approximate.'])
+        eq_(flask.get_flashed_messages(with_categories=True),
+            [('warning', 'Counting the records took too long, the count shown is approximate.')])
+        # the session can still be used
+        eq_(g.grand_totals.numericcol, 3000)
+
+    @inrequest('/')
+    def test_totals_hidden(self):
+        g = self.grid(totals=self.spent)
+        g.count_strategy = 'capped'
+        assert g.grand_totals is None
+        assert g.grand_totals is None
+        eq_(query_stats.timeouts, {'totals': 1})
+        html = g.html.table()
+        assert 'fn0009' in html
+        assert 'Grand Totals' not in html
+
+    @inrequest('/')
+    def test_page_raises(self):
+        g = self.grid(page=self.spent)
+        g.set_paging(None, None)
+        try:
+            g.records
+            assert False, 'expected QueryBudgetExceeded'
+        except QueryBudgetExceeded as e:
+            eq_(e.phase, 'page')
+
+    @inrequest('/')
+    def test_export_deferred(self):
+        g = self.grid(export=self.spent)
+        g.allowed_export_targets = {'csv': CSV}
+        g.set_renderers()
+        g.set_paging(10, 2)
+        g.export_to = 'csv'
+        assert g.export_as_response() is None
+        eq_(g.export_to, None)
+        eq_(g.render_target, 'html')
+        eq_((g.per_page, g.on_page), (10, 2))
+        eq_(query_stats.timeouts, {'export': 1})
+        eq_(g.records[0].firstname, 'fn0010')
+
+    @inrequest('/')
+    def test_export_count_unknown(self):
+        g = self.grid(export=self.spent)
+        g.allowed_export_targets = {'csv': CSV}
+        g.set_renderers()
+        g.set_export_to('csv')
+        # as the exporters do
+        g.set_paging(None, None)
+        assert g.record_count is None
+        eq_(g.record_count_kind, 'unknown')
+        # the count isn't retried, and the streamed records weren't fetched to count them
+        assert g.record_count is None
+        eq_(query_stats.timeouts, {'export': 1})
+        assert g._records is None
+
+    def test_postgresql_timeout_restored(self):
+        connection = mock.Mock()
+        connection.execute.return_value.scalar.return_value = '30s'
+        with self.BG().limit_query_time_postgresql(connection, 'count', 2):
+            pass
+        statements = [str(call[0][0]) for call in connection.execute.call_args_list]
+        eq_(statements, [
+            'SHOW statement_timeout',
+            'SET LOCAL statement_timeout = 2000',
+            "SELECT set_config('statement_timeout', :previous, true)",
+        ])
+        eq_(connection.execute.call_args[1], {'previous': '30s'})
+        connection.begin_nested.return_value.commit.assert_called_once_with()
+
+    def test_postgresql_timeout_restored_on_error(self):
+        class Canceled(Exception):
+            pgcode = '57014'
+
+        errors = (
+            (ValueError('render'), ValueError),
+            (GeneratorExit(), GeneratorExit),
+            (sa_exc.OperationalError('SELECT', {}, Canceled()), QueryBudgetExceeded),
+        )
+        for error, raised in errors:
+            connection = mock.Mock()
+            connection.execute.return_value.scalar.return_value = '30s'
+            try:
+                with self.BG().limit_query_time_postgresql(connection, 'count', 2):
+                    raise error
+                assert False, 'expected {0}'.format(raised.__name__)
+            except raised:
+                pass
+            savepoint = connection.begin_nested.return_value
+            savepoint.rollback.assert_called_once_with()
+            assert not savepoint.commit.called
+            eq_(connection.execute.call_args[1], {'previous': '30s'})
+
+    @inrequest('/')
+    def test_concurrent_warnings_flashed(self):
+        g = self.grid(count=self.spent)
+        g.concurrent_queries = 2
+        g.run_queries()
+        eq_(g.record_count_kind, 'estimated')
+        eq_(len(flask.get_flashed_messages()), 1)
+
+
+class TestPrefetch(object):
+    @classmethod
+    def setup_class(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.manager = FileDBManager(path.join(cls.tmpdir, 'grid.db'))
+        cls.manager.engine.execute(Person.__table__.insert(), [
+            {'firstname': 'fn{0:02d}'.format(x)} for x in range(25)
+        ])
+
+    @classmethod
+    def teardown_class(cls):
+        cls.manager.session.close()
+        cls.manager.engine.dispose()
+        shutil.rmtree(cls.tmpdir)
+
+    def setup(self):
+        class PG(Grid):
+            manager = self.manager
+            prefetch_next_page = True
+            result_cache = MemoryCache()
+            per_page = 10
+            Column('First Name', Person.firstname)
+
+            def query_prep(self, query, has_sort, has_filters):
+                return query.order_by(Person.id)
+        self.PG = PG
+        self.statements = 0
+        sa.event.listen(self.manager.engine, 'before_cursor_execute', self.count_statement)
+
+    def teardown(self):
+        sa.event.remove(self.manager.engine, 'before_cursor_execute', self.count_statement)
+
+    def count_statement(self, *args):
+        self.statements += 1
+
+    def render(self, on_page):
+        g = self.PG()
+        g.set_paging(10, on_page)
+        g.html()
+        if g.prefetch_future is not None:
+            g.prefetch_future.result()
+        return g
+
+    @inrequest('/')
+    def test_next_page_cached(self):
+        g = self.render(1)
+        assert g.prefetch_future is not None
+        statements = self.statements
+
+        g = self.PG()
+        g.set_paging(10, 2)
+        eq_(g.records[0].firstname, 'fn10')
+        eq_(self.statements, statements)
+        eq_(self.PG.result_cache.stats['hits'], 1)
+
+    @inrequest('/')
+    def test_not_past_last_page(self):
+        g = self.render(2)
+        assert g.prefetch_future is not None
+        g = self.render(3)
+        assert g.prefetch_future is None
+
+    @inrequest('/')
+    def test_already_cached(self):
+        self.render(1)
+        statements = self.statements
+        g = self.render(1)
+        # count and records are cached, and prefetching found the next page cached
+        eq_(self.statements, statements)
+        assert g.prefetch_future is not None
+
+    @inrequest('/')
+    def test_workers_limit(self):
+        executor, running = self.PG.prefetch_pool()
+        for x in range(self.PG.prefetch_workers):
+            running.acquire()
+        try:
+            g = self.render(1)
+            assert g.prefetch_future is None
+        finally:
+            for x in range(self.PG.prefetch_workers):
+                running.release()
+
+    @inrequest('/')
+    def test_evicted(self):
+        self.render(1)
+        self.PG.invalidate_cache()
+        g = self.PG()
+        g.set_paging(10, 2)
+        eq_(g.records[0].firstname, 'fn10')
+        eq_(self.PG.result_cache.stats['hits'], 0)
+
+    @inrequest('/')
+    def test_off(self):
+        self.PG.prefetch_next_page = False
+        g = self.render(1)
+        assert g.prefetch_future is None
+
+
+class TestBatchLoading(StatementsRecorded):
+    class EG(Grid):
+        per_page = 3
+        Column('First Name', Person.firstname)
+        EmailsColumn('Emails')
+
+        def query_prep(self, query, has_sort, has_filters):
+            return query.add_columns(Person.id).order_by(Person.id)
+
+    @classmethod
+    def setup_class(cls):
+        Status.delete_cascaded()
+        Status.testing_create('in process')
+        for x in range(5):
+            person = Person.testing_create('fn{0}'.format(x))
+            for y in range(x % 3):
+                person.emails.append(Email(email='fn{0}.{1}@example.com'.format(x, y)))
+        db.session.commit()
+
+    def emails_statements(self):
+        return [stmt for stmt in self.statements if 'FROM emails' in stmt]
+
+    def test_page_loaded_once(self):
+        g = self.EG()
+        col = g.columns[-1]
+        eq_([col.extract_data(r) for r in g.records],
+            ['', 'fn1.0@example.com', 'fn2.0@example.com, fn2.1@example.com'])
+        eq_(len(self.emails_statements()), 1)
+        assert 'IN (?, ?, ?)' in self.emails_statements()[0]
+
+    def test_html(self):
+        g = self.EG()
+        g.set_paging(3, 2)
+        assert 'fn4.0@example.com' in g.html()
+        # records and emails, the count of 5 comes from the records query's window
+        eq_(len(self.emails_statements()), 1)
+        eq_(len(self.statements), 3)
+
+    def test_reloaded_with_records(self):
+        g = self.EG()
+        g.columns[-1].extract_data(g.records[0])
+        g.set_paging(3, 2)
+        eq_(g.columns[-1].extract_data(g.records[1]), 'fn4.0@example.com')
+        eq_(len(self.emails_statements()), 2)
+
+    def test_streamed_in_batches(self):
+        g = self.EG()
+        g.set_paging(None, None)
+        col = g.columns[-1]
+        values = [col.extract_data(r) for r in g.iter_records(batch_size=2)]
+        eq_(values[2], 'fn2.0@example.com, fn2.1@example.com')
+        eq_(values[4], 'fn4.0@example.com')
+        eq_(len(self.emails_statements()), 3)
+
+    def test_not_rendered(self):
+        class EG(Grid):
+            Column('First Name', Person.firstname)
+            EmailsColumn('Emails', render_in='xls')
+
+            def query_prep(self, query, has_sort, has_filters):
+                return query.add_columns(Person.id)
+
+        g = EG()
+        g.set_paging(None, None)
+        list(g.iter_records())
+        eq_(self.emails_statements(), [])
+
+
+class TestFacetCounts(StatementsRecorded):
+    class FG(Grid):
+        facet_counts_on = True
+        Column('First Name', Person.firstname, TextFilter)
+        Column('Status', Status.label.label('status'), StatusFilter(Status.id))
+        Column('Account Type', Person.account_type,
+               OptionsEnumFilter(Person.account_type, enum_type=AccountType))
+
+        def query_prep(self, query, has_sort, has_filters):
+            return query.outerjoin(Person.status)
+
+    @classmethod
+    def setup_class(cls):
+        Status.delete_cascaded()
+        cls.open = Status.testing_create('open').id
+        cls.closed = Status.testing_create('closed').id
+        for firstname, status, account_type in (
+            ('fn0', cls.open, AccountType.admin),
+            ('fn1', cls.open, AccountType.employee),
+            ('fn2', cls.closed, AccountType.employee),
+            ('fn3', None, AccountType.employee),
+            ('gn4', cls.closed, None),
+        ):
+            Person.testing_create(firstname, status_id=status, account_type=account_type)
+
+    def facet_statements(self):
+        return [stmt for stmt in self.statements if 'GROUP BY' in stmt]
+
+    def test_unfiltered(self):
+        g = self.FG()
+        eq_(g.facet_counts(), {
+            'status': {self.open: 2, self.closed: 2, None: 1},
+            'account_type': {'admin': 1, 'employee': 3, None: 1},
+        })
+        # a grouped count per filter on SQLite
+        eq_(len(self.facet_statements()), 2)
+
+    def test_other_filters_applied(self):
+        g = self.FG()
+        g.set_filter('firstname', 'contains', 'fn')
+        g.set_filter('status', 'is', [self.open])
+        counts = g.facet_counts()
+        # the status counts leave out the status filter
+        eq_(counts['status'], {self.open: 2, self.closed: 1, None: 1})
+        eq_(counts['account_type'], {'admin': 1, 'employee': 1})
+
+    def test_off(self):
+        g = self.FG()
+        g.facet_counts_on = False
+        assert g.facet_counts_for(g.column('status').filter) is None
+        g.html()
+        eq_(self.facet_statements(), [])
+
+    @inrequest('/')
+    def test_rendered(self):
+        g = self.FG()
+        g.set_filter('firstname', 'contains', 'fn')
+        html = g.html.filtering_col_inputs1(g.column('account_type'))
+        assert '>Admin (1)</option>' in html
+        assert '>Employee (3)</option>' in html
+        assert '>Manager (0)</option>' in html
+
+    def test_cached(self):
+        class FG(self.FG):
+            result_cache = MemoryCache()
+
+        FG().facet_counts()
+        FG().facet_counts()
+        eq_(len(self.facet_statements()), 2)
+        eq_(FG.result_cache.stats, {'hits': 2, 'misses': 2})
+
+
+class TestSearchAll(object):
+    class SG(Grid):
+        search_all_on = True
+        Column('First Name', Person.firstname,
+               FullTextFilter(Person.firstname, fts_table='persons_fts'))
+        Column('Last Name', Person.lastname,
+               FullTextFilter(Person.lastname, mode='trigram', fts_table='persons_trgm'))
+        Column('ID', Person.id, IntFilter)
+
+    @classmethod
+    def setup_class(cls):
+        Status.delete_cascaded()
+        Person.testing_create('Ada Grace', lastname='Lovelace')
+        Person.testing_create('Grace', lastname='Hopper')
+        Person.testing_create('Alan', lastname='Turing')
+        grid = cls.SG()
+        for key in ('firstname', 'lastname'):
+            for stmt in grid.column(key).filter.index_ddl('sqlite'):
+                db.session.execute(stmt)
+
+    @classmethod
+    def teardown_class(cls):
+        db.session.execute('DROP TABLE persons_fts')
+        db.session.execute('DROP TABLE persons_trgm')
+
+    def names(self, grid):
+        return sorted(record.firstname for record in grid.records)
+
+    def test_fts_filters(self):
+        g = self.SG()
+        g.set_filter('firstname', 'search', 'grace')
+        eq_(self.names(g), ['Ada Grace', 'Grace'])
+
+        g = self.SG()
+        g.set_filter('firstname', 'search', 'ada grace')
+        eq_(self.names(g), ['Ada Grace'])
+
+        g = self.SG()
+        g.set_filter('lastname', 'search', 'ring')
+        eq_(self.names(g), ['Alan'])
+
+    def test_search_all(self):
+        g = self.SG()
+        g.set_search('ace')
+        assert g.has_filters
+        # "ace" isn't a whole first name, but is in "Lovelace"
+        eq_(self.names(g), ['Ada Grace'])
+
+        g = self.SG()
+        g.set_search('hopper')
+        eq_(g.record_count, 1)
+
+    def test_search_all_off(self):
+        g = self.SG()
+        g.search_all_on = False
+        g.set_search('hopper')
+        assert not g.has_filters
+        eq_(g.record_count, 3)
+
+    def test_grand_totals_follow_search(self):
+        class SG(self.SG):
+            subtotals = 'grand'
+            Column('Number', Person.numericcol, has_subtotal=True)
+
+        Person.query.filter_by(firstname='Alan').update({'numericcol': 5})
+        Person.query.filter_by(firstname='Grace').update({'numericcol': 2})
+        g = SG()
+        g.set_search('turing')
+        eq_(g.record_count, 1)
+        eq_(g.grand_totals.numericcol, 5)
+        g.set_search('hopper')
+        eq_(g.grand_totals.numericcol, 2)
+
+    @inrequest('/?search=turing')
+    def test_qs_arg(self):
+        g = self.SG()
+        g.apply_qs_args()
+        eq_(g.search_value, 'turing')
+        eq_(self.names(g), ['Alan'])
+        assert 'name="search" type="text" value="turing"' in g.html()
+
+    @inrequest('/?search=grace')
+    def test_qs_arg_session(self):
+        class SG(self.SG):
+            session_on = True
+
+        g = SG()
+        g.apply_qs_args()
+        eq_(self.names(g), ['Ada Grace', 'Grace'])
+        # a new search replaces the one stored in the session
+        flask.request.args = MultiDict([('search', 'turing')])
+        g = SG()
+        g.apply_qs_args()
+        eq_(g.search_value, 'turing')
+        eq_(self.names(g), ['Alan'])
+        # without one, the stored search is used
+        flask.request.args = MultiDict()
+        g = SG()
+        g.apply_qs_args()
+        eq_(g.search_value, 'turing')
+
+
+class SearchableStatusFilter(StatusFilter):
+    searchable = True
+    search_limit = 2
+
+
+class TestSearchableOptions(StatementsRecorded):
+    class SG(Grid):
+        Column('Status', Status.label.label('status'), SearchableStatusFilter(Status.id))
+        Column('First Name', Person.firstname, TextFilter)
+
+        def query_prep(self, query, has_sort, has_filters):
+            return query.outerjoin(Person.status)
+
+    @classmethod
+    def setup_class(cls):
+        cls.SG.manager.register_grid(cls.SG)
+        Status.delete_cascaded()
+        cls.statuses = {label: Status.testing_create(label).id
+                        for label in ('open', 'opened', 'on_hold', 'closed')}
+
+    def url(self, column_key='status', **args):
+        return self.SG.manager.options_url(self.SG, column_key) + '?' + urlencode(args)
+
+    def test_values_checked_in_database(self):
+        g = self.SG()
+        g.set_filter('status', 'is', [str(self.statuses['open']), '9999', 'foo'])
+        eq_(g.column('status').filter.value1, [self.statuses['open']])
+        eq_(g.column('status').filter.options_seq, [(self.statuses['open'], 'open')])
+        # neither the type guess nor the check loaded every option
+        assert not [stmt for stmt in self.statements
+                    if 'FROM statuses' in stmt and 'LIMIT' not in stmt and 'IN' not in stmt]
+
+    @inrequest('/')
+    def test_rendered(self):
+        g = self.SG()
+        g.set_filter('status', 'is', [str(self.statuses['closed'])])
+        html = g.html.filtering_col_inputs1(g.column('status'))
+        assert 'data-options-url="/webgrid/options/{0}.SG/status"'.format(__name__) in html
+        assert '>closed</option>' in html
+        assert '>open</option>' not in html
+
+    def test_large_value_list_checked(self):
+        class Filter(SearchableStatusFilter):
+            in_list_threshold = 1
+
+        filter = Filter(Status.id).new_instance(dialect=db.engine.dialect)
+        filter.set('is', [str(self.statuses['open']), str(self.statuses['closed']), '9999'])
+        eq_(sorted(filter.value1), sorted([self.statuses['open'], self.statuses['closed']]))
+        assert [stmt for stmt in self.statements if 'json_each' in stmt]
+
+    @inrequest('/')
+    def test_endpoint_denied(self):
+        client = flask.current_app.test_client()
+        eq_(client.get(self.url(q='o')).status_code, 403)
+
+    @inrequest('/')
+    @mock.patch.object(WebGrid, 'options_allowed', return_value=True)
+    def test_endpoint(self, m_allowed):
+        client = flask.current_app.test_client()
+        resp = client.get(self.url(q='o'))
+        eq_(resp.status_code, 200)
+        eq_(resp.get_json(), {'options': [
+            {'value': self.statuses['on_hold'], 'label': 'on_hold'},
+            {'value': self.statuses['open'], 'label': 'open'},
+        ]})
+        resp = client.get(self.url(q='OPENE', limit=5))
+        eq_([option['label'] for option in resp.get_json()['options']], ['opened'])
+        # wildcards in the search are matched literally
+        resp = client.get(self.url(q='o_'))
+        eq_(resp.get_json()['options'], [])
+        resp = client.get(self.url(q='on_'))
+        eq_([option['label'] for option in resp.get_json()['options']], ['on_hold'])
+
+    @inrequest('/')
+    @mock.patch.object(WebGrid, 'options_allowed', return_value=True)
+    def test_endpoint_not_found(self, m_allowed):
+        client = flask.current_app.test_client()
+        eq_(client.get(self.url('firstname', q='o')).status_code, 404)
+        eq_(client.get('/webgrid/options/foo.Grid/status').status_code, 404)
+
+
 class TestQueryStringArgs(object):
 
     @classmethod
@@ -1,3 +1,18 @@
+import base64
+import binascii
+import datetime as dt
+from decimal import Decimal as D
+import enum
+import json
+
+from dateutil.parser import parse as parse_date
+
+try:
+    import arrow
+except ImportError:
+    arrow = None
+
+
 def current_url(manager, root_only=False, host_only=False, strip_querystring=False,
                 strip_host=False, https=None):
     """
@@ -47,3 +62,80 @@ def current_url(manager, root_only=False, host_only=False, strip_querystring=Fal
             retval = retval.replace('https://', 'http://', 1)
 
     return retval
+
+
+def _cursor_value_dump(value):
+    # JSON has no date or decimal types, so tag those values with their type so they can be
+    # restored to something the SQLAlchemy column types will bind
+    if arrow is not None and isinstance(value, arrow.Arrow):
+        value = value.datetime
+    if isinstance(value, dt.datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, dt.date):
+        return {'d': value.isoformat()}
+    if isinstance(value, dt.time):
+        return {'t': value.isoformat()}
+    if isinstance(value, D):
+        return {'D': str(value)}
+    if isinstance(value, enum.Enum):
+        return {'e': value.name}
+    return value
+
+
+def _cursor_value_load(value):
+    if not isinstance(value, dict):
+        return value
+    tag, raw = list(value.items())[0]
+    if tag == 'dt':
+        return parse_date(raw)
+    if tag == 'd':
+        return parse_date(raw).date()
+    if tag == 't':
+        return parse_date(raw).time()
+    if tag == 'D':
+        return D(raw)
+    if tag == 'e':
+        return raw
+    raise ValueError('unrecognized cursor value tag: {}'.format(tag))
+
+
+def encode_cursor(sort_keys, values, direction):
+    """
+    Serialize keyset paging state to an opaque, URL-safe string.
+
+    :param sort_keys: list of (column key, flag_desc) tuples the values were taken with
+    :param values: the seek values, in sort order, with the tiebreaker last
+    :param direction: 'n' to seek to the rows after the values, 'p' for the rows before them
+    """
+    payload = {
+        's': [list(sk) for sk in sort_keys],
+        'v': [_cursor_value_dump(v) for v in values],
+        'd': direction,
+    }
+    data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Reverse of `encode_cursor()`. Returns a dict with sort_keys, values, and direction.
+
+    Raises ValueError when the token can not be decoded.
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        direction = payload['d']
+        if direction not in ('n', 'p'):
+            raise ValueError('unrecognized cursor direction: {}'.format(direction))
+        # one value per sort key, plus the tiebreaker
+        if len(payload['v']) != len(payload['s']) + 1:
+            raise ValueError('cursor values do not match its sort keys')
+        return {
+            'sort_keys': [tuple(sk) for sk in payload['s']],
+            'values': [_cursor_value_load(v) for v in payload['v']],
+            'direction': direction,
+        }
+    except (TypeError, KeyError, IndexError, AttributeError, UnicodeError,
+            binascii.Error) as e:
+        raise ValueError('invalid cursor: {}'.format(e))
@@ -3,7 +3,7 @@ from webgrid import BaseGrid as BaseGrid, Column, LinkColumnBase, \
     YesNoColumn, DateTimeColumn, DateColumn, NumericColumn, EnumColumn
 from webgrid.filters import TextFilter, OptionsFilterBase, Operator, \
     DateTimeFilter, ops, OptionsEnumFilter
-from .model.entities import ArrowRecord, Person, Status, AccountType
+from .model.entities import ArrowRecord, Email, Person, Status, AccountType
 
 from .app import webgrid
 from webgrid.renderers import CSV
@@ -28,8 +28,21 @@ class FullNameColumn(LinkColumnBase):
 
 
 class EmailsColumn(Column):
-    def extract_data(self, recordset):
-        return ', '.join([e.email for e in recordset.Person.emails])
+    batch_loads = True
+
+    def batch_key(self, record):
+        return record.id
+
+    def load_batch(self, person_ids):
+        emails = {}
+        query = self.grid.related_query(Email.person_id, Email.email) \
+            .filter(Email.person_id.in_(person_ids)).order_by(Email.id)
+        for person_id, email in query:
+            emails.setdefault(person_id, []).append(email)
+        return emails
+
+    def extract_data(self, record):
+        return ', '.join(self.batch_value(record, []))
 
 
 class StatusFilter(OptionsFilterBase):
@@ -46,6 +59,7 @@ class StatusFilter(OptionsFilterBase):
 
 class PeopleGrid(Grid):
     session_on = True
+    count_prunable_joins = (Status,)
 
     FirstNameColumn(_('First Name'), Person.firstname, TextFilter)
     FullNameColumn(_('Full Name'))